@@ -0,0 +1,332 @@
+"""
+Benchmark suite of the generator and analysis hot paths.
+
+Each stage runs in its own process on synthetic data and reports wall time, CPU time,
+peak resident memory and throughput as JSON. Results can be stored as a baseline and
+later runs compared against it with a regression threshold. The startup time of
+main.py is also checked against a budget.
+
+Usage:
+    python benchmarks/run_benchmarks.py --scale small --out results.json
+    python benchmarks/run_benchmarks.py --scale small --baseline baseline.json --save-baseline
+    python benchmarks/run_benchmarks.py --scale small --baseline baseline.json --threshold 0.25
+    python benchmarks/run_benchmarks.py --stages startup --startup-budget 0.5
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import SCALES, lagtimes, metastable_segments, write_colvar_files
+
+STAGES = ['startup', 'read_colvar', 'load_npy', 'clustering', 'generate_model', 'load_models', 'pcca', 'tpt']
+
+def _peak_rss_mb() -> float:
+    """
+    Peak resident set size of the current process in MB (ru_maxrss is in kB on Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+def _n_jobs() -> int:
+    return os.cpu_count() or 1
+
+# data preparation (not timed)
+
+def prepare(scale_name: str, workdir: str):
+    """
+    Generate the inputs of every stage in the working directory: COLVAR files, trajectory,
+    centers, discretized trajectory, MSMs and PCCA+ assignments. Inputs are reused if already present.
+    """
+    from src.tools import Trajectory, save_file_pkl, save_file_npy
+    from src.generator import generate_centers_dtraj, generate_model
+    from src.analysis import pcca_assign_centers
+
+    scale = SCALES[scale_name]
+    if os.path.exists(os.path.join(workdir, 'ready')):
+        return
+
+    segments = metastable_segments(scale['n_frames'], scale['n_cvs'], scale['n_segments'], scale['n_wells'])
+    write_colvar_files(segments, os.path.join(workdir, 'colvar'))
+    traj = Trajectory(segments)
+    save_file_npy(traj, os.path.join(workdir, 'traj.npy'))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        centers, dtraj = generate_centers_dtraj(traj, scale['n_centers'], n_jobs=_n_jobs())
+        models = generate_model(dtraj, lagtimes(scale))
+        assignments = pcca_assign_centers(models[len(models)//2], centers, scale['n_wells'])
+    save_file_pkl(centers, os.path.join(workdir, 'centers.pkl'))
+    save_file_npy(dtraj, os.path.join(workdir, 'dtraj.npy'))
+    save_file_pkl(models, os.path.join(workdir, 'models.pkl'))
+    save_file_pkl(assignments, os.path.join(workdir, 'assignments.pkl'))
+
+    open(os.path.join(workdir, 'ready'), 'w').close()
+
+# stages: each setup loads the inputs and returns the timed function, which returns the number of processed units
+
+# program starts measured by the startup stage
+STARTUP_RUNS = 5
+
+def setup_startup(workdir: str, scale: dict):
+    input_file = os.path.join(workdir, 'empty.in')
+    with open(input_file, 'w') as file:
+        file.write('# no commands\n')
+    command = [sys.executable, os.path.join(ROOT, 'main.py'), '-i', input_file]
+    def run():
+        for _ in range(STARTUP_RUNS):
+            subprocess.run(command, cwd=workdir, capture_output=True, check=True)
+        return STARTUP_RUNS
+    return run, 'starts/s'
+
+def _load(workdir: str, name: str, type):
+    from src.tools import load_file
+    with contextlib.redirect_stdout(io.StringIO()):
+        return load_file(os.path.join(workdir, name), type)
+
+def setup_read_colvar(workdir: str, scale: dict):
+    from src.generator import generate_trajectory
+    columns = list(range(1, scale['n_cvs'] + 1))
+    def run():
+        traj = generate_trajectory(os.path.join(workdir, 'colvar'), columns=columns, n_jobs=_n_jobs())
+        return sum(len(segment) for segment in traj)
+    return run, 'frames/s'
+
+def setup_load_npy(workdir: str, scale: dict):
+    from src.tools import Trajectory
+    def run():
+        traj = _load(workdir, 'traj.npy', Trajectory)
+        # memory-mapped segments are read when accessed
+        return sum(len(segment) for segment in traj if segment.sum() is not None)
+    return run, 'frames/s'
+
+def setup_clustering(workdir: str, scale: dict):
+    from src.tools import Trajectory
+    from src.generator import generate_centers_dtraj
+    traj = Trajectory([segment.copy() for segment in _load(workdir, 'traj.npy', Trajectory)])
+    def run():
+        generate_centers_dtraj(traj, scale['n_centers'], n_jobs=_n_jobs())
+        return sum(len(segment) for segment in traj)
+    return run, 'frames/s'
+
+def setup_generate_model(workdir: str, scale: dict):
+    from src.tools import DTrajectory
+    from src.generator import generate_model
+    dtraj = DTrajectory([segment.copy() for segment in _load(workdir, 'dtraj.npy', DTrajectory)])
+    lags = lagtimes(scale)
+    def run():
+        generate_model(dtraj, lags)
+        return sum(len(segment) for segment in dtraj)*len(lags)
+    return run, 'frame-lagtimes/s'
+
+def setup_load_models(workdir: str, scale: dict):
+    from src.tools import Models
+    # deeptime is imported on first use: the import is not part of the stage
+    import deeptime.markov.msm
+    def run():
+        return len(list(_load(workdir, 'models.pkl', Models)))
+    return run, 'models/s'
+
+def setup_pcca(workdir: str, scale: dict):
+    from src.tools import Models, Centers
+    from src.analysis import pcca_assign_centers
+    models = _load(workdir, 'models.pkl', Models)
+    centers = _load(workdir, 'centers.pkl', Centers)
+    model = models[len(models)//2]
+    def run():
+        pcca_assign_centers(model, centers, scale['n_wells'])
+        return model.n_states
+    return run, 'microstates/s'
+
+def setup_tpt(workdir: str, scale: dict):
+    import pickle
+    from src.tools import Models
+    from src.analysis import TPTkinetic_analysis
+    models = _load(workdir, 'models.pkl', Models)
+    model = models[len(models)//2]
+    with open(os.path.join(workdir, 'assignments.pkl'), 'rb') as file:
+        assignments = pickle.load(file)
+    def run():
+        pairs = 0
+        for a in range(len(assignments)):
+            for b in range(a + 1, len(assignments)):
+                TPTkinetic_analysis(model, a, b, assignments, 1.0)
+                pairs += 1
+        return pairs
+    return run, 'macrostate pairs/s'
+
+def run_stage(stage: str, scale_name: str, workdir: str) -> dict:
+    """
+    Run a stage in the current process and measure it.
+    """
+    scale = SCALES[scale_name]
+    run, unit = globals()['setup_' + stage](workdir, scale)
+    input_rss = _peak_rss_mb()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        wall, cpu = time.perf_counter(), time.process_time()
+        units = run()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    return {'wall_s': wall, 'cpu_s': cpu, 'peak_rss_mb': _peak_rss_mb(), 'input_rss_mb': input_rss,
+            'throughput': units/wall if wall > 0 else float('inf'), 'throughput_unit': unit}
+
+# driver
+
+def _subprocess(arguments: list) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''), MPLBACKEND='Agg')
+    return subprocess.run([sys.executable, os.path.abspath(__file__)] + arguments, env=env,
+                          capture_output=True, text=True)
+
+def run_suite(scale_name: str, stages: list, workdir: str) -> dict:
+    """
+    Prepare the data and run every stage in its own process.
+    """
+    import numpy
+    import deeptime
+
+    print('Preparing {} data in {}'.format(scale_name, workdir))
+    process = _subprocess(['--prepare', '--scale', scale_name, '--workdir', workdir])
+    if process.returncode != 0:
+        raise RuntimeError('Data preparation failed:\n' + process.stderr)
+
+    results = {'scale': scale_name, 'parameters': SCALES[scale_name],
+               'platform': {'python': platform.python_version(), 'numpy': numpy.__version__,
+                            'deeptime': deeptime.__version__, 'machine': platform.machine(), 'cpus': _n_jobs()},
+               'stages': {}}
+
+    for stage in stages:
+        with tempfile.NamedTemporaryFile(suffix='.json') as result_file:
+            process = _subprocess(['--worker', stage, '--scale', scale_name, '--workdir', workdir,
+                                   '--result', result_file.name])
+            if process.returncode != 0:
+                print('{:<16} FAILED'.format(stage))
+                results['stages'][stage] = {'error': process.stderr.strip().splitlines()[-1] if process.stderr else 'failed'}
+                continue
+            with open(result_file.name) as file:
+                results['stages'][stage] = json.load(file)
+
+        stage_result = results['stages'][stage]
+        print('{:<16} {:>9.3f} s {:>9.1f} MB {:>12.4g} {}'.format(stage, stage_result['wall_s'], stage_result['peak_rss_mb'],
+                                                                   stage_result['throughput'], stage_result['throughput_unit']))
+
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare results with a baseline of the same scale.
+    Stages failing in the new run are regressions.
+
+    Returns
+    -------
+    list
+        Regressions as (stage, metric, baseline value, new value)
+    """
+    regressions = []
+    reference = baseline.get(results['scale'], {}).get('stages', {})
+    print('\nComparison with baseline (threshold {:.0%}):'.format(threshold))
+    for stage, result in results['stages'].items():
+        if 'error' in result:
+            print('{:<16} {:<12} {}'.format(stage, 'error', 'REGRESSION ({})'.format(result['error'])))
+            regressions.append((stage, 'error', None, result['error']))
+            continue
+        if stage not in reference or 'error' in reference[stage]:
+            continue
+        for metric in ('wall_s', 'peak_rss_mb'):
+            old, new = reference[stage][metric], result[metric]
+            ratio = new/old if old > 0 else 1.0
+            flag = 'REGRESSION' if ratio > 1 + threshold else ''
+            print('{:<16} {:<12} {:>10.3f} -> {:>10.3f} ({:+.1%}) {}'.format(stage, metric, old, new, ratio - 1, flag))
+            if flag:
+                regressions.append((stage, metric, old, new))
+
+    return regressions
+
+def check_startup(results: dict, budget: float) -> bool:
+    """
+    Check the mean startup time of main.py against a budget.
+
+    Returns
+    -------
+    bool
+        True if the startup time exceeds the budget or the startup stage failed
+    """
+    result = results['stages'].get('startup')
+    if result is None:
+        return False
+    if 'error' in result:
+        print('\nStartup stage failed: {}'.format(result['error']))
+        return True
+    startup = result['wall_s']/STARTUP_RUNS
+    print('\nStartup time {:.3f} s (budget {:.3f} s){}'.format(startup, budget, ' EXCEEDED' if startup > budget else ''))
+    return startup > budget
+
+def main():
+    parser = argparse.ArgumentParser(description='MSManalysis benchmark suite.')
+    parser.add_argument('--scale', choices=list(SCALES), default='small', help='Data scale. Default is small.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help='Stages to run. Default is all.')
+    parser.add_argument('--workdir', default=None, help='Directory of the synthetic data. Default is a temporary directory.')
+    parser.add_argument('--out', default=None, help='Output JSON file of the results.')
+    parser.add_argument('--baseline', default=None, help='Baseline JSON file to compare with (or to save with --save-baseline).')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Relative regression threshold. Default is 0.25.')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as baseline for their scale.')
+    parser.add_argument('--startup-budget', type=float, default=1.0, help='Startup time budget of main.py in seconds. Default is 1.0.')
+    # internal
+    parser.add_argument('--prepare', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.prepare:
+        os.makedirs(args.workdir, exist_ok=True)
+        prepare(args.scale, args.workdir)
+        return
+
+    if args.worker is not None:
+        result = run_stage(args.worker, args.scale, args.workdir)
+        with open(args.result, 'w') as file:
+            json.dump(result, file)
+        return
+
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory(prefix='msm_bench_'))
+        results = run_suite(args.scale, args.stages, workdir)
+
+    if args.out is not None:
+        with open(args.out, 'w') as file:
+            json.dump(results, file, indent=2)
+        print('\nResults saved in {}.'.format(args.out))
+
+    over_budget = check_startup(results, args.startup_budget)
+
+    if args.baseline is not None:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+
+        if args.save_baseline:
+            baseline[args.scale] = results
+            with open(args.baseline, 'w') as file:
+                json.dump(baseline, file, indent=2)
+            print('\nBaseline saved in {}.'.format(args.baseline))
+        elif compare(results, baseline, args.threshold):
+            print('\nPerformance regressions found!')
+            sys.exit(1)
+
+    failed = [stage for stage, result in results['stages'].items() if 'error' in result]
+    if failed:
+        print('\nFailed stages: {}'.format(', '.join(failed)))
+    if over_budget or failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
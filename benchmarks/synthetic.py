@@ -0,0 +1,97 @@
+"""
+Synthetic data for benchmarks: metastable trajectories in a multi-well landscape, written as COLVAR files
+"""
+import os
+import numpy as np
+from scipy.signal import lfilter
+
+from typing import List
+
+# benchmark scales: frames x CV dimension x microstates x lagtimes
+SCALES = {
+    'small':  {'n_frames': 100000,   'n_cvs': 2, 'n_segments': 4,  'n_centers': 50,   'n_lagtimes': 5,  'n_wells': 3},
+    'medium': {'n_frames': 1000000,  'n_cvs': 3, 'n_segments': 8,  'n_centers': 200,  'n_lagtimes': 10, 'n_wells': 4},
+    'large':  {'n_frames': 10000000, 'n_cvs': 4, 'n_segments': 16, 'n_centers': 1000, 'n_lagtimes': 20, 'n_wells': 5},
+}
+
+def lagtimes(scale: dict) -> np.ndarray:
+    """
+    Lagtimes (in steps) of a benchmark scale.
+
+    Parameters
+    ----------
+    scale : dict
+        Benchmark scale
+
+    Returns
+    -------
+    np.ndarray
+        Logarithmically spaced lagtimes
+    """
+
+    return np.unique(np.geomspace(1, 200, scale['n_lagtimes']).astype(int))
+
+def metastable_segments(n_frames: int, n_cvs: int, n_segments: int, n_wells: int, seed: int = 0,
+                        switch_probability: float = 1e-3) -> List[np.ndarray]:
+    """
+    Generate trajectory segments jumping between Gaussian wells.
+    The well is a Markov chain switching with a small probability per frame, frames are
+    an AR(1) process around the well center: the discretized dynamics has a few slow processes.
+
+    Parameters
+    ----------
+    n_frames : int
+        Total number of frames
+    n_cvs : int
+        Number of collective variables
+    n_segments : int
+        Number of segments
+    n_wells : int
+        Number of wells
+    seed : int, optional
+        Random seed, by default 0
+    switch_probability : float, optional
+        Probability per frame of jumping to another well, by default 1e-3
+
+    Returns
+    -------
+    List[np.ndarray]
+        Trajectory segments with shape (n_frames/n_segments, n_cvs)
+    """
+
+    rng = np.random.default_rng(seed)
+    wells = rng.uniform(-5, 5, size=(n_wells, n_cvs))
+    length = n_frames//n_segments
+
+    segments = []
+    for _ in range(n_segments):
+        jumps = rng.random(length) < switch_probability
+        steps = np.where(jumps, rng.integers(1, n_wells, size=length), 0)
+        states = (rng.integers(n_wells) + np.cumsum(steps)) % n_wells
+
+        # AR(1) fluctuations around the well centers
+        noise = rng.normal(scale=0.5, size=(length, n_cvs))
+        fluctuations = lfilter([1.0], [1.0, -0.9], noise, axis=0)
+
+        segments.append(wells[states] + 0.3*fluctuations)
+
+    return segments
+
+def write_colvar_files(segments: List[np.ndarray], directory: str):
+    """
+    Write trajectory segments as PLUMED-like COLVAR files (time in the first column).
+
+    Parameters
+    ----------
+    segments : List[np.ndarray]
+        Trajectory segments
+    directory : str
+        Output directory
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    for i, segment in enumerate(segments):
+        fields = ' '.join('cv{}'.format(j+1) for j in range(segment.shape[1]))
+        data = np.column_stack([np.arange(len(segment)), segment])
+        np.savetxt(os.path.join(directory, 'COLVAR.{:03d}'.format(i)), data, fmt='%.6f',
+                   header='! FIELDS time {}'.format(fields))
@@ -22,4 +22,7 @@ for n_centers in centers_array:
     MSM.generate_centers_dtraj(n_centers=n_centers)
 
     # generate and save MSMs
-    MSM.generate_model(lagtimes=lagtimes)
\ No newline at end of file
+    MSM.generate_model(lagtimes=lagtimes)
+
+# alternatively, generate the whole grid in parallel on a process pool
+# MSM.sweep(n_centers=centers_array, lagtimes=lagtimes, out_dir='sweep', n_jobs=64)
@@ -5,12 +5,16 @@ Main program execution file.
 from src.tools import starting
 starting()
 
-from src.commands import interactive_mode, input_file
-from src.commands.command_parser import execute_command
-from src.commands import InputReader
+# analysis modules are imported by the first executed command
+from src.commands import parse_main_args, execute_command
+from src.commands import InputReader, run_systems, serve
+from src.tools import wait_rendering, profiling_report
 
 def main():
 
+    main_args = parse_main_args()
+    interactive_mode = main_args.input_file is None and main_args.input_files is None and not main_args.serve
+
     if interactive_mode:
         print('\nInteractive mode is on!\n')
         print("Type 'quit' to exit.")
@@ -20,9 +24,26 @@ def main():
         command_line = input("> ")
         execute_command(command_line.split())
 
+    # server mode
+    if main_args.serve:
+        serve(host=main_args.host, port=main_args.port, socket_file=main_args.socket_file)
+        return
+
+    # multi-system mode
+    if main_args.input_files is not None:
+        run_systems(main_args.input_files, n_workers=main_args.n_workers, log_dir=main_args.log_dir,
+                    summary_file=main_args.summary_file, scheduled=main_args.batch, n_jobs=main_args.n_jobs,
+                    chdir=main_args.chdir)
+        return
+
     # input file mode
-    reader = InputReader(input_file=input_file)
-    reader.read_and_execute()
+    reader = InputReader(input_file=main_args.input_file)
+    if main_args.batch:
+        reader.read_and_schedule(n_jobs=main_args.n_jobs)
+    else:
+        reader.read_and_execute()
+    wait_rendering()
+    profiling_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
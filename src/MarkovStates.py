@@ -1,18 +1,26 @@
 """
 Main module for the MSM analysis
 """
+import os
+import json
 import numpy as np
-from typing import Optional, Union, List
+import scipy.sparse
+from typing import Optional, Union, List, Tuple
 
-from .tools import load_file, save_file_pkl
+from .tools import load_file, save_file_pkl, save_file_npy, save_file_npz
 from .tools import get_center_infos, check_models_centers
 from .tools import Models, Centers, Trajectory, DTrajectory
 from .tools import MissingAttribute
+from .tools import ResultCache, file_digest, cached
 
-from src.analysis import its_plot, choose_model, ck_testing, score_analysis, pcca_assign_centers, \
-                            TPTkinetic_analysis, trajectory_plot, dtraj_plotting, mfpt
+from src.analysis import bootstrap_analysis, its_plot, choose_model, ck_testing, ck_summary, score_analysis, pcca_assign_centers, \
+                            TPTkinetic_analysis, trajectory_plot, dtraj_plotting, mfpt, mfpt_matrix_analysis, \
+                            TPTkinetic_matrix_analysis, ck_candidates
 
-from src.generator import generate_trajectory, generate_centers_dtraj, generate_model
+from deeptime.util.validation import ChapmanKolmogorovTest
+
+from src.generator import generate_trajectory, generate_centers_dtraj, generate_model, sweep_models, assign, sample_posterior, \
+                          trajectory_files, read_trajectory_files, update_models
 
 class System:
     """
@@ -42,8 +50,22 @@ class System:
         self.traj = traj
 
         self._test_model = None
-        self._assignements = None
+        self.assignements = None
         self._timestep_ns = 1e-3  # 1 ps
+        self._spectral_backend = 'dense'
+
+        # result cache and digests of the loaded files
+        self.cache = ResultCache()
+        self._digests = {}
+
+        # posterior samples of Bayesian MSMs by lagtime
+        self.posteriors = {}
+
+        # trajectory files already in the MSMs: path --> (size, modification time)
+        self.processed_files = {}
+
+        # computed kinetics: lagtime, starting and target states, MFPT (ns) and rate (s^-1)
+        self.kinetics_results = []
 
         # interactive mode
         self._interactive_mode = False
@@ -93,7 +115,7 @@ class System:
         """
         True if models exist.
         """    
-        return True if type(self.models) is Models else False
+        return True if isinstance(self.models, Models) else False
     
     @property
     def traj_exist(self):    
@@ -146,6 +168,73 @@ class System:
         self._timestep_ns = timestep
     
     
+    # spectral backend
+    @property
+    def spectral_backend(self) -> str:
+        """
+        Backend used for spectral analysis (implied timescales and PCCA+).
+
+        Returns
+        -------
+        str
+            'dense' (deeptime, full eigendecomposition) or 'sparse' (sparse matrices, only leading eigenpairs)
+        """
+        return self._spectral_backend
+
+    @spectral_backend.setter
+    def spectral_backend(self, backend: str):
+        """
+        Set the backend used for spectral analysis.
+
+        Parameters
+        ----------
+        backend : str
+            'dense' or 'sparse'
+
+        Raises
+        ------
+        ValueError
+            Raised if the backend is not known
+        """
+        if backend not in ('dense', 'sparse'):
+            raise ValueError(f"Unknown spectral backend '{backend}'. Choose between 'dense' and 'sparse'.")
+        self._spectral_backend = backend
+
+    # result cache
+    def _cache_key(self, command: str, args: tuple, kwargs: dict) -> Optional[str]:
+        """
+        Key of a command in the result cache: digest of the loaded models and centers files, of the command arguments
+        and of the analysis settings (selected lagtime, timestep, PCCA+ assignements, spectral backend and posterior samples).
+
+        Parameters
+        ----------
+        command : str
+            Command name
+        args : tuple
+            Positional arguments of the command
+        kwargs : dict
+            Keyword arguments of the command
+
+        Returns
+        -------
+        Optional[str]
+            Cache key, None if models or centers were not loaded from file
+        """
+
+        if self._digests.get('models') is None or self._digests.get('centers') is None:
+            return None
+
+        lagtime = self._lagtime if self._test_model is not None else None
+        assignements = None if self.assignements is None else [np.asarray(state).tolist() for state in self.assignements]
+
+        # posterior samples are identified by their files
+        posteriors = sorted((lt, [(file, os.stat(file).st_mtime_ns) for file in posterior['files']])
+                            for lt, posterior in self.posteriors.items())
+
+        return self.cache.key(command, args, sorted(kwargs.items()), self._digests['models'], self._digests['centers'],
+                              lagtime, self.timestep_ns, assignements, self.spectral_backend, posteriors)
+    
+    
     # info methods
     def center_infos(self):
         """
@@ -157,7 +246,7 @@ class System:
             print('No centers to analyze.')
 
     # ck_test method
-    def ck_test(self, n_sets: int = 2):
+    def ck_test(self, n_sets: int = 2, all_models: bool = False, n_jobs: Optional[int] = None, ck_tests: Optional[list] = None):
         """
         Perform the Chapman-Kolmogorov test.
 
@@ -165,15 +254,35 @@ class System:
         ----------
         n_sets : int, optional
             Number of macrostates to test, by default 2
+        all_models : bool, optional
+            If true, every loaded MSM is tested in one batch and a summary is printed instead of the plot, by default False
+        n_jobs : Optional[int], optional
+            Number of threads for the propagation, by default None
+        ck_tests : Optional[list], optional
+            Tests of the selected MSM and of its neighbour computed before (see ck_tests), by default None
 
         Raises
         ------
         MissingAttribute
             Raised if no test MSM is selected
         """
+        if all_models:
+            if self.models_exist:
+                print('\nPerforming Chapman-Kolmogorov test on all MSMs with {} metastable sets.'.format(n_sets))
+                return self._ck_summary(n_sets, n_jobs)
+            else:
+                msg = '\nNo MSMs are loaded. Please load or generate MSMs!\n'
+                if self.interactive_mode:
+                    print('Warning!', msg)
+                    return
+                else:
+                    raise MissingAttribute(message = msg)
+
         if self._test_model is not None:
             print('\nPerforming Chapman-Kolmogorov test with {} metastable sets.'.format(n_sets))
-            ck_testing(self.models, self._test_model, n_sets)
+            if ck_tests is None:
+                ck_tests = self._ck_tests(n_sets, n_jobs)
+            ck_testing(self.models, self._test_model, n_sets, n_jobs=n_jobs, ck_tests=ck_tests)
         else:
             msg = '\nNo test MSM is selected. Please select a MSM!\n'
             if self.interactive_mode:
@@ -181,17 +290,58 @@ class System:
             else:
                 raise MissingAttribute(message = msg)
 
-    # compute mfpt
-    def compute_mfpt(self, microstate_A: int, microstate_B: int):
+    def ck_tests(self, n_sets: int = 2, n_jobs: Optional[int] = None) -> Optional[list]:
         """
-        Compute mean fist passage time (in ns) and transition events in 1us between two microstate of a MSM.
+        Chapman-Kolmogorov tests drawn by ck_test, so that they can be computed before drawing them.
 
         Parameters
         ----------
-        microstate_A : int
-            Starting microstate
-        microstate_B : int
-            Target microstate
+        n_sets : int, optional
+            Number of macrostates to test, by default 2
+        n_jobs : Optional[int], optional
+            Number of threads for the propagation, by default None
+
+        Returns
+        -------
+        Optional[list]
+            Tests of the selected MSM and of its neighbour, None if no test MSM is selected
+        """
+
+        if self._test_model is not None:
+            return self._ck_tests(n_sets, n_jobs)
+
+    @cached()
+    def _ck_summary(self, n_sets: int, n_jobs: Optional[int] = None) -> dict:
+        """
+        Chapman-Kolmogorov test of all MSMs (cached).
+        """
+        return ck_summary(self.models, n_sets, n_jobs=n_jobs)
+
+    @cached()
+    def _ck_tests(self, n_sets: int, n_jobs: Optional[int] = None) -> list:
+        """
+        Chapman-Kolmogorov tests of the selected MSM and of its neighbour (cached).
+        """
+        ck_tests = ck_candidates(self.models, self._test_model, n_sets, n_jobs=n_jobs)
+        # observables refer to the MSMs and are not needed for plotting
+        return [ChapmanKolmogorovTest(ck.lagtimes, ck.predictions, [], ck.estimates, [], None) for ck in ck_tests]
+
+    @cached()
+    def compute_mfpt_matrix(self, targets: Optional[List[int]] = None, file_name: Optional[str] = None) -> np.ndarray:
+        """
+        Compute mean first passage times (in ns) from every microstate to each target microstate of the selected MSM.
+
+        Parameters
+        ----------
+        targets : Optional[List[int]], optional
+            Target microstates, by default None (all microstates)
+        file_name : Optional[str], optional
+            If provided, the MFPT matrix is saved in .npy format, by default None
+
+        Returns
+        -------
+        np.ndarray
+            Array with shape (n_microstates, n_targets) of MFPTs in ns
 
         Raises
         ------
@@ -199,17 +349,17 @@ class System:
             Raised if no test MSM is selected
         """
 
-        if self._test_model != None:
+        if self._test_model is not None:
             print('\nUsing timestep unit {:.2e} ns'.format(self._lagtime*self.timestep_ns))
-            mfpt(self._test_model, microstate_A, microstate_B, self._lagtime*self.timestep_ns)
+            return mfpt_matrix_analysis(self._test_model, self._lagtime*self.timestep_ns, targets=targets, file_name=file_name)
         else:
             msg = '\nNo test MSM is selected. Please select a MSM!\n'
             if self.interactive_mode:
                 print('Warning!', msg)
             else:
                 raise MissingAttribute(message = msg)
-    
-    def compute_TPT_kinetics(self, state_A: int, state_B: int):
+
+    def compute_TPT_kinetics(self, state_A: int, state_B: int) -> Tuple[np.ndarray, np.ndarray]:
         """
         Compute mfpt(s) (in ns) and event rates in 1us following TPT between PCCA+ assigned states from a MSM model.
         If no PCCA+ has been performed, single microstates will be used.
@@ -220,6 +370,22 @@ class System:
             Starting macrostate (or microstate)
         state_B : int
             Target macrostate (or microstate)
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            MFPTs (in ns) and rates (in s^-1): A --> B and B --> A
+        """
+
+        mfpts, rates = self._TPT_kinetics(state_A, state_B)
+        self._record_kinetics(self._lagtime, [(state_A, state_B, mfpts[0], rates[0]), (state_B, state_A, mfpts[1], rates[1])])
+
+        return mfpts, rates
+
+    @cached()
+    def _TPT_kinetics(self, state_A: int, state_B: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        TPT kinetics between two states (cached).
         """
 
         print('\nCompute TPT kinetics!')
@@ -237,11 +403,210 @@ class System:
             assigments = self.assignements
             print('\n Computing transitions between macrostate {} and {}'.format(state_A, state_B))
         
-        TPTkinetic_analysis(self._test_model, state_A, state_B, assigments, self._lagtime*self.timestep_ns)
+        return TPTkinetic_analysis(self._test_model, state_A, state_B, assigments, self._lagtime*self.timestep_ns,
+                                   posterior=self.posteriors.get(self._lagtime))
+
+    def compute_TPT_kinetics_matrix(self, all_models: bool = False, file_name: Optional[str] = None) -> np.ndarray:
+        """
+        Compute mfpt(s) (in ns) and event rates (in s^-1) following TPT between every pair of PCCA+ assigned states.
+        If no PCCA+ has been performed, single microstates will be used.
+
+        Parameters
+        ----------
+        all_models : bool, optional
+            If true, kinetics are computed with the same states for every loaded MSM with the same number of states
+            of the selected one, by default False
+        file_name : Optional[str], optional
+            If provided, rate matrices are saved in .npy format, by default None
+
+        Returns
+        -------
+        np.ndarray
+            Structured array with fields 'rate', 'mfpt' and 'flux' and shape (n_states, n_states),
+            or (n_models, n_states, n_states) if all_models is true
+
+        Raises
+        ------
+        MissingAttribute
+            Raised if no test MSM is selected
+        """
+
+        kinetics = self._TPT_kinetics_matrix(all_models=all_models, file_name=file_name)
+        if kinetics is None:
+            return
+
+        if all_models:
+            lagtimes = [model.lagtime for model in self.models if model.n_states == self._test_model.n_states]
+        else:
+            lagtimes = [self._lagtime]
+        for lagtime, matrix in zip(lagtimes, kinetics.reshape((-1,) + kinetics.shape[-2:])):
+            self._record_kinetics(lagtime, [(a, b, matrix['mfpt'][a, b], matrix['rate'][a, b])
+                                            for a in range(len(matrix)) for b in range(len(matrix)) if a != b])
+
+        return kinetics
+
+    @cached()
+    def _TPT_kinetics_matrix(self, all_models: bool = False, file_name: Optional[str] = None) -> Optional[np.ndarray]:
+        """
+        TPT kinetics between every pair of states (cached).
+        """
+
+        if self._test_model is None:
+            msg = '\nNo test MSM is selected. Please select a MSM!\n'
+            if self.interactive_mode:
+                print('Warning!', msg)
+                return
+            else:
+                raise MissingAttribute(message = msg)
+
+        print('\nCompute TPT kinetics between all states!')
+
+        # check for state assignement
+        if self.assignements is None:
+            print('\nNo PCCA+ assigments found! Continuing with microstates.')
+            assigments = [[i] for i in range(self._test_model.n_states)] # fake assigments
+        else:
+            print('Found {} PCCA+ assigments.'.format(len(self.assignements)))
+            assigments = self.assignements
+
+        if not all_models:
+            print('Using lagtime {:.2e} ns'.format(self._lagtime*self.timestep_ns))
+            return TPTkinetic_matrix_analysis(self._test_model, assigments, self._lagtime*self.timestep_ns, file_name=file_name)
+
+        kinetics = []
+        for model in self.models:
+            if model.n_states != self._test_model.n_states:
+                print('\nSkipping model with lagtime {}: different number of states.'.format(model.lagtime))
+                continue
+            print('\nUsing lagtime {:.2e} ns'.format(model.lagtime*self.timestep_ns))
+            kinetics.append(TPTkinetic_matrix_analysis(model, assigments, model.lagtime*self.timestep_ns))
+        kinetics = np.stack(kinetics)
+
+        if file_name is not None:
+            np.save(file_name, kinetics)
+            print('Rate matrices saved in {}.'.format(file_name))
+
+        return kinetics
+
+    def _record_kinetics(self, lagtime: int, transitions: List[Tuple[int, int, float, float]]):
+        """
+        Record computed kinetics for the summary of multi-system runs.
+
+        Parameters
+        ----------
+        lagtime : int
+            Lagtime of the MSM in steps
+        transitions : List[Tuple[int, int, float, float]]
+            Starting state, target state, MFPT (ns) and rate (s^-1) of each transition
+        """
+
+        for state_A, state_B, mfpt_ns, rate in transitions:
+            self.kinetics_results.append({'lagtime': int(lagtime), 'lagtime_ns': lagtime*self.timestep_ns, 'from': int(state_A),
+                                          'to': int(state_B), 'mfpt_ns': float(mfpt_ns), 'rate': float(rate)})
+
+    def bootstrap(self, n_samples: int = 1000, block_length: Optional[int] = None, confidence: float = 0.95,
+                  n_jobs: Optional[int] = None, seed: int = 0, file_name: Optional[str] = None) -> dict:
+        """
+        Compute bootstrap confidence intervals of stationary probabilities, mfpt(s) (in ns) and rates (in s^-1)
+        between PCCA+ assigned states of the selected MSM. If no PCCA+ has been performed, single microstates will be used.
+
+        Parameters
+        ----------
+        n_samples : int, optional
+            Number of bootstrap replicas, by default 1000
+        block_length : Optional[int], optional
+            Number of frames of each resampled block, by default None (segments are resampled)
+        confidence : float, optional
+            Confidence level of the intervals, by default 0.95
+        n_jobs : Optional[int], optional
+            Number of worker processes, by default None (all available cores)
+        seed : int, optional
+            Random seed, by default 0
+        file_name : Optional[str], optional
+            If provided, estimates and bootstrap samples are saved in .npz format, by default None
+
+        Returns
+        -------
+        dict
+            Estimates, bootstrap samples and confidence intervals
+
+        Raises
+        ------
+        MissingAttribute
+            Raised if no test MSM is selected or no discretized trajectory is loaded
+        """
+
+        if self._test_model is None or not self.dtraj_exist:
+            msg = '\nA selected MSM and its discretized trajectory are needed. Please select a MSM and load a dtraj!\n'
+            if self.interactive_mode:
+                print('Warning!', msg)
+                return
+            else:
+                raise MissingAttribute(message = msg)
+
+        if self.assignements is None:
+            print('\nNo PCCA+ assigments found! Continuing with microstates.')
+            assigments = [[i] for i in range(self._test_model.n_states)] # fake assigments
+        else:
+            print('\nFound {} PCCA+ assigments.'.format(len(self.assignements)))
+            assigments = self.assignements
+
+        print('Using lagtime {:.2e} ns'.format(self._lagtime*self.timestep_ns))
+        return bootstrap_analysis(self._test_model, self.dtraj, assigments, self._lagtime*self.timestep_ns, n_samples=n_samples,
+                                  block_length=block_length, confidence=confidence, n_jobs=n_jobs, seed=seed, file_name=file_name)
+
+    def sample_posteriors(self, n_samples: int = 1000, all_models: bool = False, batch_size: int = 100, effective: bool = True,
+                          n_jobs: Optional[int] = None, seed: int = 0, file_prefix: str = 'posterior'):
+        """
+        Sample the posterior of Bayesian MSMs of the selected MSM (or of every loaded MSM).
+        Samples are streamed to memory-mapped .npy files and used for the credible intervals of 'plot_its', 'mfpt' and 'kinetics'.
+
+        Parameters
+        ----------
+        n_samples : int, optional
+            Number of posterior samples, by default 1000
+        all_models : bool, optional
+            If true, every loaded MSM is sampled, by default False
+        batch_size : int, optional
+            Number of samples drawn by each job, by default 100
+        effective : bool, optional
+            If true, sliding window counts are divided by the lagtime, by default True
+        n_jobs : Optional[int], optional
+            Number of worker processes, by default None (all available cores)
+        seed : int, optional
+            Random seed, by default 0
+        file_prefix : str, optional
+            Prefix of the sample files (the lagtime is appended), by default 'posterior'
+
+        Raises
+        ------
+        MissingAttribute
+            Raised if no test MSM is selected (or no Models are loaded with all_models)
+        """
+
+        if all_models and self.models_exist:
+            models = list(self.models)
+        elif not all_models and self._test_model is not None:
+            models = [self._test_model]
+        else:
+            msg = '\nNo MSM to sample. Please load models and select a MSM!\n'
+            if self.interactive_mode:
+                print('Warning!', msg)
+                return
+            else:
+                raise MissingAttribute(message = msg)
+
+        for model in models:
+            lagtime = int(model.lagtime)
+            print('\nSampling {} Bayesian MSMs at lagtime {}.'.format(n_samples, lagtime))
+            self.posteriors[lagtime] = sample_posterior(model, n_samples, '{}_lag{}'.format(file_prefix, lagtime), batch_size=batch_size,
+                                                        effective=effective, n_jobs=n_jobs, seed=seed)
+            print('Samples saved in {}.'.format(', '.join(self.posteriors[lagtime]['files'])))
 
     # generate method
 
-    def generate_centers_dtraj(self, n_centers: int, save_files: bool = True):
+    def generate_centers_dtraj(self, n_centers: int, save_files: bool = True, file_format: str = 'npy', n_jobs: int = 16,
+                               mini_batch: bool = False, batch_size: int = 10000, tolerance: float = 1e-5):
         """
         Generate (and save) microstates and discretized trajectory with KMeans cluster algorithm from a trajectory.
     
@@ -251,7 +616,17 @@ class System:
         n_centers : int
             Number of microstates
         save_files : bool, optional
-            If true, of microstates and discretized trajectory will be saved in .pkl format, by default True
+            If true, microstates will be saved in .pkl format and discretized trajectory in the chosen format, by default True
+        file_format : str, optional
+            Format of the discretized trajectory file, 'npy' (memory-mapped) or 'pkl', by default 'npy'
+        n_jobs : int, optional
+            Number of threads used by KMeans, by default 16
+        mini_batch : bool, optional
+            If true, use mini-batch KMeans streaming frames from the trajectory segments (memory bounded by the batch size), by default False
+        batch_size : int, optional
+            Number of frames of each mini-batch, by default 10000
+        tolerance : float, optional
+            Convergence tolerance of the clustering, by default 1e-5
 
         Raises
         ------
@@ -260,16 +635,22 @@ class System:
         """
 
         if self.traj_exist:
-            self.centers, self.dtraj = generate_centers_dtraj(self.traj, n_centers=n_centers)
+            self._digests['centers'] = None
+            self.centers, self.dtraj = generate_centers_dtraj(self.traj, n_centers=n_centers, n_jobs=n_jobs, mini_batch=mini_batch,
+                                                              batch_size=batch_size, tolerance=tolerance)
             if save_files:
                 save_file_pkl(self.centers, f'centers_{self.centers.n_centers()}.pkl')
-                save_file_pkl(self.dtraj, f'dtraj_{self.centers.n_centers()}.pkl')
+                if file_format == 'npy':
+                    save_file_npy(self.dtraj, f'dtraj_{self.centers.n_centers()}.npy')
+                else:
+                    save_file_pkl(self.dtraj, f'dtraj_{self.centers.n_centers()}.pkl')
         
         else:
             msg = '\nNo trajectory found. Please load or generate a trajectory!\n'
             raise MissingAttribute(message = msg)
         
-    def generate_model(self, lagtimes: Union[np.ndarray[int], List[int]], save_file: bool = True):
+    def generate_model(self, lagtimes: Union[np.ndarray[int], List[int]], save_file: bool = True, file_format: str = 'pkl',
+                       sparse: bool = False, precision: str = 'float64'):
         """
         Generate (and save) MSMs from a discretized trajectory at different lagtimes.
 
@@ -278,7 +659,13 @@ class System:
         lagtimes : Union[np.ndarray[int], List[int]]
             Array or list of lagtimes
         save_file : bool, optional
-            If true, MSMs will be saved in .pkl format , by default True
+            If true, MSMs will be saved in the chosen format, by default True
+        file_format : str, optional
+            Format of the MSMs file, 'pkl' or 'npz' (indexed archive loaded lazily), by default 'pkl'
+        sparse : bool, optional
+            If true, count and transition matrices are kept in sparse (CSR) format, by default False
+        precision : str, optional
+            Storage precision of count and transition matrices in the 'npz' archive, 'float64' or 'float32', by default 'float64'
 
         Raises
         ------
@@ -286,9 +673,15 @@ class System:
             _description_
         """
         if self.dtraj_exist:
-            self.models = generate_model(self.dtraj, lagtimes = lagtimes)
+            self._digests['models'] = None
+            self.models = generate_model(self.dtraj, lagtimes = lagtimes, sparse=sparse)
+            # posterior samples of the previous models
+            self.posteriors = {}
             if save_file:
-                save_file_pkl(self.models, f'models_{self.models.n_states()}.pkl')
+                if file_format == 'npz':
+                    save_file_npz(self.models, f'models_{self.models.n_states()}.npz', sparse=sparse, precision=precision)
+                else:
+                    save_file_pkl(self.models, f'models_{self.models.n_states()}.pkl')
 
         else:
             msg = '\nNo discretized trajectory found. Please load or generate a trajectory!\n'
@@ -296,12 +689,271 @@ class System:
 
 
 
-    def generate_traj(self, dir: str, save_file= True):
+    def generate_traj(self, dir: str, save_file= True, columns: Optional[List[int]] = None, start: int = 0,
+                      stop: Optional[int] = None, stride: int = 1, n_jobs: Optional[int] = 1, file_format: str = 'npy'):
+        """
+        Generate (and save) a trajectory from the text files in a directory.
 
-        self.traj = generate_trajectory(dir = dir)
+        Parameters
+        ----------
+        dir : str
+            Directory of the trajectory files
+        save_file : bool, optional
+            If true, the trajectory will be saved in the chosen format, by default True
+        columns : Optional[List[int]], optional
+            Indices of the columns (CVs) to load, by default None (all columns)
+        start : int, optional
+            First row to load from each file, by default 0
+        stop : Optional[int], optional
+            Row at which loading stops in each file (excluded), by default None (end of file)
+        stride : int, optional
+            Load one row every stride rows, by default 1
+        n_jobs : Optional[int], optional
+            Number of processes reading files, by default 1. If None, all available cores are used
+        file_format : str, optional
+            Format of the trajectory file, 'npy' (memory-mapped) or 'pkl', by default 'npy'
+        """
+
+        self.traj = generate_trajectory(dir = dir, columns=columns, start=start, stop=stop, stride=stride, n_jobs=n_jobs)
+        self._record_files(trajectory_files(dir))
 
         if save_file:
-            save_file_pkl(self.traj, filename='traj.pkl')
+            if file_format == 'npy':
+                save_file_npy(self.traj, filename='traj.npy')
+            else:
+                save_file_pkl(self.traj, filename='traj.pkl')
+
+    def discretize(self, method: str = 'brute', n_jobs: int = 1, save_file: bool = True, file_name: Optional[str] = None):
+        """
+        Discretize the loaded trajectory assigning each frame to the nearest of the loaded centers.
+
+        Parameters
+        ----------
+        method : str, optional
+            'brute' (vectorized distances) or 'kdtree' (KD-tree built on centers), by default 'brute'
+        n_jobs : int, optional
+            Number of threads processing trajectory segments, by default 1
+        save_file : bool, optional
+            If true, the discretized trajectory will be saved in .npy format, by default True
+        file_name : Optional[str], optional
+            Name of the saved file, by default None ('dtraj_n.npy', with n the number of centers)
+
+        Raises
+        ------
+        MissingAttribute
+            Raised if trajectory or centers are not loaded.
+        """
+
+        if self.traj_exist and self.centers_exist:
+            print('\nDiscretizing trajectory with {} microstates.'.format(self.n_centers))
+            self.dtraj = assign(self.traj, self.centers, method=method, n_jobs=n_jobs)
+            if save_file:
+                file_name = file_name or f'dtraj_{self.n_centers}.npy'
+                save_file_npy(self.dtraj, file_name)
+                print('Discretized trajectory saved in {}.'.format(file_name))
+
+        else:
+            msg = '\nTrajectory or centers not loaded. Please load a trajectory and centers!\n'
+            if self.interactive_mode:
+                print('Warning!', msg)
+            else:
+                raise MissingAttribute(message = msg)
+
+    def sweep(self, n_centers: Union[np.ndarray[int], List[int]], lagtimes: Union[np.ndarray[int], List[int]],
+              out_dir: str = '.', n_jobs: Optional[int] = None, kmeans_jobs: int = 1) -> dict:
+        """
+        Generate and save microstates, discretized trajectories and MSMs for every number of microstates and lagtime.
+        Clusterings and MSMs are computed in parallel on a process pool.
+
+        Parameters
+        ----------
+        n_centers : Union[np.ndarray[int], List[int]]
+            Array or list of numbers of microstates
+        lagtimes : Union[np.ndarray[int], List[int]]
+            Array or list of lagtimes
+        out_dir : str, optional
+            Directory where results are saved, by default '.'
+        n_jobs : Optional[int], optional
+            Number of worker processes, by default None (all available cores)
+        kmeans_jobs : int, optional
+            Number of threads used by each KMeans clustering, by default 1
+
+        Returns
+        -------
+        dict
+            Index of the results (also saved as 'sweep_index.pkl' in out_dir): for each number of microstates,
+            the names of centers, discretized trajectory and models files
+
+        Raises
+        ------
+        MissingAttribute
+            Raised if a trajectory to clusterize is not present.
+        """
+
+        if self.traj_exist:
+            print('\nSweep over {} numbers of microstates and {} lagtimes.'.format(len(n_centers), len(lagtimes)))
+            return sweep_models(self.traj, n_centers, lagtimes, out_dir=out_dir, n_jobs=n_jobs, kmeans_jobs=kmeans_jobs)
+
+        else:
+            msg = '\nNo trajectory found. Please load or generate a trajectory!\n'
+            if self.interactive_mode:
+                print('Warning!', msg)
+            else:
+                raise MissingAttribute(message = msg)
+
+    # incremental update
+    def _record_files(self, file_names: List[str]):
+        """
+        Record trajectory files as processed, with their size and modification time.
+        """
+
+        for file_name in file_names:
+            stat = os.stat(file_name)
+            self.processed_files[os.path.abspath(file_name)] = (stat.st_size, stat.st_mtime_ns)
+
+    def _read_ledger(self, ledger_file: str) -> Optional[str]:
+        """
+        Read the processed files of a ledger file.
+
+        Returns
+        -------
+        Optional[str]
+            Digest of the models file the ledger belongs to (None if the ledger does not exist)
+        """
+
+        self.processed_files = {}
+        if not os.path.exists(ledger_file):
+            return None
+        with open(ledger_file) as f:
+            ledger = json.load(f)
+        # ledgers without a models digest (older format) belong to no models
+        if not isinstance(ledger, dict) or 'files' not in ledger:
+            return None
+        self.processed_files = {name: tuple(value) for name, value in ledger['files'].items()}
+
+        return ledger.get('models')
+
+    def _save_ledger(self, ledger_file: str):
+        """
+        Save the processed files in a ledger file, with the digest of the models file they belong to.
+        """
+
+        with open(ledger_file, 'w') as f:
+            json.dump({'models': self._digests['models'], 'files': self.processed_files}, f, indent=1)
+
+    def update(self, dir: str, columns: Optional[List[int]] = None, stride: int = 1, method: str = 'brute', n_jobs: Optional[int] = 1,
+               ledger_file: str = 'processed_files.json', init: bool = False, save_file: bool = True, file_name: Optional[str] = None):
+        """
+        Update the loaded MSMs with the trajectory files of a directory that were not processed yet.
+        New files are discretized with the loaded centers, their transitions are added to the count matrices at every lagtime
+        and the MSMs are fitted again; the selected MSM, PCCA+ assignements and TPT kinetics are then computed again.
+        Processed files are recorded in a ledger file, so that each update reads only the files added since the previous one.
+        The ledger records the digest of the models file it belongs to: the ledger of other models is refused, and after an update
+        it belongs to the saved models.
+
+        Parameters
+        ----------
+        dir : str
+            Directory of the trajectory files
+        columns : Optional[List[int]], optional
+            Indices of the columns (CVs) to load, by default None (all columns)
+        stride : int, optional
+            Load one row every stride rows, by default 1
+        method : str, optional
+            Discretization method, 'brute' or 'kdtree', by default 'brute'
+        n_jobs : Optional[int], optional
+            Number of processes reading files (and threads discretizing them), by default 1
+        ledger_file : str, optional
+            JSON file of the processed trajectory files, by default 'processed_files.json'
+        init : bool, optional
+            If true, the files in the directory are only recorded as processed (they are already in the MSMs), by default False
+        save_file : bool, optional
+            If true, the updated MSMs are saved, by default True
+        file_name : Optional[str], optional
+            File of the updated MSMs ('.pkl' or '.npz'), by default None ('models_n.pkl', with n the number of states)
+
+        Raises
+        ------
+        MissingAttribute
+            Raised if models (loaded from file) or centers are not loaded, or if the ledger does not belong to the loaded models
+        """
+
+        if not self.models_exist or self._digests.get('models') is None or (not init and not self.centers_exist):
+            msg = "\nModels loaded from file and centers are needed. Please load models and centers with 'load_models' and 'load_centers'!\n"
+            if self.interactive_mode:
+                print('Warning!', msg)
+                return
+            else:
+                raise MissingAttribute(message = msg)
+
+        ledger_models = self._read_ledger(ledger_file)
+        files = trajectory_files(dir)
+        if init:
+            # files of other directories already recorded for the same models are kept
+            if ledger_models != self._digests['models']:
+                self.processed_files = {}
+            self._record_files(files)
+            self._save_ledger(ledger_file)
+            print('\n{} files of {} recorded as processed in {}.'.format(len(files), dir, ledger_file))
+            return
+
+        if ledger_models is None or ledger_models != self._digests['models']:
+            self.processed_files = {}
+            msg = "\nNo record of the files in the loaded models: {} is missing or belongs to other models. " \
+                  "Please use the ledger of the loaded models, or record the files already in them with 'update DIR --init'!\n".format(ledger_file)
+            if self.interactive_mode:
+                print('Warning!', msg)
+                return
+            else:
+                raise MissingAttribute(message = msg)
+
+        new_files = []
+        for name in files:
+            path = os.path.abspath(name)
+            if path not in self.processed_files:
+                new_files.append(name)
+            elif self.processed_files[path][0] != os.stat(name).st_size:
+                print('Warning! {} changed after it was processed: new rows are ignored.'.format(name))
+
+        if not new_files:
+            print('\nNo new trajectory files in {}.'.format(dir))
+            return
+
+        print('\nUpdating MSMs with {} new trajectory files.'.format(len(new_files)))
+        new_traj = read_trajectory_files(new_files, columns=columns, stride=stride, n_jobs=n_jobs)
+        new_dtraj = assign(new_traj, self.centers, method=method, n_jobs=n_jobs or 1)
+        print('Discretized {} new frames with {} microstates.'.format(sum(len(segment) for segment in new_dtraj), self.n_centers))
+
+        self.models = update_models(self.models, new_dtraj)
+        self._digests['models'] = None
+        self.posteriors = {}
+        if self.dtraj_exist:
+            self.dtraj = DTrajectory(list(self.dtraj) + list(new_dtraj))
+        if self.traj_exist:
+            self.traj = Trajectory(list(self.traj) + list(new_traj))
+        print('Updated {} MSMs.'.format(len(self.models)))
+
+        self._record_files(new_files)
+        if save_file:
+            file_name = file_name or f'models_{self.models.n_states()}.pkl'
+            if file_name.endswith('.npz'):
+                save_file_npz(self.models, file_name, sparse=scipy.sparse.issparse(self.models[0].transition_matrix))
+            else:
+                save_file_pkl(self.models, file_name)
+            print('Models saved in {}.'.format(file_name))
+            # the ledger now belongs to the saved models
+            self._digests['models'] = file_digest(file_name)
+            self._save_ledger(ledger_file)
+        else:
+            print('Warning! The updated models are not saved: {} is not updated.'.format(ledger_file))
+
+        # downstream results
+        if self._test_model is not None:
+            self.select_model(self._lagtime)
+            print('Selected MSM with lagtime {}.'.format(self._lagtime))
+            if self.assignements is not None:
+                self.pcca_compute_assignements(len(self.assignements))
+                self.compute_TPT_kinetics_matrix()
 
     # load methods
     def load_centers(self, file_name: str):
@@ -316,6 +968,7 @@ class System:
 
         print('\nLoading Centers')
         self.centers = load_file(file_name, Centers, interactive_mode=self.interactive_mode)
+        self._digests['centers'] = file_digest(file_name) if self.centers_exist else None
         if self.centers_exist:
             self.center_infos()
 
@@ -335,33 +988,50 @@ class System:
         """
         print('\nLoading Models')
         self.models = load_file(file_name, Models, interactive_mode=self.interactive_mode)
+        self._digests['models'] = file_digest(file_name) if self.models_exist else None
 
         # reset test model
         if self._test_model != None:
             self._test_model = None
+        self.posteriors = {}
                     
         # generate default centers or check model compatibility
         if self.models_exist:
             if not self.centers_exist:
                 n_centers = self.models[0].n_states
                 self.centers = Centers(np.arange(0, n_centers).reshape(-1, 1))
+                self._digests['centers'] = 'default'
                 print('\nCreating {} default microstates.'.format(n_centers))
             else:
                 check_models_centers(self.models, self.centers)
    
 
-    # pcca assignements method
-    def pcca_compute_assignements(self, n_states:int = 2):
-        """
-        Perform pcca assignements on the test model
+    def save_models(self, file_name: str, sparse: bool = False, precision: str = 'float64'):
         """
+        Save the loaded models in .pkl format or, if the file name ends with '.npz', in an indexed archive loaded lazily.
 
-        if self._test_model is not None:
-            print('Doing PCCA with {} metastable states'.format(n_states))
-            self.assignements = pcca_assign_centers(self._test_model, self.centers, n_states)
+        Parameters
+        ----------
+        file_name : str
+            Models filename
+        sparse : bool, optional
+            If true, count and transition matrices are stored in sparse (CSR) format ('.npz' only), by default False
+        precision : str, optional
+            Storage precision of count and transition matrices ('.npz' only), 'float64' or 'float32', by default 'float64'
 
+        Raises
+        ------
+        MissingAttribute
+            Raised if Models are not loaded
+        """
+        if self.models_exist:
+            if file_name.endswith('.npz'):
+                save_file_npz(self.models, file_name, sparse=sparse, precision=precision)
+            else:
+                save_file_pkl(Models(list(self.models)), file_name)
+            print('Models saved in {}.'.format(file_name))
         else:
-            msg = '\nNo test MSM is selected. Please select a MSM!\n'
+            msg = '\nModels are not loaded. Please load a model file!\n'
             if self.interactive_mode:
                 print('Warning!', msg)
             else:
@@ -385,7 +1055,7 @@ class System:
 
         if self.models_exist:
             print('\nPlotting implied time scales!')
-            its_plot(self.models, n_its)
+            its_plot(self.models, n_its, backend=self.spectral_backend, posteriors=self.posteriors)
         else:
             msg = '\nModels are not loaded. Please load a model file!\n'
             if self.interactive_mode:
@@ -419,7 +1089,8 @@ class System:
                 raise MissingAttribute(message = msg)
 
     # compute mfpt
-    def compute_mfpt(self, microstate_A: int, microstate_B: int):
+    @cached()
+    def compute_mfpt(self, microstate_A: int, microstate_B: int) -> np.ndarray:
         """
         Compute mean fist passage time (in ns) and transition events in 1us between two microstate of a MSM.
 
@@ -430,6 +1101,11 @@ class System:
         microstate_B : int
             Target microstate
 
+        Returns
+        -------
+        np.ndarray
+            MFPTs (in ns): A --> B and B --> A
+
         Raises
         ------
         MissingAttribute
@@ -438,7 +1114,8 @@ class System:
 
         if self._test_model != None:
             print('\nUsing timestep unit {:.2e} ns'.format(self._lagtime*self.timestep_ns))
-            mfpt(self._test_model, microstate_A, microstate_B, self._lagtime*self.timestep_ns)
+            return mfpt(self._test_model, microstate_A, microstate_B, self._lagtime*self.timestep_ns,
+                        posterior=self.posteriors.get(self._lagtime))
         else:
             msg = '\nNo test MSM is selected. Please select a MSM!\n'
             if self.interactive_mode:
@@ -447,6 +1124,7 @@ class System:
                 raise MissingAttribute(message = msg)
 
     # assignements
+    @cached('assignements')
     def pcca_compute_assignements(self, n_states:int = 2):
         """
         Perform pcca assignements on the test model
@@ -454,7 +1132,8 @@ class System:
 
         if self._test_model is not None:
             print('Doing PCCA with {} metastable states'.format(n_states))
-            self.assignements = pcca_assign_centers(self._test_model, self.centers, n_states, interactive_mode=self.interactive_mode)
+            self.assignements = pcca_assign_centers(self._test_model, self.centers, n_states, interactive_mode=self.interactive_mode,
+                                                    backend=self.spectral_backend)
 
         else:
             msg = '\nNo test MSM is selected. Please select a MSM!\n'
@@ -483,7 +1162,7 @@ class System:
     # loading
     def load_dtraj(self, file_name: str):
         """
-        Load discretized trajectory from a file.
+        Load discretized trajectory from a file (.pkl or memory-mapped .npy).
 
         Parameters
         ----------
@@ -495,7 +1174,7 @@ class System:
 
     def load_traj(self, file_name: str):
         """
-        Load trajectory from a file.
+        Load trajectory from a file (.pkl or memory-mapped .npy).
 
         Parameters
         ----------
@@ -526,17 +1205,29 @@ class System:
     # plotting PCCA assigments or discretized trajectory
     def plot_traj(self, bin: int = 100):
         """
+        Plot the binned PCCA+ memberships of the trajectory frames.
+
+        Parameters
+        ----------
+        bin : int, optional
+            Number of bins for each axis, by default 100
         """
 
         if (self.traj_exist and self.dtraj_exist) and self.assignements != None:
-            trajectory_plot(self.traj, self.dtraj, self._test_model, self.assignements)
+            trajectory_plot(self.traj, self.dtraj, self._test_model, self.assignements, n_bins=bin)
         else:
             print('Select a traj, a dtraj and a model.')
 
     def plot_dtraj(self, bin: int = 100):
         """
+        Plot the most visited microstate in each bin of the trajectory.
+
+        Parameters
+        ----------
+        bin : int, optional
+            Number of bins for each axis, by default 100
         """
         if self.dtraj_exist and self.traj_exist:
-            dtraj_plotting(self.traj, self.dtraj)
+            dtraj_plotting(self.traj, self.dtraj, n_bins=bin)
         else:
             print('Select a traj and a dtraj')
\ No newline at end of file
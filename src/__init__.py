@@ -1,4 +1,14 @@
-import src.analysis
-import src.commands
-import src.tools
-from .MarkovStates import System
\ No newline at end of file
+"""
+MSManalysis. Subpackages and the System class are imported when first used.
+"""
+import importlib
+
+def __getattr__(name):
+
+    if name == 'System':
+        from .MarkovStates import System
+        return System
+    if name in ('analysis', 'commands', 'generator', 'tools'):
+        return importlib.import_module('.' + name, __name__)
+
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
\ No newline at end of file
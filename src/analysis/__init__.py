@@ -1 +1,34 @@
-from .functions import *
\ No newline at end of file
+"""
+Analysis of MSMs. Functions are imported from their modules when first used, so that plotting and
+estimation dependencies are not loaded at startup.
+"""
+import importlib
+
+# public names of each module, imported when first used
+_modules = {
+    'functions': ['its_plot', 'choose_model', 'ck_candidates', 'ck_testing', 'ck_summary', 'mfpt',
+                  'mfpt_matrix_analysis', 'pcca_assign_centers', 'TPTkinetic_analysis', 'TPTkinetic_matrix_analysis',
+                  'bootstrap_analysis', 'score_analysis', 'binned_microstates', 'trajectory_plot', 'dtraj_plotting',
+                  'state_plotting'],
+    'spectral': ['leading_eigenpairs', 'sparse_implied_timescales', 'sparse_pcca'],
+    'kinetics': ['mfpt_matrix', 'tpt_rate_matrix', 'tpt_dtype'],
+    'chapman_kolmogorov': ['MatrixPowers', 'chapman_kolmogorov', 'ck_errors'],
+    'bootstrap': ['block_counts', 'msm_observables', 'bootstrap_msm', 'confidence_interval'],
+    'posterior': ['posterior_timescales', 'posterior_mfpt', 'posterior_tpt'],
+}
+_exports = {name: module for module, names in _modules.items() for name in names}
+
+__all__ = list(_exports)
+
+def __getattr__(name):
+
+    if name not in _exports:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    value = getattr(importlib.import_module('.' + _exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+
+    return sorted(set(globals()) | set(_exports))
\ No newline at end of file
@@ -0,0 +1,251 @@
+"""
+Bootstrap of MSMs: resampling of trajectory blocks with counts reused across replicas and refits in a process pool
+"""
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from deeptime.markov import TransitionCountModel
+from deeptime.markov.msm import MaximumLikelihoodMSM
+
+from .kinetics import tpt_rate_matrix
+from src.tools.utils.shared import SharedArrays, attach_arrays
+
+
+def block_counts(dtraj: Sequence[np.ndarray], lagtime: int, n_states: int,
+                 block_length: Optional[int] = None) -> Tuple[scipy.sparse.csr_matrix, np.ndarray, np.ndarray]:
+    """
+    Count transitions (sliding window) of each block of a discretized trajectory.
+    Transitions are assigned to the block of their starting frame: the sum of the counts of all the blocks
+    is the count matrix of the whole discretized trajectory.
+
+    Parameters
+    ----------
+    dtraj : Sequence[np.ndarray]
+        Discretized trajectory
+    lagtime : int
+        Lagtime in steps
+    n_states : int
+        Number of states
+    block_length : Optional[int], optional
+        Number of frames of each block, by default None (a block for each segment)
+
+    Returns
+    -------
+    Tuple[scipy.sparse.csr_matrix, np.ndarray, np.ndarray]
+        Counts with shape (n_blocks, n_pairs) and the starting and ending state of each observed pair of states
+    """
+
+    block_codes, block_values, block_ids = [], [], []
+    n_blocks = 0
+    for segment in dtraj:
+        states = np.asarray(segment, dtype=np.int64)
+        n_origins = len(states) - lagtime
+        length = len(states) if block_length is None else block_length
+        for start in range(0, max(n_origins, 0), length):
+            stop = min(start + length, n_origins)
+            codes, values = np.unique(states[start:stop]*n_states + states[start+lagtime:stop+lagtime], return_counts=True)
+            block_codes.append(codes)
+            block_values.append(values)
+            block_ids.append(np.full(len(codes), n_blocks))
+            n_blocks += 1
+
+    if n_blocks == 0:
+        raise ValueError('The discretized trajectory is shorter than the lagtime {}.'.format(lagtime))
+
+    pairs, columns = np.unique(np.concatenate(block_codes), return_inverse=True)
+    counts = scipy.sparse.csr_matrix((np.concatenate(block_values).astype(np.float64), (np.concatenate(block_ids), columns)),
+                                     shape=(n_blocks, len(pairs)))
+
+    return counts, pairs // n_states, pairs % n_states
+
+# block counts shared with the bootstrap worker processes
+_shared_counts = {}
+# replicas fitted by each bootstrap job
+_CHUNK_SIZE = 16
+
+def _attach_counts(info: dict):
+    """
+    Initializer of the bootstrap worker processes: attach to the shared block counts.
+
+    Parameters
+    ----------
+    info : dict
+        Description of the shared arrays (SharedArrays.info)
+    """
+
+    _shared_counts['shm'], arrays = attach_arrays(info)
+    _set_counts(arrays)
+
+def _set_counts(arrays: Dict[str, np.ndarray]):
+    counts = scipy.sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(arrays['shape']))
+    # replicas are weighted sums of the block rows
+    _shared_counts['counts_T'] = counts.T.tocsr()
+    _shared_counts['rows'] = arrays['rows']
+    _shared_counts['cols'] = arrays['cols']
+
+def msm_observables(model, sets: Sequence[np.ndarray], n_states: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Stationary probabilities of sets of states and TPT kinetics (in lagtime units) between them.
+    States are given in the full state space of the discretized trajectory: states outside the active set
+    of the MSM are ignored, and quantities involving empty sets are NaN.
+
+    Parameters
+    ----------
+    model : MarkovStateModel
+        MSM
+    sets : Sequence[np.ndarray]
+        Sets of states (full state space)
+    n_states : int
+        Number of states of the full state space
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Stationary probability of each set and structured array of TPT kinetics (see tpt_rate_matrix)
+    """
+
+    full2active = np.full(n_states, -1)
+    symbols = model.count_model.state_symbols
+    full2active[symbols] = np.arange(len(symbols))
+    active_sets = [full2active[s][full2active[s] >= 0] for s in sets]
+
+    pi = np.asarray(model.stationary_distribution)
+    probabilities = np.array([pi[s].sum() if len(s) > 0 else np.nan for s in active_sets])
+
+    kinetics = np.full((len(sets), len(sets)), np.nan, dtype=[('rate', np.float64), ('mfpt', np.float64), ('flux', np.float64)])
+    found = [i for i, s in enumerate(active_sets) if len(s) > 0]
+    if len(found) > 1:
+        kinetics[np.ix_(found, found)] = tpt_rate_matrix(model.transition_matrix, pi, [active_sets[i] for i in found],
+                                                         reversible=model.reversible)
+
+    return probabilities, kinetics
+
+def _bootstrap_chunk(seed: np.random.SeedSequence, n_replicas: int, n_states: int, lagtime: int, sets: Sequence[np.ndarray],
+                     reversible: bool, sparse: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Bootstrap job: fit MSMs of resampled blocks and compute their observables.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Stationary probabilities of the sets with shape (n_replicas, n_sets) and TPT kinetics with shape (n_replicas, n_sets, n_sets)
+    """
+
+    rng = np.random.default_rng(seed)
+    counts_T = _shared_counts['counts_T']
+    n_blocks = counts_T.shape[1]
+    estimator = MaximumLikelihoodMSM(reversible=reversible, sparse=sparse)
+
+    probabilities, kinetics = [], []
+    for _ in range(n_replicas):
+        weights = np.bincount(rng.integers(n_blocks, size=n_blocks), minlength=n_blocks).astype(np.float64)
+        count_matrix = scipy.sparse.csr_matrix((counts_T @ weights, (_shared_counts['rows'], _shared_counts['cols'])),
+                                               shape=(n_states, n_states))
+        count_matrix.eliminate_zeros()
+        if not sparse:
+            count_matrix = count_matrix.toarray()
+
+        model = estimator.fit_fetch(TransitionCountModel(count_matrix=count_matrix, counting_mode='sliding', lagtime=lagtime))
+        p, k = msm_observables(model, sets, n_states)
+        probabilities.append(p)
+        kinetics.append(k)
+
+    return np.array(probabilities), np.array(kinetics)
+
+def bootstrap_msm(dtraj: Sequence[np.ndarray], lagtime: int, sets: Sequence[Sequence[int]], n_states: int,
+                  n_samples: int = 1000, block_length: Optional[int] = None, reversible: bool = True, sparse: bool = False,
+                  n_jobs: Optional[int] = None, seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+    Bootstrap MSMs by resampling blocks of a discretized trajectory with replacement.
+    The transitions of each block are counted once: the count matrix of a replica is the sum of the counts of the
+    drawn blocks, weighted by the number of draws. Replicas are fitted in a process pool attached to the block counts
+    through shared memory.
+
+    Parameters
+    ----------
+    dtraj : Sequence[np.ndarray]
+        Discretized trajectory
+    lagtime : int
+        Lagtime in steps
+    sets : Sequence[Sequence[int]]
+        Sets of states (e.g. PCCA+ assignments, full state space)
+    n_states : int
+        Number of states of the full state space
+    n_samples : int, optional
+        Number of bootstrap replicas, by default 1000
+    block_length : Optional[int], optional
+        Number of frames of each resampled block, by default None (segments are resampled)
+    reversible : bool, optional
+        True to fit reversible MSMs, by default True
+    sparse : bool, optional
+        True to fit sparse MSMs, by default False
+    n_jobs : Optional[int], optional
+        Number of worker processes, by default None (all available cores); 1 runs in the current process
+    seed : int, optional
+        Random seed, by default 0
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Samples of the stationary probabilities ('probability', shape (n_samples, n_sets)) and of TPT rates,
+        mean first passage times (in lagtime units) and fluxes ('rate', 'mfpt', 'flux', shape (n_samples, n_sets, n_sets))
+    """
+
+    sets = [np.asarray(s, dtype=int) for s in sets]
+    counts, rows, cols = block_counts(dtraj, lagtime, n_states, block_length=block_length)
+    if counts.shape[0] < 2:
+        print('Warning! Only {} block to resample: set a block length to bootstrap a single segment.'.format(counts.shape[0]))
+    arrays = {'data': counts.data, 'indices': counts.indices, 'indptr': counts.indptr,
+              'shape': np.array(counts.shape), 'rows': rows, 'cols': cols}
+
+    # chunks of replicas do not depend on the number of workers: results are reproducible
+    n_workers = n_jobs or os.cpu_count() or 1
+    replicas = [len(chunk) for chunk in np.array_split(np.arange(n_samples), -(-n_samples // _CHUNK_SIZE))]
+    n_chunks = len(replicas)
+    seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    arguments = (n_states, lagtime, sets, reversible, sparse)
+
+    if n_workers == 1:
+        _set_counts(arrays)
+        results = [_bootstrap_chunk(s, n, *arguments) for s, n in zip(seeds, replicas)]
+    else:
+        with SharedArrays() as shared:
+            for key, array in arrays.items():
+                shared.share(key, array)
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_attach_counts, initargs=(shared.info,)) as executor:
+                jobs = [executor.submit(_bootstrap_chunk, s, n, *arguments) for s, n in zip(seeds, replicas)]
+                results = [job.result() for job in jobs]
+
+    kinetics = np.concatenate([k for _, k in results])
+
+    return {'probability': np.concatenate([p for p, _ in results]),
+            'rate': kinetics['rate'], 'mfpt': kinetics['mfpt'], 'flux': kinetics['flux']}
+
+def confidence_interval(samples: np.ndarray, confidence: float = 0.95) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Equal-tailed percentile interval of bootstrap or posterior samples (NaN samples are ignored).
+
+    Parameters
+    ----------
+    samples : np.ndarray
+        Samples along the first axis
+    confidence : float, optional
+        Confidence level, by default 0.95
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Lower and upper bounds
+    """
+
+    alpha = 100*(1 - confidence)/2
+    # all-NaN slices (e.g. the diagonal of kinetics) give NaN bounds
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanpercentile(samples, alpha, axis=0), np.nanpercentile(samples, 100 - alpha, axis=0)
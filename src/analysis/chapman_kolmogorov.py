@@ -0,0 +1,256 @@
+"""
+Batched Chapman-Kolmogorov test: propagation of PCCA+ memberships with cached powers of the transition matrix
+"""
+import numbers
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from deeptime.base import Observable
+from deeptime.util.validation import ChapmanKolmogorovTest
+from deeptime.markov.msm import MarkovStateModel
+
+
+class MatrixPowers:
+    """
+    Powers of a transition matrix computed by repeated squaring.
+    The squares T^(2^k) are computed once and cached: the propagation of a (small) set of distributions
+    to any integer number of steps only needs one vector-matrix product per set bit of the number of steps.
+    """
+
+    def __init__(self, transition_matrix):
+        """
+        Parameters
+        ----------
+        transition_matrix : np.ndarray or scipy.sparse matrix
+            Transition matrix
+        """
+
+        if scipy.sparse.issparse(transition_matrix):
+            transition_matrix = transition_matrix.toarray()
+        self._squares = [np.asarray(transition_matrix)]
+        self._lock = threading.Lock()
+
+    def square(self, k: int) -> np.ndarray:
+        """
+        Return T^(2^k), computing and caching the missing squares.
+
+        Parameters
+        ----------
+        k : int
+            Exponent of the square
+
+        Returns
+        -------
+        np.ndarray
+            T^(2^k)
+        """
+
+        with self._lock:
+            while len(self._squares) <= k:
+                self._squares.append(self._squares[-1] @ self._squares[-1])
+            return self._squares[k]
+
+    def propagate(self, distributions: np.ndarray, n_steps: int) -> np.ndarray:
+        """
+        Propagate row distributions by n_steps steps.
+
+        Parameters
+        ----------
+        distributions : np.ndarray
+            Distributions to propagate, shape (n_distributions, n_states)
+        n_steps : int
+            Number of steps
+
+        Returns
+        -------
+        np.ndarray
+            distributions @ T^n_steps
+        """
+
+        result = np.array(distributions, dtype=float)
+        k = 0
+        while n_steps > 0:
+            if n_steps & 1:
+                result = result @ self.square(k)
+            n_steps >>= 1
+            k += 1
+
+        return result
+
+
+class MembershipsObservable(Observable):
+    """
+    Observable of the Chapman-Kolmogorov test: probabilities of the PCCA+ metastable sets of a test model after propagating
+    the stationary distribution restricted to each set (weighted by the memberships).
+    """
+
+    def __init__(self, test_model, memberships: np.ndarray):
+        """
+        Parameters
+        ----------
+        test_model : MarkovStateModel
+            MSM the memberships are computed on
+        memberships : np.ndarray
+            PCCA+ memberships (n_states, n_sets) on the active states of the test model
+        """
+
+        self.memberships = memberships
+        self.n_states, self.n_sets = memberships.shape
+
+        P0 = memberships*np.asarray(test_model.stationary_distribution)[:, None]
+        self.P0 = P0/P0.sum(axis=0)
+
+        # map from the full state space of the discretized trajectory to the active states of the test model
+        symbols = test_model.count_model.state_symbols
+        self.full2active = np.full(test_model.count_model.n_states_full, -1)
+        self.full2active[symbols] = np.arange(len(symbols))
+
+    def restrict(self, model) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Initial distributions and memberships on the active states of another MSM.
+        States outside the active set of the test model have zero probability and membership.
+
+        Parameters
+        ----------
+        model : MarkovStateModel
+            MSM
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            Initial distributions and memberships, both with shape (model.n_states, n_sets)
+        """
+
+        symbols = model.count_model.state_symbols
+        active = np.full(len(symbols), -1)
+        inside = symbols < len(self.full2active)
+        active[inside] = self.full2active[symbols[inside]]
+        found = active >= 0
+
+        p0 = np.zeros((len(symbols), self.n_sets))
+        memberships = np.zeros((len(symbols), self.n_sets))
+        p0[found] = self.P0[active[found]]
+        memberships[found] = self.memberships[active[found]]
+
+        return p0, memberships
+
+    def __call__(self, model, mlag=1, **kw) -> np.ndarray:
+        """
+        Probabilities of the metastable sets (rows: starting set) after mlag lagtimes of a MSM.
+        """
+
+        if mlag == 0 or model is None:
+            return np.eye(self.n_sets)
+
+        p0, memberships = self.restrict(model)
+        propagated = np.stack([model.propagate(p0[:, i], mlag) for i in range(self.n_sets)])
+
+        return propagated @ memberships
+
+def _ck_prediction(observable: MembershipsObservable, powers: MatrixPowers, propagator, mlag) -> np.ndarray:
+    """
+    Membership matrix predicted by the test model after mlag lagtimes.
+    Fractional powers are computed by propagator (the test model, or its dense copy for sparse MSMs).
+    """
+
+    if mlag == 0:
+        return np.eye(observable.n_sets)
+
+    if isinstance(mlag, numbers.Integral) or float(mlag).is_integer():
+        propagated = powers.propagate(observable.P0.T, int(mlag))
+        return propagated @ observable.memberships
+
+    # fractional powers are computed by the MSM propagation
+    return observable(propagator, mlag=mlag)
+
+def _ck_estimate(observable: MembershipsObservable, model) -> np.ndarray:
+    """
+    Membership matrix estimated by a MSM at its own lagtime.
+    """
+
+    if model is None:
+        return np.eye(observable.n_sets)
+
+    p0, memberships = observable.restrict(model)
+    transition_matrix = model.transition_matrix
+    if scipy.sparse.issparse(transition_matrix):
+        transition_matrix = transition_matrix.toarray()
+
+    return (transition_matrix.T @ p0).T @ memberships
+
+def chapman_kolmogorov(models: Sequence, test_models: Sequence, n_sets: int, include_lag0: bool = True,
+                       n_jobs: Optional[int] = None) -> List[ChapmanKolmogorovTest]:
+    """
+    Perform the Chapman-Kolmogorov test of several candidate MSMs against the same list of estimated MSMs.
+    Integer propagations share the cached powers of each candidate, the estimates are computed once per candidate
+    and the lagtimes are evaluated in a thread pool. Results are equal to deeptime MarkovStateModel.ck_test
+    (states outside the active set of the candidate are ignored instead of being mapped to its first state).
+
+    Parameters
+    ----------
+    models : Sequence
+        List of MSMs estimated at different lagtimes
+    test_models : Sequence
+        Candidate MSMs to test
+    n_sets : int
+        Number of PCCA+ metastable sets
+    include_lag0 : bool, optional
+        Whether to include lagtime 0 in the test, by default True
+    n_jobs : Optional[int], optional
+        Number of threads, by default None (ThreadPoolExecutor default)
+
+    Returns
+    -------
+    List[ChapmanKolmogorovTest]
+        One Chapman-Kolmogorov test for each candidate, ready for deeptime plot_ck_test
+    """
+
+    models = sorted(models, key=lambda x: x.lagtime)
+    lagtimes = ([0] if include_lag0 else []) + [model.lagtime for model in models]
+    estimated = ([None] if include_lag0 else []) + list(models)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        for test_model in test_models:
+            clustering = test_model.pcca(n_sets)
+            observable = MembershipsObservable(test_model, clustering.memberships)
+            powers = MatrixPowers(test_model.transition_matrix)
+
+            # deeptime fractional propagation needs dense eigenvectors
+            propagator = test_model
+            if scipy.sparse.issparse(test_model.transition_matrix):
+                propagator = MarkovStateModel(powers.square(0), test_model.stationary_distribution, test_model.reversible,
+                                              count_model=test_model.count_model, lagtime=test_model.lagtime)
+
+            predictions = executor.map(lambda lagtime: _ck_prediction(observable, powers, propagator, lagtime/test_model.lagtime),
+                                       lagtimes)
+            estimates = executor.map(lambda model: _ck_estimate(observable, model), estimated)
+
+            results.append(ChapmanKolmogorovTest(lagtimes, list(predictions), [], list(estimates), [], observable))
+
+    return results
+
+def ck_errors(ck_tests: Sequence[ChapmanKolmogorovTest]) -> Dict[str, np.ndarray]:
+    """
+    Summarize Chapman-Kolmogorov tests with the deviation between predictions and estimates.
+
+    Parameters
+    ----------
+    ck_tests : Sequence[ChapmanKolmogorovTest]
+        Chapman-Kolmogorov tests
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Maximum and mean absolute deviation of each test
+    """
+
+    deviations = [np.abs(np.real(ck.predictions) - np.real(ck.estimates)) for ck in ck_tests]
+
+    return {'max': np.array([deviation.max() for deviation in deviations]),
+            'mean': np.array([deviation.mean() for deviation in deviations])}
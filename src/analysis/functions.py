@@ -2,23 +2,25 @@
 Useful functions for MSM analysis
 """
 from src.tools import Models, Centers, DTrajectory, Trajectory
+from src.tools import render
 
-from deeptime.plots import plot_implied_timescales, plot_ck_test
-from deeptime.util.validation import implied_timescales
 from deeptime.markov.msm import MarkovStateModelCollection
 
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-from matplotlib.lines import Line2D
-
 import numpy as np
+import scipy.sparse
 
-from typing import List
+from typing import List, Optional, Tuple
 
 from tabulate import tabulate
 
+from .spectral import sparse_pcca
+from .kinetics import mfpt_matrix, tpt_rate_matrix
+from .chapman_kolmogorov import chapman_kolmogorov, ck_errors
+from .bootstrap import bootstrap_msm, msm_observables, confidence_interval
+from .posterior import posterior_timescales, posterior_mfpt, posterior_tpt
+
 # plotting implied time scale
-def its_plot(models: Models, n_its: int):
+def its_plot(models: Models, n_its: int, backend: str = 'dense', posteriors: Optional[dict] = None):
     """
     Plot the implied timescale test.
 
@@ -28,10 +30,18 @@ def its_plot(models: Models, n_its: int):
         Collection of MSMs at different lagtime on wich the implied timescale test is performed
     n_its : int
         Number of eigenvalue to plot
+    backend : str, optional
+        Spectral backend, 'dense' or 'sparse', by default 'dense'
+    posteriors : Optional[dict], optional
+        Posterior samples of Bayesian MSMs by lagtime: 95% credible intervals are shown for the sampled lagtimes, by default None
     """
 
-    # creating its object
-    its_data = implied_timescales(models)
+    # matplotlib (and deeptime plots) are imported by the plotting commands only
+    import matplotlib.pyplot as plt
+    from deeptime.plots import plot_implied_timescales
+
+    # cached its object
+    its_data = models.implied_timescales(n_its=n_its, backend=backend)
 
     # check for max number of process:
     if n_its > its_data.max_n_processes:
@@ -41,11 +51,21 @@ def its_plot(models: Models, n_its: int):
     _, ax = plt.subplots(1, 1)
 
     plot_implied_timescales(its_data, n_its=n_its, ax=ax)
+
+    # credible intervals of the sampled lagtimes
+    sampled = sorted(lt for lt in (posteriors or {}) if lt in its_data.lagtimes)
+    if sampled:
+        bounds = [confidence_interval(posterior_timescales(posteriors[lt]['transition_matrices'], posteriors[lt]['stationary_distributions'],
+                                                         lt, n_its, reversible=posteriors[lt]['reversible'])) for lt in sampled]
+        for i in range(n_its):
+            ax.fill_between(sampled, [low[i] for low, _ in bounds], [high[i] for _, high in bounds], alpha=0.2,
+                            color='C{}'.format(i), label='95% credible interval' if i == 0 else None)
+        ax.legend()
     ax.set_yscale('log')
     ax.set_title('Implied Timescales')
     ax.set_xlabel('Lagtime (steps)')
     ax.set_ylabel('Timescale (steps)')
-    plt.show()
+    render(ax.figure, 'its')
 
 # model selections
 def choose_model(models: Models, lagtime: int) -> MarkovStateModelCollection:
@@ -65,22 +85,20 @@ def choose_model(models: Models, lagtime: int) -> MarkovStateModelCollection:
         The selected MSM
     """
 
-    # creating its object
-    its_data = implied_timescales(models).lagtimes
-
-    # its parameters
+    # cached lagtimes
+    lagtimes = models.lagtimes()
 
-    index = np.abs(its_data-lagtime).argmin()
+    index = np.abs(lagtimes-lagtime).argmin()
     selected_model = models[index]
     print('Lagtime chosen is {}.'.format(lagtime))
-    print('Selecting model number {} with lagtime {}.'.format(index, its_data[index]))
+    print('Selecting model number {} with lagtime {}.'.format(index, lagtimes[index]))
 
     return selected_model
 
 # Chapman-Kolmogorov test
-def ck_testing(models: Models, test_model: MarkovStateModelCollection, n_sets:int):
+def ck_candidates(models: Models, test_model: MarkovStateModelCollection, n_sets: int, n_jobs: Optional[int] = None) -> list:
     """
-    Perfom Chapman-Kolmogorov test on a selected MSM.
+    Perform Chapman-Kolmogorov test on a selected MSM and on the MSM stored before it (after it for the first MSM).
 
     Parameters
     ----------
@@ -90,10 +108,14 @@ def ck_testing(models: Models, test_model: MarkovStateModelCollection, n_sets:in
         The selected MSM
     n_sets : int
         Number of macrostate to test
+    n_jobs : Optional[int], optional
+        Number of threads for the propagation, by default None
+
+    Returns
+    -------
+    list
+        Chapman-Kolmogorov tests of the selected MSM and of its neighbour
     """
-    
-    ck_test = test_model.ck_test(models, n_metastable_sets=n_sets)
-    grid = plot_ck_test(ck_test, legend=False)
 
     # test the model stored before the one chosen
     index = models.index(test_model)
@@ -102,12 +124,72 @@ def ck_testing(models: Models, test_model: MarkovStateModelCollection, n_sets:in
     else:
         test_model2 = models[index-1]
 
-    ck_test = test_model2.ck_test(models, n_metastable_sets=n_sets)
-    plot_ck_test(ck_test, legend=True, grid=grid)
-    plt.show()
+    return chapman_kolmogorov(models, [test_model, test_model2], n_sets, n_jobs=n_jobs)
+
+def ck_testing(models: Models, test_model: MarkovStateModelCollection, n_sets:int, n_jobs: Optional[int] = None,
+               ck_tests: Optional[list] = None):
+    """
+    Perfom Chapman-Kolmogorov test on a selected MSM.
+
+    Parameters
+    ----------
+    models : Models
+        List of MSMs from wich the MSM was selected 
+    test_model : MarkovStateModelCollection
+        The selected MSM
+    n_sets : int
+        Number of macrostate to test
+    n_jobs : Optional[int], optional
+        Number of threads for the propagation, by default None
+    ck_tests : Optional[list], optional
+        Precomputed tests of the selected MSM and of its neighbour (see ck_candidates), by default None
+    """
+
+    from deeptime.plots import plot_ck_test
+
+    if ck_tests is None:
+        ck_tests = ck_candidates(models, test_model, n_sets, n_jobs=n_jobs)
+    grid = plot_ck_test(ck_tests[0], legend=False)
+    plot_ck_test(ck_tests[1], legend=True, grid=grid)
+    render(grid.figure, 'ck_test')
+
+def ck_summary(models: Models, n_sets: int, candidates: Optional[List[MarkovStateModelCollection]] = None,
+               n_jobs: Optional[int] = None) -> dict:
+    """
+    Perform Chapman-Kolmogorov test on several candidate MSMs in one batch and print the deviations
+    between predicted and estimated memberships.
+
+    Parameters
+    ----------
+    models : Models
+        List of MSMs at different lagtimes
+    n_sets : int
+        Number of macrostate to test
+    candidates : Optional[List[MarkovStateModelCollection]], optional
+        MSMs to test, by default None (all MSMs)
+    n_jobs : Optional[int], optional
+        Number of threads for the propagation, by default None
+
+    Returns
+    -------
+    dict
+        Lagtimes of the candidates, maximum and mean absolute deviations
+    """
+
+    if candidates is None:
+        candidates = list(models)
+
+    ck_tests = chapman_kolmogorov(models, candidates, n_sets, n_jobs=n_jobs)
+    errors = ck_errors(ck_tests)
+    errors['lagtime'] = np.array([model.lagtime for model in candidates])
+
+    table = [[lagtime, max_error, mean_error] for lagtime, max_error, mean_error in zip(errors['lagtime'], errors['max'], errors['mean'])]
+    print(tabulate(table, headers=['Lagtime', 'Max deviation', 'Mean deviation'], floatfmt='.4f'))
 
+    return errors
 
-def mfpt(test_model: MarkovStateModelCollection, state_A: int, state_B: int, ts_units: float):
+
+def mfpt(test_model: MarkovStateModelCollection, state_A: int, state_B: int, ts_units: float, posterior: Optional[dict] = None) -> np.ndarray:
     """
     Compute the mean first passage time (in ns) and the rates of transition events in 1us between two microstates.
 
@@ -121,10 +203,17 @@ def mfpt(test_model: MarkovStateModelCollection, state_A: int, state_B: int, ts_
         Target microstate
     ts_units : float
         Conversion unit for MSM lagtime and timestep (usually lagtime*timestep) 
+    posterior : Optional[dict], optional
+        Posterior samples of the Bayesian MSM: 95% credible intervals are printed, by default None
+
+    Returns
+    -------
+    np.ndarray
+        MFPTs (in ns): A --> B and B --> A
     """
 
-    # forward mfpt
-    fw_mfpt = test_model.mfpt(state_A, state_B)
+    # forward mfpt (deeptime returns mfpt in steps, converted here in lagtime units)
+    fw_mfpt = test_model.mfpt(state_A, state_B)/test_model.lagtime
     fc = 1e3/(fw_mfpt*ts_units)
 
     print(
@@ -137,7 +226,7 @@ def mfpt(test_model: MarkovStateModelCollection, state_A: int, state_B: int, ts_
         )
     
     # backward mfpt
-    bc_mfpt = test_model.mfpt(state_B, state_A)
+    bc_mfpt = test_model.mfpt(state_B, state_A)/test_model.lagtime
     bc = 1e3/(bc_mfpt*ts_units)
 
     print(
@@ -148,9 +237,59 @@ def mfpt(test_model: MarkovStateModelCollection, state_A: int, state_B: int, ts_
         f' k center {state_B}--> center {state_A} is '
         f'{bc:.2f} events/us'
         )
+
+    if posterior is not None:
+        mfpts = posterior_mfpt(posterior['transition_matrices'], posterior['stationary_distributions'], state_A, state_B)*ts_units
+        low, high = confidence_interval(mfpts)
+        print('\nPosterior 95% credible intervals ({} samples):'.format(len(mfpts)))
+        print(tabulate([['{} --> {}'.format(a, b), '[{:.2f}, {:.2f}]'.format(low[i], high[i]), '[{:.2f}, {:.2f}]'.format(1e3/high[i], 1e3/low[i])]
+                        for i, (a, b) in enumerate(((state_A, state_B), (state_B, state_A)))],
+                       headers=['Transition', 'MFPT (ns)', 'Events/us'], disable_numparse=True))
+
+    return np.array([fw_mfpt, bc_mfpt])*ts_units
+
+def mfpt_matrix_analysis(test_model: MarkovStateModelCollection, ts_units: float, targets: Optional[List[int]] = None,
+                         file_name: Optional[str] = None) -> np.ndarray:
+    """
+    Compute the mean first passage times (in ns) from every microstate to each target microstate.
+
+    Parameters
+    ----------
+    test_model : MarkovStateModelCollection
+        The selected MSM
+    ts_units : float
+        Conversion unit for MSM lagtime and timestep (usually lagtime*timestep)
+    targets : Optional[List[int]], optional
+        Target microstates, by default None (all microstates)
+    file_name : Optional[str], optional
+        If provided, the MFPT matrix is saved in .npy format, by default None
+
+    Returns
+    -------
+    np.ndarray
+        Array with shape (n_microstates, n_targets) of MFPTs in ns
+    """
+
+    targets = list(range(test_model.n_states)) if targets is None else targets
+    mfpts = mfpt_matrix(test_model.transition_matrix, test_model.stationary_distribution, targets=targets)*ts_units
+
+    print('\nComputed MFPTs from {} microstates to {} target microstates.'.format(mfpts.shape[0], mfpts.shape[1]))
+    
+    # print only small tables
+    if mfpts.shape[0] <= 50 and mfpts.shape[1] <= 10:
+        headers = ['MFPT (ns)'] + ['--> {}'.format(j) for j in targets]
+        tab = [['Microstate {}'.format(i)] + ['{:.2f}'.format(m) for m in row] for i, row in enumerate(mfpts)]
+        print(tabulate(tab, headers=headers))
+
+    if file_name is not None:
+        np.save(file_name, mfpts)
+        print('MFPT matrix saved in {}.'.format(file_name))
+
+    return mfpts
     
 # pcca assignements
-def pcca_assign_centers(test_model: MarkovStateModelCollection, centers: Centers, n_states: int, interactive_mode: bool = False) -> List[List[int]]:
+def pcca_assign_centers(test_model: MarkovStateModelCollection, centers: Centers, n_states: int, interactive_mode: bool = False,
+                        backend: str = 'dense') -> List[List[int]]:
     """
     Perform PCCA+ on a MSM.
 
@@ -164,6 +303,8 @@ def pcca_assign_centers(test_model: MarkovStateModelCollection, centers: Centers
         Number of macrostate for the PCCA+
     interactive_moode : bool
         True if interactive mode in on, default is False
+    backend : str, optional
+        Spectral backend, 'dense' (deeptime PCCA+) or 'sparse' (leading eigenvectors only), by default 'dense'
 
     Returns
     -------
@@ -183,11 +324,16 @@ def pcca_assign_centers(test_model: MarkovStateModelCollection, centers: Centers
         else:
             raise ValueError(msg)
     
-    pcca = test_model.pcca(n_states) 
-    pcsp = pcca.coarse_grained_stationary_probability
+    if backend == 'sparse':
+        _, assignments, pcsp = sparse_pcca(test_model.transition_matrix, test_model.stationary_distribution, n_states,
+                                           reversible=test_model.reversible)
+    else:
+        pcca = test_model.pcca(n_states) 
+        assignments = pcca.assignments
+        pcsp = pcca.coarse_grained_stationary_probability
     
     print('\nPCCA analysis.')
-    unique_ass = np.unique(pcca.assignments)
+    unique_ass = np.unique(assignments)
     n_unique_ass = len(unique_ass)
     print('PCCA found {} unique assignemets:'.format(n_unique_ass))
     ordered_states = []
@@ -195,7 +341,7 @@ def pcca_assign_centers(test_model: MarkovStateModelCollection, centers: Centers
     for i in range(n_unique_ass):
     
         print('Assigned macrostate {} with a stationary probability of {}'.format(i, pcsp[i]))
-        ind = np.where(pcca.assignments == i)[0]
+        ind = np.where(assignments == i)[0]
         ordered_states.append(ind)
         
         tab = []
@@ -212,7 +358,8 @@ def pcca_assign_centers(test_model: MarkovStateModelCollection, centers: Centers
 
     return ordered_states
 
-def TPTkinetic_analysis(test_model: MarkovStateModelCollection, state_A: int, state_B: int, assignements: List[List[int]], ts_units: float):
+def TPTkinetic_analysis(test_model: MarkovStateModelCollection, state_A: int, state_B: int, assignements: List[List[int]], ts_units: float,
+                        posterior: Optional[dict] = None) -> Tuple[np.ndarray, np.ndarray]:
     """
     Compute mean first passage times (in ns) and rate in (in s^-1) between two states.
 
@@ -228,6 +375,13 @@ def TPTkinetic_analysis(test_model: MarkovStateModelCollection, state_A: int, st
         Assigments of PCCA+
     ts_units : float
         Conversion unit between steps units and time in ns
+    posterior : Optional[dict], optional
+        Posterior samples of the Bayesian MSM: 95% credible intervals are printed, by default None
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        MFPTs (in ns) and rates (in s^-1): A --> B and B --> A
     """
 
     # forward kinetics A -> B
@@ -262,6 +416,142 @@ def TPTkinetic_analysis(test_model: MarkovStateModelCollection, state_A: int, st
             f'{bc:.2e} s^-1'
             )
 
+    if posterior is not None:
+        rates, mfpts = posterior_tpt(posterior['transition_matrices'], posterior['stationary_distributions'],
+                                     assignements[state_A], assignements[state_B], reversible=posterior['reversible'])
+        rate_low, rate_high = confidence_interval(rates*1e9/ts_units)
+        mfpt_low, mfpt_high = confidence_interval(mfpts*ts_units)
+        print('\nPosterior 95% credible intervals ({} samples):'.format(len(rates)))
+        print(tabulate([['ms {} --> {}'.format(a, b), '[{:.2f}, {:.2f}]'.format(mfpt_low[i], mfpt_high[i]),
+                         '[{:.2e}, {:.2e}]'.format(rate_low[i], rate_high[i])]
+                        for i, (a, b) in enumerate(((state_A, state_B), (state_B, state_A)))],
+                       headers=['Transition', 'MFPT (ns)', 'Rate (s^-1)'], disable_numparse=True))
+
+    return np.array([ftpt.mfpt, btpt.mfpt])*ts_units, np.array([fc, bc])
+
+def TPTkinetic_matrix_analysis(test_model: MarkovStateModelCollection, assignements: List[List[int]], ts_units: float,
+                               file_name: Optional[str] = None) -> np.ndarray:
+    """
+    Compute mean first passage times (in ns) and rates (in s^-1) following TPT between every pair of states.
+
+    Parameters
+    ----------
+    test_model : MarkovStateModelCollection
+        MSM to analyze
+    assignements : List[List[int]]
+        Assigments of PCCA+
+    ts_units : float
+        Conversion unit between steps units and time in ns
+    file_name : Optional[str], optional
+        If provided, the rate matrix is saved in .npy format, by default None
+
+    Returns
+    -------
+    np.ndarray
+        Structured array with shape (n_states, n_states) and fields 'rate' (s^-1), 'mfpt' (ns) and 'flux':
+        element (a, b) refers to the transition a --> b
+    """
+
+    kinetics = tpt_rate_matrix(test_model.transition_matrix, test_model.stationary_distribution, assignements,
+                               reversible=test_model.reversible)
+    kinetics['rate'] *= 1e9/ts_units
+    kinetics['mfpt'] *= ts_units
+
+    n_states = len(assignements)
+    headers = ['from \\ to'] + ['ms {}'.format(j) for j in range(n_states)]
+    print('\nMFPT (ns):')
+    print(tabulate([['ms {}'.format(i)] + ['{:.2f}'.format(m) if i != j else '-' for j, m in enumerate(row)]
+                    for i, row in enumerate(kinetics['mfpt'])], headers=headers))
+    print('\nRates (s^-1):')
+    print(tabulate([['ms {}'.format(i)] + ['{:.2e}'.format(k) if i != j else '-' for j, k in enumerate(row)]
+                    for i, row in enumerate(kinetics['rate'])], headers=headers))
+
+    if file_name is not None:
+        np.save(file_name, kinetics)
+        print('Rate matrix saved in {}.'.format(file_name))
+
+    return kinetics
+
+
+def bootstrap_analysis(test_model: MarkovStateModelCollection, dtraj: DTrajectory, assignements: List[List[int]], ts_units: float,
+                       n_samples: int = 1000, block_length: Optional[int] = None, confidence: float = 0.95,
+                       n_jobs: Optional[int] = None, seed: int = 0, file_name: Optional[str] = None) -> dict:
+    """
+    Compute bootstrap confidence intervals of stationary probabilities, mean first passage times (in ns) and rates (in s^-1)
+    following TPT between every pair of states. The states are kept fixed and MSMs are refitted from resampled blocks
+    of the discretized trajectory at the lagtime of the test model.
+
+    Parameters
+    ----------
+    test_model : MarkovStateModelCollection
+        MSM to analyze
+    dtraj : DTrajectory
+        Discretized trajectory used to fit the MSM
+    assignements : List[List[int]]
+        Assigments of PCCA+
+    ts_units : float
+        Conversion unit between steps units and time in ns
+    n_samples : int, optional
+        Number of bootstrap replicas, by default 1000
+    block_length : Optional[int], optional
+        Number of frames of each resampled block, by default None (segments are resampled)
+    confidence : float, optional
+        Confidence level of the intervals, by default 0.95
+    n_jobs : Optional[int], optional
+        Number of worker processes, by default None (all available cores)
+    seed : int, optional
+        Random seed, by default 0
+    file_name : Optional[str], optional
+        If provided, estimates and bootstrap samples are saved in .npz format, by default None
+
+    Returns
+    -------
+    dict
+        Estimates ('probability', 'rate', 'mfpt'), bootstrap samples ('*_samples') and interval bounds ('*_low', '*_high')
+    """
+
+    n_states = max(test_model.count_model.n_states_full, max(int(np.max(segment)) for segment in dtraj if len(segment) > 0) + 1)
+    symbols = test_model.count_model.state_symbols
+    sets = [symbols[np.asarray(state, dtype=int)] for state in assignements]
+
+    probability, kinetics = msm_observables(test_model, sets, n_states)
+    samples = bootstrap_msm(dtraj, int(test_model.lagtime), sets, n_states, n_samples=n_samples, block_length=block_length,
+                            reversible=test_model.reversible, sparse=scipy.sparse.issparse(test_model.transition_matrix),
+                            n_jobs=n_jobs, seed=seed)
+
+    results = {'probability': probability, 'rate': kinetics['rate']*1e9/ts_units, 'mfpt': kinetics['mfpt']*ts_units,
+               'probability_samples': samples['probability'], 'rate_samples': samples['rate']*1e9/ts_units,
+               'mfpt_samples': samples['mfpt']*ts_units, 'confidence': confidence}
+    for key in ('probability', 'rate', 'mfpt'):
+        results[key + '_low'], results[key + '_high'] = confidence_interval(results[key + '_samples'], confidence)
+
+    n_failed = int(np.isnan(samples['probability']).any(axis=1).sum())
+    print('\nBootstrap with {} replicas ({:.0%} confidence intervals).'.format(n_samples, confidence))
+    if n_failed > 0:
+        print('Warning! {} replicas miss at least one state set: they are ignored for the affected quantities.'.format(n_failed))
+
+    print('\nStationary probabilities:')
+    print(tabulate([['ms {}'.format(i), '{:.4f}'.format(p), '[{:.4f}, {:.4f}]'.format(low, high)] for i, (p, low, high)
+                    in enumerate(zip(results['probability'], results['probability_low'], results['probability_high']))],
+                   headers=['State', 'Estimate', 'Interval'], disable_numparse=True))
+
+    print('\nKinetics:')
+    table = []
+    for i in range(len(sets)):
+        for j in range(len(sets)):
+            if i != j:
+                table.append(['ms {} --> {}'.format(i, j),
+                              '{:.2f}'.format(results['mfpt'][i, j]),
+                              '[{:.2f}, {:.2f}]'.format(results['mfpt_low'][i, j], results['mfpt_high'][i, j]),
+                              '{:.2e}'.format(results['rate'][i, j]),
+                              '[{:.2e}, {:.2e}]'.format(results['rate_low'][i, j], results['rate_high'][i, j])])
+    print(tabulate(table, headers=['Transition', 'MFPT (ns)', 'Interval', 'Rate (s^-1)', 'Interval'], disable_numparse=True))
+
+    if file_name is not None:
+        np.savez(file_name, **results)
+        print('Bootstrap results saved in {}.'.format(file_name))
+
+    return results
 
 #############WORK IN PROGRESS############
 
@@ -287,53 +577,183 @@ def score_analysis(test_model: MarkovStateModelCollection, dtraj: Trajectory, me
 
 # plotting functions: still to improve
 
-def trajectory_plot(traj: Trajectory, dtraj: Trajectory, test_model: MarkovStateModelCollection, assigments: list):
+def _plane_chunks(traj: Trajectory, dtraj: DTrajectory, chunk_size: int):
     """
+    Iterate over aligned chunks of trajectory and discretized trajectory.
+    Frames are projected on the plotting plane: the first two CVs, or frame index and CV for 1D trajectories.
     """
+
+    offset = 0
+    for segment, dsegment in zip(traj, dtraj):
+        for start in range(0, len(segment), chunk_size):
+            frames = np.asarray(segment[start:start+chunk_size])
+            frames = frames.reshape(len(frames), -1)
+            if frames.shape[1] >= 2:
+                plane = frames[:, :2]
+            else:
+                plane = np.column_stack([offset + start + np.arange(len(frames)), frames[:, 0]])
+            yield plane, np.asarray(dsegment[start:start+chunk_size])
+        offset += len(segment)
+
+def binned_microstates(traj: Trajectory, dtraj: DTrajectory, n_bins: int = 100,
+                       chunk_size: int = 1000000) -> Tuple[np.ndarray, np.ndarray, scipy.sparse.csr_matrix]:
+    """
+    Histogram of the microstates visited in each bin of a 2D grid over the plotting plane
+    (first two CVs, or frame index and CV for 1D trajectories).
+    The trajectory is streamed in chunks: memory and plotting time do not depend on its length.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Trajectory
+    dtraj : DTrajectory
+        Discretized trajectory
+    n_bins : int, optional
+        Number of bins for each axis, by default 100
+    chunk_size : int, optional
+        Number of frames processed at once, by default 1000000
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, scipy.sparse.csr_matrix]
+        Bin edges of the two axes and sparse counts with shape (n_bins*n_bins, n_microstates)
+    """
+
+    # first pass: plane limits and number of microstates
+    lower, upper = np.full(2, np.inf), np.full(2, -np.inf)
+    n_microstates = 0
+    for plane, microstates in _plane_chunks(traj, dtraj, chunk_size):
+        if len(plane) > 0:
+            lower = np.minimum(lower, plane.min(axis=0))
+            upper = np.maximum(upper, plane.max(axis=0))
+            n_microstates = max(n_microstates, int(microstates.max()) + 1)
+    upper = np.where(upper > lower, upper, lower + 1)
+    edges = [np.linspace(lower[k], upper[k], n_bins + 1) for k in range(2)]
+
+    # second pass: sparse accumulation of (bin, microstate) pairs
+    counts = scipy.sparse.csr_matrix((n_bins*n_bins, n_microstates))
+    for plane, microstates in _plane_chunks(traj, dtraj, chunk_size):
+        index = ((plane - lower)/(upper - lower)*n_bins).astype(int)
+        index = np.clip(index, 0, n_bins - 1)
+        bins = index[:, 0]*n_bins + index[:, 1]
+        counts += scipy.sparse.coo_matrix((np.ones(len(bins)), (bins, microstates)),
+                                          shape=(n_bins*n_bins, n_microstates)).tocsr()
+
+    return edges[0], edges[1], counts
+
+def _plane_labels(traj: Trajectory) -> Tuple[str, str]:
+    """
+    Axis labels of the plotting plane.
+    """
+
+    if np.asarray(traj[0][:1]).reshape(1, -1).shape[1] >= 2:
+        return 'CV1', 'CV2'
+    else:
+        return 'Frame', 'CV'
+
+def trajectory_plot(traj: Trajectory, dtraj: DTrajectory, test_model: MarkovStateModelCollection, assigments: list, n_bins: int = 100):
+    """
+    Plot the binned PCCA+ memberships of the trajectory frames for each metastable set.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Trajectory
+    dtraj : DTrajectory
+        Discretized trajectory
+    test_model : MarkovStateModelCollection
+        The selected MSM
+    assigments : list
+        PCCA+ assignments
+    n_bins : int, optional
+        Number of bins for each axis, by default 100
+    """
+
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+
     n_states = len(assigments)
     pcca = test_model.pcca(n_states)
 
-    ass = np.concatenate(dtraj, axis=0)
-    traj_concat = np.concatenate(traj, axis=0)
+    xedges, yedges, counts = binned_microstates(traj, dtraj, n_bins)
+
+    # memberships of the microstates (zero outside the active set)
+    memberships = np.zeros((counts.shape[1], n_states))
+    symbols = test_model.count_model.state_symbols
+    mask = symbols < counts.shape[1]
+    memberships[symbols[mask]] = pcca.memberships[mask]
+
+    frames = np.asarray(counts.sum(axis=1)).ravel()
+    mean_memberships = (counts @ memberships)/np.maximum(frames, 1)[:, None]
+    xlabel, ylabel = _plane_labels(traj)
 
-    fig, axes = plt.subplots(n_states, 1, figsize=(15, 10))
+    fig, axes = plt.subplots(n_states, 1, figsize=(15, 10), squeeze=False)
     axes = axes.ravel()
     for i in range(len(axes)):
         ax = axes[i]
         ax.set_title(f"Metastable set {i+1} probabilities")
-        ax.scatter(traj_concat[::100], traj_concat[::100],
-                   c=pcca.memberships[ass[::100], i], cmap=plt.cm.Reds)
+        values = np.ma.masked_where(frames == 0, mean_memberships[:, i]).reshape(n_bins, n_bins)
+        ax.pcolormesh(xedges, yedges, values.T, cmap=plt.cm.Reds, vmin=0, vmax=1)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
     norm = mpl.colors.Normalize(vmin=0, vmax=1)
     fig.colorbar(plt.cm.ScalarMappable(norm=norm, cmap=plt.cm.Reds),
                  ax=axes, shrink=.8)
-    plt.show()
+    render(fig, 'trajectory')
 
-def dtraj_plotting(traj: Trajectory, dtraj: Trajectory):
+def dtraj_plotting(traj: Trajectory, dtraj: DTrajectory, n_bins: int = 100):
     """
+    Plot the most visited microstate in each bin of the trajectory.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Trajectory
+    dtraj : DTrajectory
+        Discretized trajectory
+    n_bins : int, optional
+        Number of bins for each axis, by default 100
     """
 
-    colors = ['red', 'blue', 'green', 'yellow', 'pink', 'purple']
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Patch
+
+    xedges, yedges, counts = binned_microstates(traj, dtraj, n_bins)
 
-    ass = np.concatenate(dtraj[:][::100], axis=0)
-    traj_concat = np.concatenate(traj[::100], axis=0)
+    frames = np.asarray(counts.sum(axis=1)).ravel()
+    dominant = np.asarray(counts.argmax(axis=1)).ravel()
+    values = np.ma.masked_where(frames == 0, dominant).reshape(n_bins, n_bins)
 
-    microstates = np.unique(ass)
+    # one color for each microstate, cycling over the tab20 colormap
+    n_microstates = counts.shape[1]
+    colors = plt.cm.tab20(np.arange(n_microstates) % 20)
+    cmap = mpl.colors.ListedColormap(colors)
 
-    # Scatter plot
-    plt.figure(figsize=(15, 10))
-    for i in microstates:
-        mask = ass == i
-        plt.scatter(traj_concat[mask, 0], traj_concat[mask, 1], color=colors[i], label=f'Microstate {i}')
+    fig, ax = plt.subplots(1, 1, figsize=(15, 10))
+    mesh = ax.pcolormesh(xedges, yedges, values.T, cmap=cmap, vmin=-0.5, vmax=n_microstates-0.5)
 
-    plt.xlabel('CV')
-    plt.title('Dtraj assigments')
-    plt.legend()
-    plt.show()
+    microstates = np.unique(dominant[frames > 0])
+    if len(microstates) <= 20:
+        handles = [Patch(color=colors[i], label=f'Microstate {i}') for i in microstates]
+        ax.legend(handles=handles)
+    else:
+        fig.colorbar(mesh, ax=ax, label='Microstate')
+
+    xlabel, ylabel = _plane_labels(traj)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title('Dtraj assigments')
+    render(fig, 'dtraj')
     
 def state_plotting(test_model: MarkovStateModelCollection, assignements: List[List[int]], centers: Centers, lagtime: int, timestep: float):
     """
     """
 
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    from matplotlib.lines import Line2D
+
     # energy in kJ/mol
     RT = 2.479
     # time in ns
@@ -370,6 +790,10 @@ def state_plotting(test_model: MarkovStateModelCollection, assignements: List[Li
     
     ref_id = np.argsort(en)[0]
 
+    # mfpts between all the macrostates
+    kinetics = tpt_rate_matrix(test_model.transition_matrix, test_model.stationary_distribution, assignements,
+                               reversible=test_model.reversible)
+
     if centers.shape[1] <= 1:
         #drowing arrows with mfpts
         for i in np.argsort(en)[1:]:
@@ -385,19 +809,13 @@ def state_plotting(test_model: MarkovStateModelCollection, assignements: List[Li
             color_2 = 'red'
 
             # forward
-            fflux = test_model.reactive_flux(assignements[ref_id],
-                                    assignements[i])
-            _, ftpt = fflux.coarse_grain(assignements)
-            mfpt_fw = f'{ftpt.mfpt*ns_unit:.2f} ns \n'
+            mfpt_fw = f'{kinetics[ref_id, i]["mfpt"]*ns_unit:.2f} ns \n'
 
             ax.text(mid_x, mid_y, mfpt_fw, color=color_1, 
                 fontsize=10, ha='left', va='top')
         
             # backward
-            bflux = test_model.reactive_flux(assignements[i],
-                                    assignements[ref_id])
-            _ , btpt = bflux.coarse_grain(assignements)
-            mfpt_bw = f' {btpt.mfpt*ns_unit:.2f} ns \n'
+            mfpt_bw = f' {kinetics[i, ref_id]["mfpt"]*ns_unit:.2f} ns \n'
 
             ax.text(mid_x, mid_y, mfpt_bw, color=color_2, 
                 fontsize=10, ha='right', va='bottom')
@@ -422,5 +840,5 @@ def state_plotting(test_model: MarkovStateModelCollection, assignements: List[Li
         plt.ylim([np.min(en) -5, np.max(en) + 5])
     
     plt.title('MSM analysis')
-    plt.show()        
+    render(plt.gcf(), 'states')        
 
@@ -0,0 +1,181 @@
+"""
+Batched kinetics of MSMs: mean first passage times between all pairs of microstates and TPT rates between all pairs of macrostates
+"""
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+from scipy.sparse.linalg import splu
+
+from typing import Optional, Sequence
+
+
+def mfpt_matrix(transition_matrix, stationary_distribution: Optional[np.ndarray] = None,
+                targets: Optional[Sequence[int]] = None) -> np.ndarray:
+    """
+    Compute mean first passage times (in lagtime units) from every microstate to each target microstate.
+    Dense transition matrices use a single LU factorization of the fundamental matrix shared by all targets,
+    sparse transition matrices use one sparse LU factorization per target, solving for all the starting states at once.
+
+    Parameters
+    ----------
+    transition_matrix : np.ndarray or scipy.sparse matrix
+        Transition matrix of the MSM
+    stationary_distribution : Optional[np.ndarray], optional
+        Stationary distribution of the MSM, needed for dense transition matrices, by default None
+    targets : Optional[Sequence[int]], optional
+        Target microstates, by default None (all microstates)
+
+    Returns
+    -------
+    np.ndarray
+        Array with shape (n_microstates, n_targets): element (i, j) is the MFPT from microstate i to target j
+    """
+
+    n = transition_matrix.shape[0]
+    targets = np.arange(n) if targets is None else np.asarray(targets, dtype=int)
+
+    if scipy.sparse.issparse(transition_matrix):
+        mfpts = np.zeros((n, len(targets)))
+        A = (scipy.sparse.identity(n, format='csr') - transition_matrix).tocsr()
+        for j, target in enumerate(targets):
+            others = np.delete(np.arange(n), target)
+            lu = splu(A[others][:, others].tocsc())
+            mfpts[others, j] = lu.solve(np.ones(n-1))
+        return mfpts
+
+    # fundamental matrix Z = (I - P + 1 pi^T)^-1: mfpt(i, j) = (Z_jj - Z_ij) / pi_j
+    P = np.asarray(transition_matrix)
+    pi = np.asarray(stationary_distribution)
+    lu = scipy.linalg.lu_factor(np.eye(n) - P + pi[None, :])
+    rhs = np.zeros((n, len(targets)))
+    rhs[targets, np.arange(len(targets))] = 1.0
+    Z = scipy.linalg.lu_solve(lu, rhs)
+
+    mfpts = (Z[targets, np.arange(len(targets))][None, :] - Z) / pi[targets][None, :]
+    mfpts[targets, np.arange(len(targets))] = 0.0
+
+    return mfpts
+
+# TPT kinetics
+
+tpt_dtype = np.dtype([('rate', np.float64), ('mfpt', np.float64), ('flux', np.float64)])
+
+def _restricted_solver(M, states: np.ndarray):
+    """
+    Factorize the matrix I - M restricted to a set of states.
+
+    Parameters
+    ----------
+    M : np.ndarray or scipy.sparse matrix
+        Square matrix
+    states : np.ndarray
+        States of the restriction
+
+    Returns
+    -------
+    Callable
+        Function solving (I - M_states,states) x = b
+    """
+
+    if scipy.sparse.issparse(M):
+        A = scipy.sparse.identity(len(states), format='csc') - M[states][:, states].tocsc()
+        return splu(A.tocsc()).solve
+    else:
+        lu = scipy.linalg.lu_factor(np.eye(len(states)) - M[np.ix_(states, states)])
+        return lambda b: scipy.linalg.lu_solve(lu, b)
+
+def _committor(M, solve, intermediate: np.ndarray, source: np.ndarray, target: np.ndarray, n: int) -> np.ndarray:
+    """
+    Committor probability of reaching target before source, given the factorization of the intermediate states.
+
+    Parameters
+    ----------
+    M : np.ndarray or scipy.sparse matrix
+        Transition matrix (forward or time-reversed)
+    solve : Callable
+        Solver of (I - M) restricted to the intermediate states
+    intermediate : np.ndarray
+        States not in source nor target
+    source : np.ndarray
+        Source states (committor 0)
+    target : np.ndarray
+        Target states (committor 1)
+    n : int
+        Number of states
+
+    Returns
+    -------
+    np.ndarray
+        Committor of each state
+    """
+
+    q = np.zeros(n)
+    q[target] = 1.0
+    if len(intermediate) > 0:
+        rhs = np.asarray(M[intermediate][:, target].sum(axis=1)).ravel()
+        q[intermediate] = solve(rhs)
+
+    return q
+
+def tpt_rate_matrix(transition_matrix, stationary_distribution: np.ndarray, sets: Sequence[Sequence[int]],
+                    reversible: bool = False) -> np.ndarray:
+    """
+    Compute TPT rates, mean first passage times (in lagtime units) and total reactive fluxes between every ordered pair of sets of states.
+    For each unordered pair only one factorization is computed (two for non-reversible MSMs):
+    forward and backward committors of the reverse reaction are obtained as complements of the direct ones.
+
+    Parameters
+    ----------
+    transition_matrix : np.ndarray or scipy.sparse matrix
+        Transition matrix of the MSM
+    stationary_distribution : np.ndarray
+        Stationary distribution of the MSM
+    sets : Sequence[Sequence[int]]
+        Sets of states (e.g. PCCA+ assignments)
+    reversible : bool, optional
+        True if the MSM is reversible (backward committors are then complements of forward ones), by default False
+
+    Returns
+    -------
+    np.ndarray
+        Structured array with shape (n_sets, n_sets) and fields 'rate', 'mfpt' and 'flux': element (a, b) refers to the reaction a --> b
+    """
+
+    P = transition_matrix
+    pi = np.asarray(stationary_distribution)
+    n = P.shape[0]
+    sets = [np.asarray(s, dtype=int) for s in sets]
+
+    # time-reversed transition matrix
+    if not reversible:
+        if scipy.sparse.issparse(P):
+            P_rev = (scipy.sparse.diags(1/pi) @ P.T @ scipy.sparse.diags(pi)).tocsr()
+        else:
+            P_rev = (np.asarray(P).T * pi[None, :]) / pi[:, None]
+
+    results = np.zeros((len(sets), len(sets)), dtype=tpt_dtype)
+
+    for a in range(len(sets)):
+        for b in range(a+1, len(sets)):
+            A, B = sets[a], sets[b]
+            intermediate = np.setdiff1d(np.arange(n), np.concatenate([A, B]))
+
+            # forward committor A --> B (B --> A is the complement)
+            solve = _restricted_solver(P, intermediate) if len(intermediate) > 0 else None
+            q_forward = _committor(P, solve, intermediate, A, B, n)
+
+            # backward committor A --> B (probability of coming from A)
+            if reversible:
+                q_backward = 1.0 - q_forward
+            else:
+                solve_rev = _restricted_solver(P_rev, intermediate) if len(intermediate) > 0 else None
+                q_backward = _committor(P_rev, solve_rev, intermediate, B, A, n)
+
+            # total reactive flux out of the source, equal for both directions
+            flux = pi[A] @ np.asarray(P[A] @ q_forward).ravel()
+
+            for source, target, weight in ((a, b, pi @ q_backward), (b, a, pi @ (1.0 - q_backward))):
+                rate = flux/weight
+                results[source, target] = (rate, 1/rate if rate > 0 else np.inf, flux)
+
+    return results
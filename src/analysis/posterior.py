@@ -0,0 +1,168 @@
+"""
+Posterior statistics of Bayesian MSMs: implied timescales, MFPTs and TPT rates computed on stacks of sampled transition matrices
+"""
+import numpy as np
+
+from typing import Iterator, Sequence, Tuple
+
+
+def _batches(n_samples: int, batch_size: int) -> Iterator[slice]:
+    """
+    Slices of consecutive samples: memory-mapped samples are read one batch at a time.
+    """
+
+    for start in range(0, n_samples, batch_size):
+        yield slice(start, min(start + batch_size, n_samples))
+
+def posterior_timescales(transition_matrices: np.ndarray, stationary_distributions: np.ndarray, lagtime: int, n_its: int,
+                         reversible: bool = True, batch_size: int = 100) -> np.ndarray:
+    """
+    Implied timescales (in steps) of sampled transition matrices.
+    Eigenvalues of each batch are computed with a single stacked call: reversible matrices are symmetrized
+    with their stationary distribution and real symmetric eigenvalues are used.
+
+    Parameters
+    ----------
+    transition_matrices : np.ndarray
+        Sampled transition matrices, shape (n_samples, n_states, n_states)
+    stationary_distributions : np.ndarray
+        Sampled stationary distributions, shape (n_samples, n_states)
+    lagtime : int
+        Lagtime of the samples in steps
+    n_its : int
+        Number of implied timescales
+    reversible : bool, optional
+        True if the samples are reversible, by default True
+    batch_size : int, optional
+        Number of samples processed at once, by default 100
+
+    Returns
+    -------
+    np.ndarray
+        Implied timescales with shape (n_samples, n_its)
+    """
+
+    n_samples = len(transition_matrices)
+    timescales = np.empty((n_samples, n_its))
+    for batch in _batches(n_samples, batch_size):
+        P = np.asarray(transition_matrices[batch])
+        if reversible:
+            sqrt_pi = np.sqrt(np.asarray(stationary_distributions[batch]))
+            S = P * sqrt_pi[:, :, None] / sqrt_pi[:, None, :]
+            eigenvalues = np.linalg.eigvalsh(0.5*(S + np.swapaxes(S, 1, 2)))
+        else:
+            eigenvalues = np.linalg.eigvals(P)
+        # decreasing modulus, stationary process excluded
+        moduli = -np.sort(-np.abs(eigenvalues), axis=1)[:, 1:n_its+1]
+        with np.errstate(divide='ignore'):
+            timescales[batch] = -lagtime/np.log(moduli)
+
+    return timescales
+
+def posterior_mfpt(transition_matrices: np.ndarray, stationary_distributions: np.ndarray, state_A: int, state_B: int,
+                   batch_size: int = 100) -> np.ndarray:
+    """
+    Mean first passage times (in lagtime units) between two states of sampled transition matrices.
+    Each batch is solved with a stacked linear solve of the fundamental matrix Z = (I - P + 1 pi^T)^-1.
+
+    Parameters
+    ----------
+    transition_matrices : np.ndarray
+        Sampled transition matrices, shape (n_samples, n_states, n_states)
+    stationary_distributions : np.ndarray
+        Sampled stationary distributions, shape (n_samples, n_states)
+    state_A : int
+        First state
+    state_B : int
+        Second state
+    batch_size : int, optional
+        Number of samples processed at once, by default 100
+
+    Returns
+    -------
+    np.ndarray
+        MFPTs with shape (n_samples, 2): A --> B and B --> A
+    """
+
+    n_samples, n_states = stationary_distributions.shape
+    states = np.array([state_A, state_B])
+    rhs = np.zeros((n_states, 2))
+    rhs[states, [0, 1]] = 1.0
+
+    mfpts = np.empty((n_samples, 2))
+    for batch in _batches(n_samples, batch_size):
+        P = np.asarray(transition_matrices[batch])
+        pi = np.asarray(stationary_distributions[batch])
+        Z = np.linalg.solve(np.eye(n_states)[None] - P + pi[:, None, :], rhs[None])
+        # mfpt(i, j) = (Z_jj - Z_ij) / pi_j
+        mfpts[batch, 0] = (Z[:, state_B, 1] - Z[:, state_A, 1]) / pi[:, state_B]
+        mfpts[batch, 1] = (Z[:, state_A, 0] - Z[:, state_B, 0]) / pi[:, state_A]
+
+    return mfpts
+
+def _stacked_committor(P: np.ndarray, intermediate: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """
+    Committor probabilities of reaching target before the other absorbing states, for a stack of transition matrices.
+    """
+
+    q = np.zeros(P.shape[:2])
+    q[:, target] = 1.0
+    if len(intermediate) > 0:
+        A = np.eye(len(intermediate))[None] - P[:, intermediate][:, :, intermediate]
+        b = P[:, intermediate][:, :, target].sum(axis=2)
+        q[:, intermediate] = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+
+    return q
+
+def posterior_tpt(transition_matrices: np.ndarray, stationary_distributions: np.ndarray, set_A: Sequence[int], set_B: Sequence[int],
+                  reversible: bool = True, batch_size: int = 100) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    TPT rates and mean first passage times (in lagtime units) between two sets of states of sampled transition matrices.
+    Committors of each batch are computed with stacked linear solves (as tpt_rate_matrix for a single MSM).
+
+    Parameters
+    ----------
+    transition_matrices : np.ndarray
+        Sampled transition matrices, shape (n_samples, n_states, n_states)
+    stationary_distributions : np.ndarray
+        Sampled stationary distributions, shape (n_samples, n_states)
+    set_A : Sequence[int]
+        First set of states
+    set_B : Sequence[int]
+        Second set of states
+    reversible : bool, optional
+        True if the samples are reversible (backward committors are complements of forward ones), by default True
+    batch_size : int, optional
+        Number of samples processed at once, by default 100
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Rates and MFPTs with shape (n_samples, 2): A --> B and B --> A
+    """
+
+    n_samples, n_states = stationary_distributions.shape
+    A, B = np.asarray(set_A, dtype=int), np.asarray(set_B, dtype=int)
+    intermediate = np.setdiff1d(np.arange(n_states), np.concatenate([A, B]))
+
+    rates = np.empty((n_samples, 2))
+    for batch in _batches(n_samples, batch_size):
+        P = np.asarray(transition_matrices[batch])
+        pi = np.asarray(stationary_distributions[batch])
+
+        q_forward = _stacked_committor(P, intermediate, B)
+        if reversible:
+            q_backward = 1.0 - q_forward
+        else:
+            P_rev = np.swapaxes(P, 1, 2) * pi[:, None, :] / pi[:, :, None]
+            q_backward = _stacked_committor(P_rev, intermediate, A)
+
+        # total reactive flux out of A
+        flux = np.einsum('si,sij,sj->s', pi[:, A], P[:, A], q_forward)
+        rates[batch, 0] = flux / np.einsum('si,si->s', pi, q_backward)
+        rates[batch, 1] = flux / np.einsum('si,si->s', pi, 1.0 - q_backward)
+
+    with np.errstate(divide='ignore'):
+        mfpts = 1/rates
+
+    return rates, mfpts
@@ -0,0 +1,237 @@
+"""
+Sparse spectral backend: leading eigenpairs, implied timescales and PCCA+ memberships of large MSMs
+"""
+import numpy as np
+import scipy.sparse
+from scipy.sparse.linalg import eigs, eigsh, ArpackNoConvergence
+
+from scipy.optimize import fmin
+
+from typing import Optional, Tuple
+
+from deeptime.util.validation import ImpliedTimescales
+
+# shift of the shift-invert mode: leading eigenvalues of metastable MSMs cluster around 1
+_SHIFT = 1.0 + 1e-8
+# implied timescales computed when the number of processes is not given
+DEFAULT_N_ITS = 10
+
+def _krylov(solver, M, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Run an ARPACK solver for the k eigenvalues largest in modulus.
+    A bounded number of plain iterations is tried first; if it does not converge (eigenvalues too close to 1,
+    as for metastable MSMs) the shift-invert mode around 1 is used.
+
+    Parameters
+    ----------
+    solver : callable
+        ARPACK solver, scipy.sparse.linalg.eigs or scipy.sparse.linalg.eigsh
+    M : scipy.sparse matrix
+        Sparse matrix
+    k : int
+        Number of eigenpairs
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Eigenvalues and correspondent eigenvectors (columns), as returned by the solver (unsorted)
+    """
+
+    try:
+        return solver(M, k=k, which='LM', maxiter=300)
+    except ArpackNoConvergence:
+        return solver(M.tocsc(), k=k, sigma=_SHIFT, which='LM')
+
+
+def leading_eigenpairs(transition_matrix, k: int, stationary_distribution: Optional[np.ndarray] = None,
+                       reversible: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the k leading eigenvalues (largest in modulus) and right eigenvectors of a transition matrix.
+    The matrix is stored in sparse format and only the k eigenpairs are computed with an iterative Krylov solver:
+    Lanczos on the symmetrized matrix for reversible MSMs, Arnoldi otherwise (shift-invert mode if needed).
+    Small matrices fall back to a dense solver.
+
+    Parameters
+    ----------
+    transition_matrix : np.ndarray or scipy.sparse matrix
+        Transition matrix of the MSM
+    k : int
+        Number of eigenpairs
+    stationary_distribution : Optional[np.ndarray], optional
+        Stationary distribution, needed for the symmetrization of reversible MSMs, by default None
+    reversible : bool, optional
+        True if the MSM is reversible, by default False
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Eigenvalues sorted by decreasing modulus and correspondent right eigenvectors (columns)
+    """
+
+    T = scipy.sparse.csr_matrix(transition_matrix)
+    n = T.shape[0]
+    k = min(k, n)
+    symmetric = reversible and stationary_distribution is not None
+
+    if symmetric:
+        # D^1/2 T D^-1/2 is symmetric for reversible MSMs
+        sqrt_pi = np.sqrt(stationary_distribution)
+        S = scipy.sparse.diags(sqrt_pi) @ T @ scipy.sparse.diags(1/sqrt_pi)
+        S = (S + S.T)/2
+        if k < n - 1:
+            values, vectors = _krylov(eigsh, S, k)
+        else:
+            values, vectors = np.linalg.eigh(S.toarray())
+        vectors = vectors/sqrt_pi[:, None]
+
+    else:
+        if k < n - 1:
+            values, vectors = _krylov(eigs, T, k)
+        else:
+            values, vectors = np.linalg.eig(T.toarray())
+
+    order = np.argsort(-np.abs(values))[:k]
+    values, vectors = values[order], vectors[:, order]
+
+    # real MSM spectra are returned as real arrays
+    if np.allclose(np.imag(values), 0) and np.allclose(np.imag(vectors), 0):
+        values, vectors = np.real(values), np.real(vectors)
+
+    return values, vectors
+
+def sparse_implied_timescales(models, n_its: Optional[int] = None) -> ImpliedTimescales:
+    """
+    Compute the first n_its implied timescales of a list of MSMs with the sparse spectral backend.
+
+    Parameters
+    ----------
+    models : Models
+        List of MSMs
+    n_its : Optional[int], optional
+        Number of implied timescales (processes), by default None (DEFAULT_N_ITS)
+
+    Returns
+    -------
+    ImpliedTimescales
+        Implied timescales object
+    """
+
+    if n_its is None:
+        n_its = DEFAULT_N_ITS
+
+    lagtimes = []
+    its = []
+    for model in models:
+        values, _ = leading_eigenpairs(model.transition_matrix, n_its+1, model.stationary_distribution, model.reversible)
+        # skip the stationary eigenvalue
+        its.append(-model.lagtime/np.log(np.abs(values[1:])))
+        lagtimes.append(model.lagtime)
+
+    return ImpliedTimescales(lagtimes, its)
+
+def _fill_rotation(rotation_crop: np.ndarray, eigenvectors: np.ndarray) -> np.ndarray:
+    """
+    Complete the PCCA+ rotation matrix from its lower-right block, so that memberships sum to 1 and are non-negative
+    on the feasible set.
+
+    Parameters
+    ----------
+    rotation_crop : np.ndarray
+        Lower-right (n_states-1, n_states-1) block of the rotation matrix
+    eigenvectors : np.ndarray
+        Leading eigenvectors (n_microstates, n_states), the first one constant
+
+    Returns
+    -------
+    np.ndarray
+        Rotation matrix (n_states, n_states)
+    """
+
+    rotation = np.hstack([-rotation_crop.sum(axis=1, keepdims=True), rotation_crop])
+    first_row = np.max(-eigenvectors[:, 1:] @ rotation, axis=0, keepdims=True)
+
+    return np.vstack([first_row, rotation])/first_row.sum()
+
+def _optimize_rotation(eigenvectors: np.ndarray, rotation: np.ndarray) -> np.ndarray:
+    """
+    Optimize the PCCA+ rotation matrix starting from the inner simplex solution,
+    maximizing the crispness of the memberships (Roeblitz and Weber, Adv. Data Anal. Classif. 7, 147 (2013)).
+
+    Parameters
+    ----------
+    eigenvectors : np.ndarray
+        Leading eigenvectors (n_microstates, n_states), the first one constant
+    rotation : np.ndarray
+        Rotation matrix of the inner simplex algorithm (n_states, n_states)
+
+    Returns
+    -------
+    np.ndarray
+        Optimized rotation matrix: memberships are eigenvectors @ rotation
+    """
+
+    shape = (rotation.shape[0]-1, rotation.shape[1]-1)
+
+    def crispness(rotation_crop):
+        filled = _fill_rotation(rotation_crop.reshape(shape), eigenvectors)
+        return -np.sum(np.sum(filled**2, axis=0)/filled[0])
+
+    optimum = fmin(crispness, rotation[1:, 1:].ravel(), disp=False)
+
+    return _fill_rotation(optimum.reshape(shape), eigenvectors)
+
+def sparse_pcca(transition_matrix, stationary_distribution: np.ndarray, n_states: int,
+                reversible: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    PCCA+ memberships from the n_states leading eigenvectors of a transition matrix, computed with the sparse backend.
+    The inner simplex solution is optimized as in the dense backend (deeptime), so both give the same memberships
+    up to the accuracy of the eigensolvers.
+
+    Parameters
+    ----------
+    transition_matrix : np.ndarray or scipy.sparse matrix
+        Transition matrix of the MSM
+    stationary_distribution : np.ndarray
+        Stationary distribution of the MSM
+    n_states : int
+        Number of macrostates
+    reversible : bool, optional
+        True if the MSM is reversible, by default True
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Memberships (n_microstates, n_states), crisp assignments of the microstates and macrostates stationary probabilities
+    """
+
+    _, eigenvectors = leading_eigenpairs(transition_matrix, n_states, stationary_distribution, reversible)
+    eigenvectors = np.real(eigenvectors)
+    # the stationary right eigenvector is constant; the others are normalized with the stationary distribution
+    eigenvectors[:, 0] = 1.0
+    eigenvectors /= np.sqrt(np.einsum('ij,i,ij->j', eigenvectors, stationary_distribution, eigenvectors))
+
+    # inner simplex algorithm: representative states are the vertices of the eigenvector simplex
+    ortho_sys = eigenvectors.copy()
+    representatives = np.zeros(n_states, dtype=int)
+    representatives[0] = np.argmax(np.linalg.norm(eigenvectors, axis=1))
+    ortho_sys -= eigenvectors[representatives[0]]
+
+    for k in range(1, n_states):
+        temp = ortho_sys[representatives[k-1]].copy()
+        ortho_sys -= np.outer(ortho_sys @ temp, temp)
+        distances = np.linalg.norm(ortho_sys, axis=1)
+        distances[representatives[:k]] = -1
+        representatives[k] = np.argmax(distances)
+        ortho_sys /= np.linalg.norm(ortho_sys[representatives[k]])
+
+    rotation = np.linalg.inv(eigenvectors[representatives])
+    if n_states > 1:
+        rotation = _optimize_rotation(eigenvectors, rotation)
+
+    memberships = np.clip(eigenvectors @ rotation, 0, 1)
+    memberships /= memberships.sum(axis=1, keepdims=True)
+
+    assignments = np.argmax(memberships, axis=1)
+    coarse_stationary = memberships.T @ stationary_distribution
+
+    return memberships, assignments, coarse_stationary
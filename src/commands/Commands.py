@@ -2,26 +2,150 @@
 Available commands
 """
 import sys
+import threading
+import contextlib
+from contextvars import ContextVar
 
-# import the main analysis object
-from src.MarkovStates import System
+from typing import TYPE_CHECKING
 
-MSM = System()
+from src.tools import set_rendering, wait_rendering, set_profiling, profiling_report
+from src.tools.utils.errors import CommandError
+
+if TYPE_CHECKING:
+    from src.MarkovStates import System
+
+# default system of the program, created by the first command: the analysis modules are imported only then
+_default = {'system': None, 'interactive_mode': True}
+# the first commands of a scheduled batch run concurrently: the default system is created once
+_default_lock = threading.Lock()
+# system the commands are executed on: the default one, unless a driver runs several systems
+_current_system = ContextVar('current_system', default=None)
+
+def default_system() -> 'System':
+    """
+    Default system of the program (created on first use).
+    """
+
+    if _default['system'] is None:
+        from src.MarkovStates import System
+        with _default_lock:
+            if _default['system'] is None:
+                system = System()
+                system.interactive_mode = _default['interactive_mode']
+                _default['system'] = system
+
+    return _default['system']
+
+def set_default_interactive_mode(status: bool):
+    """
+    Set the interactive mode of the default system.
+    """
+
+    with _default_lock:
+        _default['interactive_mode'] = status
+        if _default['system'] is not None:
+            _default['system'].interactive_mode = status
+
+def current_system() -> 'System':
+    """
+    System the commands are executed on.
+    """
+
+    system = _current_system.get()
+    return default_system() if system is None else system
+
+@contextlib.contextmanager
+def use_system(system: 'System'):
+    """
+    Execute the commands of the context on a system.
+
+    Parameters
+    ----------
+    system : System
+        Analysis system
+    """
+
+    token = _current_system.set(system)
+    try:
+        yield system
+    finally:
+        _current_system.reset(token)
+
+def __getattr__(name):
+    # MSM: the default system, as a module attribute
+    if name == 'MSM':
+        return default_system()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+def bayesian(args):
+    """
+    Sample the posterior of Bayesian MSMs.
+    """
+
+    current_system().sample_posteriors(n_samples=args.n_samples, all_models=args.all, batch_size=args.batch_size,
+                                       effective=not args.sliding, n_jobs=args.n_jobs, seed=args.seed, file_prefix=args.out)
+
+def bootstrap(args):
+    """
+    Compute bootstrap confidence intervals of kinetics and stationary probabilities.
+    """
+
+    current_system().bootstrap(n_samples=args.n_samples, block_length=args.block, confidence=args.confidence,
+                               n_jobs=args.n_jobs, seed=args.seed, file_name=args.out)
+
+def cache(args):
+    """
+    Manage the result cache.
+    """
+
+    cache = current_system().cache
+    if args.cache_dir is not None:
+        cache.cache_dir = args.cache_dir
+    if args.max_size is not None:
+        cache.max_size_mb = args.max_size
+
+    if args.action == 'on':
+        cache.enabled = True
+        print('Result cache is on ({}).'.format(cache.cache_dir))
+    elif args.action == 'off':
+        cache.enabled = False
+        print('Result cache is off.')
+    elif args.action == 'clear':
+        cache.clear()
+    else:
+        cache.info()
 
 def center_info(args):
     """
     Print information about loaded centers.
     """
 
-    MSM.center_infos()
+    current_system().center_infos()
 
-def ck_test(args):
+def ck_test(args, ck_tests=None):
     """
-    Perform Chapman-Kolmogorov test.
+    Perform Chapman-Kolmogorov test (batch runs compute the tests with ck_tests before drawing them).
     """
 
     n_macrostate = args.n
-    MSM.ck_test(n_sets=n_macrostate)
+    current_system().ck_test(n_sets=n_macrostate, all_models=args.all, n_jobs=args.n_jobs, ck_tests=ck_tests)
+
+def ck_tests(args):
+    """
+    Compute the Chapman-Kolmogorov tests drawn by ck_test.
+    """
+
+    return current_system().ck_tests(n_sets=args.n, n_jobs=args.n_jobs)
+
+def discretize(args):
+    """
+    Discretize a trajectory with the loaded centers.
+    """
+
+    system = current_system()
+    if args.file is not None:
+        system.load_traj(file_name=args.file)
+    system.discretize(method=args.method, n_jobs=args.jobs, file_name=args.out)
 
 def kinetics(args):
     """
@@ -31,7 +155,14 @@ def kinetics(args):
     macrostate_A = args.A
     macrostate_B = args.B
 
-    MSM.compute_TPT_kinetics(macrostate_A, macrostate_B)
+    return current_system().compute_TPT_kinetics(macrostate_A, macrostate_B)
+
+def kinetics_matrix(args):
+    """
+    Compute kinetic analysis between all pairs of macrostates.
+    """
+
+    return current_system().compute_TPT_kinetics_matrix(all_models=args.all, file_name=args.out)
 
 def load_centers(args):
     """
@@ -39,7 +170,15 @@ def load_centers(args):
     """
 
     center_file = args.file
-    MSM.load_centers(file_name=center_file)
+    current_system().load_centers(file_name=center_file)
+
+def load_dtraj(args):
+    """
+    Load discretized trajectory file.
+    """
+
+    dtraj_file = args.file
+    current_system().load_dtraj(file_name=dtraj_file)
 
 def load_models(args):
     """
@@ -47,7 +186,15 @@ def load_models(args):
     """
 
     model_file = args.file
-    MSM.load_models(file_name=model_file)
+    current_system().load_models(file_name=model_file)
+
+def load_traj(args):
+    """
+    Load trajectory file.
+    """
+
+    traj_file = args.file
+    current_system().load_traj(file_name=traj_file)
 
 def mfpt(args):
     """
@@ -57,7 +204,14 @@ def mfpt(args):
     state_A = args.A
     state_B = args.B
 
-    MSM.compute_mfpt(state_A, state_B)
+    return current_system().compute_mfpt(state_A, state_B)
+
+def mfpt_matrix(args):
+    """
+    Compute the mean first passage times from all microstates to the target microstates.
+    """
+
+    return current_system().compute_mfpt_matrix(targets=args.targets or None, file_name=args.out)
 
 def pcca_assigments(args):
     """
@@ -65,7 +219,17 @@ def pcca_assigments(args):
     """
 
     n_state = args.n
-    MSM.pcca_compute_assignements(n_states=n_state)
+    system = current_system()
+    system.pcca_compute_assignements(n_states=n_state)
+
+    return system.assignements
+
+def plot_dtraj(args):
+    """
+    Plot the microstates visited by the trajectory.
+    """
+
+    current_system().plot_dtraj(bin=args.bins)
 
 def plot_its(args):
     """
@@ -73,30 +237,101 @@ def plot_its(args):
     """
 
     n_its = args.n_its
-    MSM.plot_its(n_its)
+    current_system().plot_its(n_its)
     
+def plot_traj(args):
+    """
+    Plot the PCCA+ memberships of the trajectory.
+    """
+
+    current_system().plot_traj(bin=args.bins)
+
+def profile(args):
+    """
+    Set the profiling of commands or print the profiling summary.
+    """
+
+    enabled = None if args.action == 'report' else args.action == 'on'
+    set_profiling(enabled=enabled, memory=False if args.no_memory else None, cprofile=True if args.cprofile else None,
+                  trace_file=args.trace_file, out_dir=args.out_dir)
+
+    if args.action == 'report':
+        profiling_report()
+
 def quit(args):
     """
     Terminate the program.
     """
 
+    wait_rendering()
+    profiling_report()
     print('Goodbye!')
     sys.exit()
 
+def render(args):
+    """
+    Set how figures are rendered.
+    """
+
+    set_rendering(headless=args.mode == 'file', out_dir=args.out_dir, formats=args.formats, dpi=args.dpi)
+
+def save_models(args):
+    """
+    Save the loaded models.
+    """
+
+    current_system().save_models(args.file_name, sparse=args.sparse, precision='float32' if args.float32 else 'float64')
+
 def select_model(args):
     """
     Select the MSM to analyze by the lagtime.
     """
 
     lagtime = args.lagtime
-    MSM.select_model(lagtime)
+    current_system().select_model(lagtime)
+
+def spectral_backend(args):
+    """
+    Set and/or print the spectral backend.
+    """
+
+    system = current_system()
+    if args.backend is not None:
+        system.spectral_backend = args.backend
+
+    print('\nSpectral backend is {}.'.format(system.spectral_backend))
+
+def sweep(args):
+    """
+    Generate microstates and MSMs for a grid of numbers of microstates and lagtimes.
+    """
+
+    system = current_system()
+    if args.centers is None or args.lagtimes is None:
+        msg = '\nNumbers of microstates and lagtimes are needed. Type \'sweep -h\' for the syntax!\n'
+        if system.interactive_mode:
+            print('Warning!', msg)
+            return
+        raise CommandError('sweep', message=msg)
+
+    return system.sweep(n_centers=args.centers, lagtimes=args.lagtimes, out_dir=args.out_dir, n_jobs=args.jobs,
+                        kmeans_jobs=args.kmeans_jobs)
 
 def timestep(args):
     """
     Set and/or print the timestep (in ns).
     """
 
+    system = current_system()
     if args.timestep is not None:
-        MSM.timestep_ns = args.timestep
+        system.timestep_ns = args.timestep
     
-    print('\nTimestep is {:.2e} ns.'.format(MSM.timestep_ns))
+    print('\nTimestep is {:.2e} ns.'.format(system.timestep_ns))
+
+def update(args):
+    """
+    Update the loaded MSMs with new trajectory files.
+    """
+
+    current_system().update(args.dir, columns=args.columns, stride=args.stride, method=args.method, n_jobs=args.jobs,
+                            ledger_file=args.ledger, init=args.init, file_name=args.out)
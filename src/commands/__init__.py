@@ -1,3 +1,5 @@
-from .command_parser import execute_command, interactive_mode, input_file
+from .command_parser import execute_command, parse_main_args, set_interactive_mode
 from src.commands.inputfile_parser import InputReader
+from src.commands.driver import run_systems
+from src.commands.server import serve, AnalysisServer
 from .Commands import *
\ No newline at end of file
@@ -3,10 +3,12 @@ Parser for the main program and available commands
 """
 
 import argparse
-from typing import Sequence
+import numpy as np
+from typing import Any, Optional, Sequence
 
 from .Commands import *
 from src.tools.utils.errors import CommandError
+from src.tools import set_profiling, profiled
 
 # command parser dictionary
 commands = {}
@@ -14,19 +16,67 @@ commands = {}
 # Main parser
 main_parser = argparse.ArgumentParser(description="MSManalysis by Luca S. and Luca B.", add_help=True)
 main_parser.add_argument("-i", dest="input_file", help="Input file with command instructions.", default=None, type=str, metavar='INPUT_FILE')
-main_args = main_parser.parse_args()
+main_parser.add_argument("-p", dest="profile", help="Profile every command: print a summary at the end and write a Chrome trace.", action='store_true')
+main_parser.add_argument("-b", dest="batch", help="Schedule the commands of the input file on their dependencies and run independent ones concurrently.", action='store_true')
+main_parser.add_argument("-j", dest="n_jobs", help="Number of worker threads of the batch mode. Default is the Python default.", default=None, type=int, metavar='N_JOBS')
+main_parser.add_argument("-m", dest="input_files", nargs='+', help="Input files (or glob patterns) of many systems, each run on its own system in a process pool.", default=None, metavar='INPUT_FILE')
+main_parser.add_argument("-w", dest="n_workers", help="Maximum number of systems run at once with '-m'. Default is all the available cores.", default=None, type=int, metavar='N_WORKERS')
+main_parser.add_argument("--logs", dest="log_dir", help="Directory of the log files of the runs with '-m'. Default is logs.", default='logs', type=str, metavar='LOG_DIR')
+main_parser.add_argument("--summary", dest="summary_file", help="Output .csv file of the kinetics of the runs with '-m'.", default=None, type=str, metavar='SUMMARY_FILE')
+main_parser.add_argument("--chdir", dest="chdir", help="Run each input file of '-m' from its directory.", action='store_true')
+main_parser.add_argument("--serve", dest="serve", help="Run the analysis server: clients execute commands on persistent sessions over HTTP (or a Unix socket).", action='store_true')
+main_parser.add_argument("--host", dest="host", help="HTTP host of the server. Default is 127.0.0.1.", default='127.0.0.1', type=str, metavar='HOST')
+main_parser.add_argument("--port", dest="port", help="HTTP port of the server. Default is 8765.", default=8765, type=int, metavar='PORT')
+main_parser.add_argument("--socket", dest="socket_file", help="Unix socket of the server, used instead of HTTP.", default=None, type=str, metavar='SOCKET')
 
-# Main parser argument
-input_file = main_args.input_file
+# the command line is parsed by the main program, not when the module is imported
+interactive_mode = True
 
-# activate reading mode
-if input_file is not None:
-    print('Reading commands from {}!'.format(input_file))
-    interactive_mode = False
-else:
-    interactive_mode = True
-# set the interactive mode status for the main program
-MSM.interactive_mode = interactive_mode
+def set_interactive_mode(status: bool):
+    """
+    Set the interactive mode of the command parser and of the default system.
+    In interactive mode errors print a warning, otherwise they stop the program.
+
+    Parameters
+    ----------
+    status : bool
+        The status of the interactive mode
+    """
+
+    global interactive_mode
+    interactive_mode = status
+    set_default_interactive_mode(status)
+
+def parse_main_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    """
+    Parse the arguments of the main program: the interactive mode is activated if no input file is given.
+
+    Parameters
+    ----------
+    argv : Optional[Sequence[str]], optional
+        Arguments, by default None (command line)
+
+    Returns
+    -------
+    argparse.Namespace
+        Main program arguments
+    """
+
+    main_args = main_parser.parse_args(argv)
+
+    # activate reading mode
+    if main_args.input_files is not None or main_args.serve:
+        set_interactive_mode(False)
+    elif main_args.input_file is not None:
+        print('Reading commands from {}!'.format(main_args.input_file))
+        set_interactive_mode(False)
+    else:
+        set_interactive_mode(True)
+
+    if main_args.profile:
+        set_profiling(True)
+
+    return main_args
 
 class MyArgumentParser(argparse.ArgumentParser):
     """
@@ -45,6 +95,27 @@ class MyArgumentParser(argparse.ArgumentParser):
             self.exit(2)
 
 
+def int_range(text: str) -> np.ndarray:
+    """
+    Convert a command argument into an array of integers.
+    Accepted formats are 'START:STOP[:STEP]' (as numpy.arange) and comma separated values 'N1,N2,...'.
+
+    Parameters
+    ----------
+    text : str
+        Command argument
+
+    Returns
+    -------
+    np.ndarray
+        Array of integers
+    """
+    if ':' in text:
+        return np.arange(*[int(value) for value in text.split(':')])
+    else:
+        return np.array([int(value) for value in text.split(',')])
+
+
 # Command Parser
 command_parser = MyArgumentParser(prog="", add_help=False, exit_on_error=False)
 command_subparsers = command_parser.add_subparsers(title='Available commands', 
@@ -54,6 +125,57 @@ command_subparsers = command_parser.add_subparsers(title='Available commands',
                                                    required=True) 
 
 
+# bayesian parser
+bayesian_parser = command_subparsers.add_parser('bayesian',
+                                                help='Sample the posterior of Bayesian MSMs.',
+                                                description="This command samples posterior transition matrices of the selected MSM (every loaded MSM with '--all').\n\
+                                                    Samples are drawn in batches by parallel processes and streamed to .npy files (PREFIX_lagLAGTIME_*.npy).\n\
+                                                    'plot_its', 'mfpt' and 'kinetics' then report 95% credible intervals for the sampled lagtimes.",
+                                                add_help=False)
+bayesian_parser.add_argument('n_samples', metavar='N_SAMPLES', type=int, nargs='?', default=1000, help='Number of posterior samples. Default is 1000')
+bayesian_parser.add_argument('-a', '--all', dest='all', action='store_true', help='Sample every loaded MSM.')
+bayesian_parser.add_argument('-b', '--batch_size', dest='batch_size', type=int, default=100, help='Number of samples of each job. Default is 100')
+bayesian_parser.add_argument('-j', '--jobs', dest='n_jobs', type=int, default=None, help='Number of processes. Default is all the available cores.')
+bayesian_parser.add_argument('--sliding', dest='sliding', action='store_true', help='Use sliding window counts as they are (by default they are divided by the lagtime).')
+bayesian_parser.add_argument('--seed', dest='seed', type=int, default=0, help='Random seed of non-reversible sampling. Default is 0.')
+bayesian_parser.add_argument('-o', '--out', dest='out', type=str, default='posterior', help='Prefix of the sample files. Default is posterior')
+bayesian_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+bayesian_parser.set_defaults(func=bayesian)
+commands['bayesian'] = bayesian_parser
+
+# bootstrap parser
+bootstrap_parser = command_subparsers.add_parser('bootstrap',
+                                                 help='Compute bootstrap confidence intervals of kinetics and stationary probabilities.',
+                                                 description="This command computes confidence intervals of stationary probabilities, mean first passage times (in ns)\n\
+                                                    and rates (in s^-1) between every pair of macrostates by refitting the selected MSM on resampled blocks of the discretized trajectory.\n\
+                                                    Blocks are the trajectory segments, or blocks of BLOCK frames with '-b'. Replicas are fitted in parallel processes.\n\
+                                                    A MSM must be selected with 'select_model' and its discretized trajectory loaded with 'load_dtraj'.",
+                                                 add_help=False)
+bootstrap_parser.add_argument('-n', '--samples', dest='n_samples', type=int, default=1000, help='Number of bootstrap replicas. Default is 1000.')
+bootstrap_parser.add_argument('-b', '--block', dest='block', type=int, default=None, help='Number of frames of each resampled block. Default is one block per segment.')
+bootstrap_parser.add_argument('-c', '--confidence', dest='confidence', type=float, default=0.95, help='Confidence level. Default is 0.95.')
+bootstrap_parser.add_argument('-j', '--jobs', dest='n_jobs', type=int, default=None, help='Number of processes. Default is all the available cores.')
+bootstrap_parser.add_argument('--seed', dest='seed', type=int, default=0, help='Random seed. Default is 0.')
+bootstrap_parser.add_argument('-o', '--out', dest='out', type=str, default=None, help='Output .npz file with estimates and bootstrap samples.')
+bootstrap_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+bootstrap_parser.set_defaults(func=bootstrap)
+commands['bootstrap'] = bootstrap_parser
+
+# cache parser
+cache_parser = command_subparsers.add_parser('cache',
+                                             help='Manage the on-disk cache of analysis results.',
+                                             description="This command manages the cache of analysis results (PCCA+, kinetics, mfpt and CK tests).\n\
+                                                Results are addressed by the content of the loaded models and centers files, the command arguments,\n\
+                                                the selected lagtime, timestep and PCCA+ assignements: rerunning a command on the same inputs replays the stored output.\n\
+                                                'on' and 'off' switch the cache (off by default), 'clear' removes every entry and 'info' prints the cache size.",
+                                             add_help=False)
+cache_parser.add_argument('action', metavar='ACTION', type=str, nargs='?', choices=['on', 'off', 'clear', 'info'], default='info', help="'on', 'off', 'clear' or 'info'. Default is 'info'")
+cache_parser.add_argument('-d', '--dir', dest='cache_dir', type=str, default=None, help='Cache directory. Default is .msm_cache')
+cache_parser.add_argument('-s', '--max_size', dest='max_size', type=float, default=None, help='Maximum cache size in MB; least recently used results are evicted. Default is 1024')
+cache_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+cache_parser.set_defaults(func=cache)
+commands['cache'] = cache_parser
+
 # center_info parser
 center_info_parser = command_subparsers.add_parser('center_info',
                                                    help='Print information on microstates.',
@@ -67,13 +189,31 @@ commands['center_info'] = center_info_parser
 ck_test_parser = command_subparsers.add_parser('ck_test',
                                                help='Perform Chapman-Kolmogorov analysis with a chosen number of macrostate.',
                                                description="This command perform Chapman-Kolmogorov analysis with a chosen set of macrostate.\n\
-                                                A MSM must be selected before with 'select_model'.",
+                                                A MSM must be selected before with 'select_model'.\n\
+                                                With '--all', every loaded MSM is tested and a table with the deviations between predictions and estimates is printed.",
                                                 add_help=False)
 ck_test_parser.add_argument('n', metavar='N_macrostates', type=int, nargs='?', default=2, help='Number of macrostates for CK analysis. Default is 2')
+ck_test_parser.add_argument('-a', '--all', dest='all', action='store_true', help='Test every loaded MSM.')
+ck_test_parser.add_argument('-j', '--n_jobs', dest='n_jobs', type=int, default=None, help='Number of threads.')
 ck_test_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
 ck_test_parser.set_defaults(func=ck_test)
 commands['ck_test'] = ck_test_parser
 
+# discretize parser
+discretize_parser = command_subparsers.add_parser('discretize',
+                                                  help='Discretize a trajectory with the loaded microstates.',
+                                                  description="This command assigns each frame of a trajectory to the nearest microstate and saves the discretized trajectory in .npy format.\n\
+                                                    If no trajectory file is provided, the loaded trajectory will be used.\n\
+                                                    Centers must be loaded before with 'load_centers'.",
+                                                  add_help=False)
+discretize_parser.add_argument('file', metavar='TRAJ_FILE', type=str, nargs='?', default=None, help='Trajectory file to discretize.')
+discretize_parser.add_argument('-m', '--method', dest='method', type=str, choices=['brute', 'kdtree'], default='brute', help="Assignment method. Default is 'brute'.")
+discretize_parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='Number of threads. Default is 1.')
+discretize_parser.add_argument('-o', '--out', dest='out', type=str, default=None, help="Output file. Default is 'dtraj_n.npy'.")
+discretize_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+discretize_parser.set_defaults(func=discretize)
+commands['discretize'] = discretize_parser
+
 # kinetics parser
 kinetics_parser = command_subparsers.add_parser('kinetics',
                                                 help='Compute kinetic analysis between two macrostate.',
@@ -87,6 +227,20 @@ kinetics_parser.add_argument("-h", "--help", action='store_true', help="Show hel
 kinetics_parser.set_defaults(func=kinetics)
 commands['kinetics'] = kinetics_parser
 
+# kinetics_matrix parser
+kinetics_matrix_parser = command_subparsers.add_parser('kinetics_matrix',
+                                                       help='Compute kinetic analysis between all pairs of macrostates.',
+                                                       description="This command computes mean first passage times (in ns) and rates (in s^-1) following TPT between every pair of macrostates.\n\
+                                                        If PCCA+ has not be performed, single microstates will be used.\n\
+                                                        With '--all', the same macrostates are used for every loaded MSM.\n\
+                                                        A MSM must be selected before with 'select_model'",
+                                                       add_help=False)
+kinetics_matrix_parser.add_argument('-a', '--all', dest='all', action='store_true', help='Compute kinetics for every loaded MSM.')
+kinetics_matrix_parser.add_argument('-o', '--out', dest='out', type=str, default=None, help='Output .npy file.')
+kinetics_matrix_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+kinetics_matrix_parser.set_defaults(func=kinetics_matrix)
+commands['kinetics_matrix'] = kinetics_matrix_parser
+
 # load_centers parser
 load_centers_parser = command_subparsers.add_parser('load_centers',
                                                     help='Load MSMs microstate from a file.',
@@ -97,16 +251,39 @@ load_centers_parser.add_argument("-h", "--help", action='store_true', help="Show
 load_centers_parser.set_defaults(func=load_centers)
 commands['load_centers'] = load_centers_parser
 
+# load_dtraj parser
+load_dtraj_parser = command_subparsers.add_parser('load_dtraj',
+                                                  help='Load a discretized trajectory from a file.',
+                                                  description='This command load a discretized trajectory from a .pkl or .npy file.\n\
+                                                    .npy files are memory-mapped and read from disk only when needed.',
+                                                  add_help=False)
+load_dtraj_parser.add_argument('file', metavar='DTRAJ_FILE', nargs='?', type=str, help='Discretized trajectory file')
+load_dtraj_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+load_dtraj_parser.set_defaults(func=load_dtraj)
+commands['load_dtraj'] = load_dtraj_parser
+
 # load_models parser
 load_models_parser = command_subparsers.add_parser('load_models',
                                                    help='Load MSMs from a file.',
-                                                   description='This command load MSMs from a .pkl file.',
+                                                   description="This command load MSMs from a .pkl file or from an indexed .npz archive (see 'save_models'),\n\
+                                                    whose MSMs are read only when they are used.",
                                                    add_help=False)
 load_models_parser.add_argument('file', metavar='MODELS_FILE', nargs='?', type=str, help='Models file')
 load_models_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
 load_models_parser.set_defaults(func=load_models)
 commands['load_models'] = load_models_parser
 
+# load_traj parser
+load_traj_parser = command_subparsers.add_parser('load_traj',
+                                                 help='Load a trajectory from a file.',
+                                                 description='This command load a trajectory from a .pkl or .npy file.\n\
+                                                    .npy files are memory-mapped and read from disk only when needed.',
+                                                 add_help=False)
+load_traj_parser.add_argument('file', metavar='TRAJ_FILE', nargs='?', type=str, help='Trajectory file')
+load_traj_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+load_traj_parser.set_defaults(func=load_traj)
+commands['load_traj'] = load_traj_parser
+
 # mfpt parser
 mfpt_parser = command_subparsers.add_parser('mfpt',
                                             help='Comute mean first passage times (in ns) between two microstates.',
@@ -119,6 +296,19 @@ mfpt_parser.add_argument("-h", "--help", action='store_true', help="Show help me
 mfpt_parser.set_defaults(func=mfpt)
 commands['mftp'] = mfpt_parser
 
+# mfpt_matrix parser
+mfpt_matrix_parser = command_subparsers.add_parser('mfpt_matrix',
+                                                   help='Compute mean first passage times (in ns) between all pairs of microstates.',
+                                                   description="This command computes mean first passage times (in ns) from every microstate to each target microstate.\n\
+                                                    If no target is provided, all microstates are used as targets. The matrix can be saved in .npy format.\n\
+                                                    A MSM must be selected before with 'select_model'",
+                                                   add_help=False)
+mfpt_matrix_parser.add_argument('targets', metavar='TARGETS', type=int, nargs='*', default=None, help='Target microstate ids. Default is all microstates.')
+mfpt_matrix_parser.add_argument('-o', '--out', dest='out', type=str, default=None, help='Output .npy file.')
+mfpt_matrix_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+mfpt_matrix_parser.set_defaults(func=mfpt_matrix)
+commands['mfpt_matrix'] = mfpt_matrix_parser
+
 # pcca_assigments_parser
 pcca_assigments_parser = command_subparsers.add_parser('pcca_assigments',
                                                        help='Perform PCCA+ with a chosen number of macrostates on a selected MSM.',
@@ -131,6 +321,17 @@ pcca_assigments_parser.add_argument("-h", "--help", action='store_true', help="S
 pcca_assigments_parser.set_defaults(func=pcca_assigments)
 commands['pcca_assigments'] = pcca_assigments_parser
 
+# plot_dtraj parser
+plot_dtraj_parser = command_subparsers.add_parser('plot_dtraj',
+                                                  help='Plot the microstates visited by the trajectory.',
+                                                  description='This command plots the most visited microstate in each bin of a 2D grid over the first two CVs\n\
+                                                    (frame index and CV for 1D trajectories). A trajectory and a discretized trajectory must be loaded.',
+                                                  add_help=False)
+plot_dtraj_parser.add_argument('-b', '--bins', dest='bins', type=int, default=100, help='Number of bins for each axis. Default is 100.')
+plot_dtraj_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+plot_dtraj_parser.set_defaults(func=plot_dtraj)
+commands['plot_dtraj'] = plot_dtraj_parser
+
 # plot_its
 plot_its_parser = command_subparsers.add_parser('plot_its',
                                                 help='Perform and plot the implied timescale analysis of a given number of eigenvalue.',
@@ -142,6 +343,33 @@ plot_its_parser.add_argument("-h", "--help", action='store_true', help="Show hel
 plot_its_parser.set_defaults(func=plot_its)
 commands['plot_its'] = plot_its_parser
 
+# plot_traj parser
+plot_traj_parser = command_subparsers.add_parser('plot_traj',
+                                                 help='Plot the PCCA+ memberships of the trajectory.',
+                                                 description='This command plots the mean PCCA+ membership of each metastable set in each bin of a 2D grid over the first two CVs\n\
+                                                    (frame index and CV for 1D trajectories). PCCA+ must be performed before with \'pcca_assigments\'.',
+                                                 add_help=False)
+plot_traj_parser.add_argument('-b', '--bins', dest='bins', type=int, default=100, help='Number of bins for each axis. Default is 100.')
+plot_traj_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+plot_traj_parser.set_defaults(func=plot_traj)
+commands['plot_traj'] = plot_traj_parser
+
+# profile parser
+profile_parser = command_subparsers.add_parser('profile',
+                                               help='Profile the executed commands.',
+                                               description="This command records wall time, CPU time and memory of every executed command.\n\
+                                                'on' and 'off' switch profiling (off by default, or on with 'main.py -p'), 'report' prints the summary table and writes\n\
+                                                the Chrome trace (chrome://tracing or Perfetto); the report is also printed at 'quit'.",
+                                               add_help=False)
+profile_parser.add_argument('action', metavar='ACTION', type=str, nargs='?', choices=['on', 'off', 'report'], default='report', help="'on', 'off' or 'report'. Default is 'report'")
+profile_parser.add_argument('-o', '--trace', dest='trace_file', type=str, default=None, help='Output file of the Chrome trace. Default is msm_trace.json')
+profile_parser.add_argument('-c', '--cprofile', dest='cprofile', action='store_true', help='Save cProfile statistics of each command.')
+profile_parser.add_argument('-d', '--dir', dest='out_dir', type=str, default=None, help='Output directory of cProfile statistics. Default is profiles')
+profile_parser.add_argument('--no_memory', dest='no_memory', action='store_true', help='Do not trace memory allocations (lower overhead).')
+profile_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+profile_parser.set_defaults(func=profile)
+commands['profile'] = profile_parser
+
 # quit parser
 quit_parser = command_subparsers.add_parser('quit',
                                             help='Terminate the program.',
@@ -151,6 +379,34 @@ quit_parser.add_argument("-h", "--help", action='store_true', help="Show help me
 quit_parser.set_defaults(func=quit)
 commands['quit'] = quit_parser
 
+# render parser
+render_parser = command_subparsers.add_parser('render',
+                                              help='Set how figures are rendered.',
+                                              description="This command sets how figures are rendered: 'screen' shows figures on screen,\n\
+                                                'file' renders figures off-screen and saves them in the output directory while the next commands are executed.",
+                                              add_help=False)
+render_parser.add_argument('mode', metavar='MODE', type=str, nargs='?', choices=['screen', 'file'], default='file', help="'screen' or 'file'. Default is 'file'")
+render_parser.add_argument('-o', '--out_dir', dest='out_dir', type=str, default=None, help='Output directory of figures.')
+render_parser.add_argument('-f', '--formats', dest='formats', type=str, nargs='+', default=None, help='File formats of figures (e.g. png svg pdf).')
+render_parser.add_argument('--dpi', dest='dpi', type=int, default=None, help='Resolution of raster figures.')
+render_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+render_parser.set_defaults(func=render)
+commands['render'] = render_parser
+
+# save_models parser
+save_models_parser = command_subparsers.add_parser('save_models',
+                                                   help='Save the loaded models.',
+                                                   description="This command saves the loaded models in .pkl format or, if the file name ends with '.npz',\n\
+                                                    in an indexed archive: when loaded with 'load_models', MSMs are read only when they are used.\n\
+                                                    Archive matrices can be stored in sparse format and single precision (converted back to double precision when loaded).",
+                                                   add_help=False)
+save_models_parser.add_argument('file_name', metavar='FILE', type=str, help='Models file (.pkl or .npz).')
+save_models_parser.add_argument('-s', '--sparse', dest='sparse', action='store_true', help='Store count and transition matrices in sparse format (.npz only).')
+save_models_parser.add_argument('--float32', dest='float32', action='store_true', help='Store count and transition matrices in single precision (.npz only).')
+save_models_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+save_models_parser.set_defaults(func=save_models)
+commands['save_models'] = save_models_parser
+
 #select_model
 select_model_parser = command_subparsers.add_parser('select_model',
                                                     help='Select the MSM to analyze choosing the lagtime (in step units).',
@@ -162,6 +418,35 @@ select_model_parser.add_argument("-h", "--help", dest='help', action='store_true
 select_model_parser.set_defaults(func=select_model)
 commands['select_model'] = select_model_parser
 
+# spectral_backend parser
+spectral_backend_parser = command_subparsers.add_parser('spectral_backend',
+                                                        help='Set the backend used for implied timescales and PCCA+.',
+                                                        description="This command sets the spectral backend: 'dense' computes the full eigendecomposition of transition matrices,\n\
+                                                            'sparse' uses sparse matrices and computes only the leading eigenpairs (for MSMs with many microstates).\n\
+                                                            If no backend is provided, it will print the active backend.",
+                                                        add_help=False)
+spectral_backend_parser.add_argument('backend', metavar='BACKEND', type=str, nargs='?', choices=['dense', 'sparse'], default=None, help="'dense' or 'sparse'.")
+spectral_backend_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+spectral_backend_parser.set_defaults(func=spectral_backend)
+commands['spectral_backend'] = spectral_backend_parser
+
+# sweep parser
+sweep_parser = command_subparsers.add_parser('sweep',
+                                             help='Generate MSMs for a grid of numbers of microstates and lagtimes.',
+                                             description="This command clusters the loaded trajectory with each number of microstates and generates MSMs at each lagtime.\n\
+                                                Jobs run in parallel on a process pool. Centers, discretized trajectories and models are saved in the output directory,\n\
+                                                together with an index of the results ('sweep_index.pkl').\n\
+                                                A trajectory must be loaded before with 'load_traj'.",
+                                             add_help=False)
+sweep_parser.add_argument('centers', metavar='N_CENTERS', type=int_range, nargs='?', help="Numbers of microstates, as 'START:STOP[:STEP]' or 'N1,N2,...'.")
+sweep_parser.add_argument('lagtimes', metavar='LAGTIMES', type=int_range, nargs='?', help="Lagtimes (in step units), as 'START:STOP[:STEP]' or 'LT1,LT2,...'.")
+sweep_parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None, help='Number of worker processes. Default is all available cores.')
+sweep_parser.add_argument('-k', '--kmeans-jobs', dest='kmeans_jobs', type=int, default=1, help='Number of threads of each KMeans clustering. Default is 1.')
+sweep_parser.add_argument('-o', '--out', dest='out_dir', type=str, default='.', help='Output directory. Default is the current directory.')
+sweep_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+sweep_parser.set_defaults(func=sweep)
+commands['sweep'] = sweep_parser
+
 # timestep parser
 timestep_parser = command_subparsers.add_parser('timestep',
                                                 help='Set the conversion unit between step units and ns.',
@@ -173,8 +458,29 @@ timestep_parser.add_argument("-h", "--help", action='store_true', help="Show hel
 timestep_parser.set_defaults(func=timestep)
 commands['timestep'] = timestep_parser
 
+# update parser
+update_parser = command_subparsers.add_parser('update',
+                                              help='Update the loaded MSMs with new trajectory files.',
+                                              description="This command discretizes the trajectory files of a directory that were not processed yet with the loaded centers,\n\
+                                                adds their transitions to the count matrices of the loaded MSMs and fits the MSMs again. The selected MSM, PCCA+ assigments\n\
+                                                and TPT kinetics are computed again. Processed files are recorded in a ledger file: use '--init' once to record the files\n\
+                                                already in the MSMs. The ledger belongs to the saved models: the ledger of other models is refused.\n\
+                                                Models and centers must be loaded before with 'load_models' and 'load_centers'.",
+                                              add_help=False)
+update_parser.add_argument('dir', metavar='DIR', type=str, help='Directory of the trajectory files.')
+update_parser.add_argument('-c', '--columns', dest='columns', type=int, nargs='+', default=None, help='Indices of the columns (CVs) to load. Default is all columns.')
+update_parser.add_argument('-s', '--stride', dest='stride', type=int, default=1, help='Load one row every STRIDE rows. Default is 1.')
+update_parser.add_argument('-m', '--method', dest='method', type=str, choices=['brute', 'kdtree'], default='brute', help="Discretization method. Default is 'brute'.")
+update_parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='Number of processes reading files. Default is 1.')
+update_parser.add_argument('-l', '--ledger', dest='ledger', type=str, default='processed_files.json', help='Ledger of the processed files. Default is processed_files.json')
+update_parser.add_argument('--init', dest='init', action='store_true', help='Only record the files in DIR as processed.')
+update_parser.add_argument('-o', '--out', dest='out', type=str, default=None, help="Output file of the updated models (.pkl or .npz). Default is 'models_N.pkl'.")
+update_parser.add_argument("-h", "--help", action='store_true', help="Show help message.")
+update_parser.set_defaults(func=update)
+commands['update'] = update_parser
+
 # command execution function
-def execute_command(command_line: Sequence[str]):
+def execute_command(command_line: Sequence[str], **kwargs) -> Any:
     """
     Execute a command line.
 
@@ -182,6 +488,13 @@ def execute_command(command_line: Sequence[str]):
     ----------
     command : Sequence[str]
         Command line to be executed
+    kwargs : dict
+        Keyword arguments of the command function (e.g. results computed before by a batch run)
+
+    Returns
+    -------
+    Any
+        Result of the command, if any (e.g. MFPTs of 'mftp', PCCA+ assignements of 'pcca_assigments')
     """
     command = command_line[0]
     if command in commands.keys():
@@ -191,7 +504,8 @@ def execute_command(command_line: Sequence[str]):
         if args.help:
             parser.print_help()
         else:
-            args.func(args)
+            with profiled(command_line):
+                return args.func(args, **kwargs)
     
     else:
         msg = f'Command {command} not found.'
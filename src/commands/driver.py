@@ -0,0 +1,198 @@
+"""
+Driver running the input files of many systems in parallel processes
+"""
+import os
+import csv
+import glob
+import time
+import traceback
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tabulate import tabulate
+from typing import List, Optional, Sequence
+
+from src.tools import rendering_session, profiling_session
+from .Commands import use_system
+from .inputfile_parser import InputReader
+
+
+def expand_input_files(patterns: Sequence[str]) -> List[str]:
+    """
+    Expand input files and glob patterns, keeping the given order and dropping duplicates.
+
+    Parameters
+    ----------
+    patterns : Sequence[str]
+        Input files or glob patterns
+
+    Returns
+    -------
+    List[str]
+        Input files
+    """
+
+    input_files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            print('Warning! No input file matches {}.'.format(pattern))
+        for match in matches:
+            if match not in input_files:
+                input_files.append(match)
+
+    return input_files
+
+def _log_name(index: int, input_file: str) -> str:
+    # input files of different systems often share the name (e.g. mutant_A/input.in, mutant_B/input.in)
+    name = os.path.splitext(os.path.normpath(input_file))[0].replace(os.sep, '_').strip('._')
+    return '{:03d}_{}.log'.format(index, name)
+
+def run_input_file(input_file: str, log_file: str, scheduled: bool = False, n_jobs: Optional[int] = None,
+                   chdir: bool = False) -> dict:
+    """
+    Execute an input file on a new system, writing the output to a log file.
+    Figures, Chrome trace and cProfile statistics of the run are saved in a directory named as the log file (without extension).
+    Errors and exits (e.g. 'quit') of the input file are caught and reported in the returned status.
+
+    Parameters
+    ----------
+    input_file : str
+        Input file
+    log_file : str
+        Output log file
+    scheduled : bool, optional
+        If true, the commands are scheduled on their dependencies (as main.py -b), by default False
+    n_jobs : Optional[int], optional
+        Number of worker threads of the scheduled mode, by default None
+    chdir : bool, optional
+        If true, the input file is executed from its directory, by default False
+
+    Returns
+    -------
+    dict
+        Input file, log file, status, wall time (s) and computed kinetics of the run
+    """
+
+    input_file, log_file = os.path.abspath(input_file), os.path.abspath(log_file)
+    cwd = os.getcwd()
+    if chdir:
+        os.chdir(os.path.dirname(input_file))
+
+    from src.MarkovStates import System
+
+    system = System()
+    status = 'done'
+    start = time.perf_counter()
+    # figures and profiles of the run are saved next to its log: runs sharing a directory would overwrite them
+    run_dir = os.path.splitext(log_file)[0]
+    with open(log_file, 'w') as log, contextlib.redirect_stdout(log), use_system(system):
+        print('Reading commands from {}!'.format(input_file))
+        try:
+            # worker processes run several input files: settings changed by a run are restored at its end
+            with rendering_session(run_dir), \
+                 profiling_session(os.path.join(run_dir, 'msm_trace.json'), os.path.join(run_dir, 'profiles')):
+                reader = InputReader(input_file=input_file)
+                if scheduled:
+                    reader.read_and_schedule(n_jobs=n_jobs)
+                else:
+                    reader.read_and_execute()
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                status = 'exit {}'.format(e.code)
+        except Exception as e:
+            traceback.print_exc(file=log)
+            message = str(e).strip().splitlines()
+            status = 'error: {}'.format(message[0] if message else type(e).__name__)
+        finally:
+            os.chdir(cwd)
+
+    return {'input_file': input_file, 'log_file': log_file, 'status': status,
+            'wall_s': time.perf_counter() - start, 'kinetics': system.kinetics_results}
+
+def run_systems(patterns: Sequence[str], n_workers: Optional[int] = None, log_dir: str = 'logs',
+                summary_file: Optional[str] = None, scheduled: bool = False, n_jobs: Optional[int] = None,
+                chdir: bool = False) -> List[dict]:
+    """
+    Execute the input files of many systems in a process pool: each input file runs on its own system,
+    with its output in a log file. A summary of the runs and of the computed kinetics is printed at the end.
+
+    Parameters
+    ----------
+    patterns : Sequence[str]
+        Input files or glob patterns
+    n_workers : Optional[int], optional
+        Maximum number of systems analyzed at once, by default None (all the available cores)
+    log_dir : str, optional
+        Directory of the log files, by default 'logs'
+    summary_file : Optional[str], optional
+        If provided, the kinetics summary is saved in .csv format, by default None
+    scheduled : bool, optional
+        If true, the commands of each input file are scheduled on their dependencies, by default False
+    n_jobs : Optional[int], optional
+        Number of worker threads of the scheduled mode, by default None
+    chdir : bool, optional
+        If true, each input file is executed from its directory, by default False
+
+    Returns
+    -------
+    List[dict]
+        Results of the runs (see run_input_file), in input order
+    """
+
+    input_files = expand_input_files(patterns)
+    if not input_files:
+        print('Warning! No input files to run.')
+        return []
+
+    os.makedirs(log_dir, exist_ok=True)
+    log_files = [os.path.join(log_dir, _log_name(i, input_file)) for i, input_file in enumerate(input_files)]
+    print('Running {} input files with {} processes, logs in {}.'.format(len(input_files), n_workers or os.cpu_count(), log_dir))
+
+    # workers are forked: the command line is not parsed again as in spawned processes,
+    # and the analysis and plotting modules imported once here are shared by every run
+    import src.MarkovStates
+    import matplotlib.pyplot
+
+    results = [None]*len(input_files)
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('fork')) as executor:
+        jobs = {executor.submit(run_input_file, input_file, log_file, scheduled, n_jobs, chdir): i
+                for i, (input_file, log_file) in enumerate(zip(input_files, log_files))}
+        for job in as_completed(jobs):
+            i = jobs[job]
+            try:
+                results[i] = job.result()
+            except Exception as e:
+                # the worker process died (e.g. out of memory)
+                results[i] = {'input_file': os.path.abspath(input_files[i]), 'log_file': os.path.abspath(log_files[i]),
+                              'status': 'failed: {}'.format(type(e).__name__), 'wall_s': float('nan'), 'kinetics': []}
+            print('[{}/{}] {}: {} ({:.1f} s)'.format(sum(r is not None for r in results), len(input_files), input_files[i],
+                                                     results[i]['status'], results[i]['wall_s']))
+
+    print('\n### Runs ###')
+    print(tabulate([[input_file, result['status'], result['wall_s'], log_file]
+                    for input_file, log_file, result in zip(input_files, log_files, results)],
+                   headers=['Input file', 'Status', 'Wall (s)', 'Log'], floatfmt='.1f'))
+
+    rows = [[input_file, k['lagtime'], '{:.2e}'.format(k['lagtime_ns']), '{} --> {}'.format(k['from'], k['to']),
+             '{:.2f}'.format(k['mfpt_ns']), '{:.2e}'.format(k['rate'])]
+            for input_file, result in zip(input_files, results) for k in result['kinetics']]
+    if rows:
+        print('\n### Kinetics ###')
+        print(tabulate(rows, headers=['Input file', 'Lagtime', 'Lagtime (ns)', 'Transition', 'MFPT (ns)', 'Rate (s^-1)'],
+                       disable_numparse=True))
+    else:
+        print('\nNo kinetics computed.')
+
+    if summary_file is not None:
+        with open(summary_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['input_file', 'status', 'lagtime', 'lagtime_ns', 'from', 'to', 'mfpt_ns', 'rate_s-1'])
+            for input_file, result in zip(input_files, results):
+                for k in result['kinetics']:
+                    writer.writerow([input_file, result['status'], k['lagtime'], k['lagtime_ns'], k['from'], k['to'],
+                                     k['mfpt_ns'], k['rate']])
+        print('Kinetics summary saved in {}.'.format(summary_file))
+
+    return results
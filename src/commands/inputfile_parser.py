@@ -1,8 +1,10 @@
 """
 Input module for input file parsing and execution.
 """
+from typing import List, Optional, Tuple
 
 from .command_parser import execute_command
+from .scheduler import BatchScheduler, parse_batch
 
 class InputReader:
 
@@ -10,6 +12,27 @@ class InputReader:
 
         self.input_file = input_file
 
+    def read_commands(self) -> List[Tuple[int, List[str]]]:
+        """
+        Read the command lines of the input file.
+
+        Returns
+        -------
+        List[Tuple[int, List[str]]]
+            Line numbers and command lines
+        """
+
+        command_lines = []
+        with open(self.input_file) as f:
+
+            for n, line in enumerate(f, start=1):
+
+                command_line = line.split("#", 1)[0].strip() # ignore comments that start with '#'
+
+                if command_line:
+                    command_lines.append((n, command_line.split()))
+
+        return command_lines
     
     def read_and_execute(self):
 
@@ -21,4 +44,18 @@ class InputReader:
 
                 if command_line:
                     print('\n>', command_line)                    
-                    execute_command(command_line.split())
\ No newline at end of file
+                    execute_command(command_line.split())
+
+    def read_and_schedule(self, n_jobs: Optional[int] = None):
+        """
+        Parse the whole input file and execute it on the dependency graph of its commands:
+        independent commands run concurrently and their output is printed in input order.
+
+        Parameters
+        ----------
+        n_jobs : Optional[int], optional
+            Number of worker threads, by default None
+        """
+
+        batch = parse_batch(self.read_commands())
+        BatchScheduler(n_jobs=n_jobs).run(batch)
\ No newline at end of file
@@ -0,0 +1,253 @@
+"""
+Batch execution of input files: commands are scheduled on a dependency graph and independent ones run concurrently.
+"""
+import sys
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .command_parser import execute_command, commands
+from .Commands import ck_tests
+from src.tools.utils.errors import CommandError
+from src.tools import capture_output, profiled
+
+# state of the analysis: every command reads and/or writes some of these resources
+RESOURCES = frozenset(['models', 'selected', 'centers', 'dtraj', 'traj', 'assignements', 'posteriors',
+                       'timestep', 'kinetics', 'settings', 'figures'])
+
+def _access(reads: Sequence[str] = (), writes: Sequence[str] = (), main_thread: bool = False) -> Tuple[frozenset, frozenset, bool]:
+    # every command depends on the settings (cache, profiling, spectral backend, rendering)
+    return frozenset(reads) | {'settings'}, frozenset(writes), main_thread
+
+# resources read and written by each command (cached commands also read the posteriors, whose files are in the cache key)
+# TPT kinetics are recorded for the summary of multi-system runs: they are written in input order
+# commands plotting figures run in the main thread, one at a time
+ACCESS = {
+    'bayesian': _access(['models', 'selected'], ['posteriors']),
+    'bootstrap': _access(['selected', 'dtraj', 'assignements', 'timestep']),
+    'cache': _access(writes=['settings']),
+    'center_info': _access(['centers']),
+    'ck_test': _access(['models', 'selected', 'posteriors'], ['figures'], main_thread=True),
+    'discretize': _access(['centers'], ['traj', 'dtraj']),
+    'kinetics': _access(['selected', 'centers', 'assignements', 'timestep', 'posteriors'], ['kinetics']),
+    'kinetics_matrix': _access(['models', 'selected', 'centers', 'assignements', 'timestep', 'posteriors'], ['kinetics']),
+    'load_centers': _access(['models'], ['centers']),
+    'load_dtraj': _access(writes=['dtraj']),
+    'load_models': _access(writes=['models', 'selected', 'centers', 'posteriors']),
+    'load_traj': _access(writes=['traj']),
+    'mftp': _access(['selected', 'timestep', 'posteriors']),
+    'mfpt_matrix': _access(['selected', 'timestep', 'posteriors']),
+    'pcca_assigments': _access(['selected', 'centers', 'posteriors'], ['assignements']),
+    'plot_dtraj': _access(['traj', 'dtraj'], ['figures'], main_thread=True),
+    'plot_its': _access(['models', 'posteriors'], ['figures'], main_thread=True),
+    'plot_traj': _access(['traj', 'dtraj', 'selected', 'assignements'], ['figures'], main_thread=True),
+    'profile': _access(writes=['settings'], main_thread=True),
+    'quit': _access(writes=RESOURCES, main_thread=True),
+    'render': _access(writes=['settings', 'figures'], main_thread=True),
+    'save_models': _access(['models']),
+    'select_model': _access(['models'], ['selected']),
+    'spectral_backend': _access(writes=['settings']),
+    'sweep': _access(['traj']),
+    'timestep': _access(writes=['timestep']),
+    'update': _access(['centers', 'timestep'], ['models', 'selected', 'assignements', 'dtraj', 'traj', 'posteriors', 'kinetics']),
+}
+
+def _ck_test_stage(args) -> Optional[Callable[[], dict]]:
+    # with '--all' only a table is printed
+    if args.all:
+        return None
+    return lambda: {'ck_tests': ck_tests(args)}
+
+# plotting commands whose computation runs in the pool, before the main thread draws the figure:
+# function of the parsed arguments returning the computation (which returns the keyword arguments of the command),
+# None if the command draws no figure
+STAGES = {
+    'ck_test': _ck_test_stage,
+}
+
+class BatchCommand(NamedTuple):
+    """
+    Command of a batch: line number, command line and accessed resources.
+    A staged command is split in a computation (compute) and in the drawing, which waits for it (stage, its index).
+    """
+    line: int
+    command_line: List[str]
+    reads: frozenset
+    writes: frozenset
+    main_thread: bool
+    compute: Optional[Callable[[], dict]] = None
+    stage: Optional[int] = None
+
+
+def parse_batch(command_lines: Sequence[Tuple[int, List[str]]]) -> List[BatchCommand]:
+    """
+    Check the commands of a batch before executing any of them.
+    Commands missing from the access table (e.g. commands added later) conservatively access every resource.
+
+    Parameters
+    ----------
+    command_lines : Sequence[Tuple[int, List[str]]]
+        Line numbers and command lines
+
+    Returns
+    -------
+    List[BatchCommand]
+        Parsed commands
+    """
+
+    batch = []
+    for line, command_line in command_lines:
+        if command_line[0] not in commands:
+            raise CommandError(command_line[0], "Command '{}' not found (line {})!".format(command_line[0], line))
+        # parsing errors exit before anything is executed
+        args, _ = commands[command_line[0]].parse_known_args(command_line[1:])
+
+        reads, writes, main_thread = ACCESS.get(command_line[0], (RESOURCES, RESOURCES, True))
+        if command_line[0] in STAGES and not args.help:
+            compute = STAGES[command_line[0]](args)
+            if compute is None:
+                # no figure is drawn
+                batch.append(BatchCommand(line, command_line, reads, writes - {'figures'}, False))
+            else:
+                batch.append(BatchCommand(line, command_line, reads, frozenset(), False, compute=compute))
+                batch.append(BatchCommand(line, command_line, reads, writes, main_thread, stage=len(batch) - 1))
+            continue
+
+        batch.append(BatchCommand(line, command_line, reads, writes, main_thread))
+
+    return batch
+
+def dependency_graph(batch: Sequence[BatchCommand]) -> List[set]:
+    """
+    Dependencies of each command of a batch: a command waits for the last previous command writing a resource
+    it accesses, and a command writing a resource also waits for the previous commands reading it.
+    The drawing of a staged command waits for its computation.
+
+    Parameters
+    ----------
+    batch : Sequence[BatchCommand]
+        Parsed commands
+
+    Returns
+    -------
+    List[set]
+        Indices of the commands each command depends on
+    """
+
+    last_writer: Dict[str, int] = {}
+    readers: Dict[str, List[int]] = {resource: [] for resource in RESOURCES}
+
+    dependencies = []
+    for i, command in enumerate(batch):
+        depends = {last_writer[resource] for resource in command.reads | command.writes if resource in last_writer}
+        for resource in command.writes:
+            depends.update(readers[resource])
+        if command.stage is not None:
+            depends.add(command.stage)
+        dependencies.append(depends)
+
+        for resource in command.reads - command.writes:
+            readers[resource].append(i)
+        for resource in command.writes:
+            last_writer[resource] = i
+            readers[resource] = []
+
+    return dependencies
+
+
+class BatchScheduler:
+    """
+    Execute a batch of commands on a dependency graph. Independent commands run concurrently in a thread pool
+    and their output is printed in input order.
+    """
+
+    def __init__(self, n_jobs: Optional[int] = None):
+        """
+        Parameters
+        ----------
+        n_jobs : Optional[int], optional
+            Number of worker threads, by default None (as ThreadPoolExecutor)
+        """
+
+        self.n_jobs = n_jobs
+
+    @staticmethod
+    def _run(command: BatchCommand, kwargs: Optional[dict] = None) -> Tuple[str, Optional[BaseException], Any]:
+        """
+        Execute a command (or the computation of a staged command) capturing its output.
+        """
+
+        error, result = None, None
+        with capture_output() as record:
+            # the command line of a staged command is printed by its computation
+            if command.stage is None:
+                print('\n>', ' '.join(command.command_line))
+            try:
+                if command.compute is not None:
+                    with profiled(command.command_line + ['(computation)']):
+                        result = command.compute()
+                else:
+                    execute_command(command.command_line, **(kwargs or {}))
+            except BaseException as e:
+                error = e
+
+        return ''.join(record), error, result
+
+    def run(self, batch: Sequence[BatchCommand]):
+        """
+        Execute a batch of commands. The first failing command (in input order) stops the batch:
+        no later command is started, and its exception is raised after the output of the previous commands.
+
+        Parameters
+        ----------
+        batch : Sequence[BatchCommand]
+            Parsed commands
+        """
+
+        dependencies = dependency_graph(batch)
+        waiting = list(range(len(batch)))
+        results = {}
+        # keyword arguments of the drawings computed by staged commands
+        computed = {}
+        running = {}
+        printed = 0
+        failed = len(batch)
+
+        with ThreadPoolExecutor(max_workers=self.n_jobs, thread_name_prefix='batch') as executor:
+            while printed < len(batch):
+                # start the commands whose dependencies are done (commands before a failure always run)
+                ready = [i for i in waiting if i < failed and dependencies[i] <= results.keys()]
+                for i in ready:
+                    waiting.remove(i)
+                    if not batch[i].main_thread:
+                        # workers execute on the system of the scheduler
+                        running[executor.submit(contextvars.copy_context().run, self._run, batch[i])] = i
+
+                main_thread = [i for i in ready if batch[i].main_thread]
+                for i in main_thread:
+                    if i > failed:
+                        waiting.append(i)
+                        continue
+                    results[i] = self._run(batch[i], computed.pop(batch[i].stage, None))
+                    if results[i][1] is not None:
+                        failed = min(failed, i)
+
+                # without commands to run in the main thread, wait for a worker
+                if running and not main_thread:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i = running.pop(future)
+                        results[i] = future.result()
+                        if batch[i].compute is not None:
+                            computed[i] = results[i][2]
+                        if results[i][1] is not None:
+                            failed = min(failed, i)
+
+                # print the output in input order
+                while printed in results:
+                    output, error, _ = results[printed]
+                    sys.stdout.write(output)
+                    if error is not None:
+                        raise error
+                    printed += 1
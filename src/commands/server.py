@@ -0,0 +1,335 @@
+"""
+Analysis server: named sessions keep their systems (models, centers, PCCA+, cached spectra) in memory
+and execute commands sent over HTTP or a local Unix socket.
+"""
+import os
+import json
+import time
+import math
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from typing import Any, Dict, List, Optional, Union
+
+from src.tools import capture_output, set_rendering, wait_rendering
+from .Commands import use_system
+from .command_parser import commands, execute_command, set_interactive_mode
+from .scheduler import ACCESS
+
+# commands changing process-wide settings (or stopping the process), which would affect every session
+UNAVAILABLE = {'quit': 'close the session instead',
+               'render': 'figures of the server are always saved to file',
+               'profile': 'profiling settings are shared by all the sessions'}
+
+def to_json(value: Any) -> Any:
+    """
+    Convert a command result to JSON types: arrays to (nested) lists, structured arrays to objects of lists,
+    non-finite numbers to null.
+
+    Parameters
+    ----------
+    value : Any
+        Command result
+
+    Returns
+    -------
+    Any
+        JSON serializable result
+    """
+
+    if isinstance(value, np.ndarray):
+        if value.dtype.names is not None:
+            return {name: to_json(value[name]) for name in value.dtype.names}
+        return to_json(value.tolist())
+    if isinstance(value, np.generic):
+        return to_json(value.item())
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {str(key): to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    return repr(value)
+
+
+class Session:
+    """
+    Named analysis session: a system and the lock queuing its commands.
+    """
+
+    def __init__(self, name: str):
+        """
+        Parameters
+        ----------
+        name : str
+            Session name
+        """
+
+        from src.MarkovStates import System
+
+        self.name = name
+        self.system = System()
+        self.lock = threading.Lock()
+        self.created = time.time()
+        self.n_commands = 0
+
+    def info(self) -> dict:
+        """
+        Summary of the session state.
+        """
+
+        system = self.system
+        return {'name': self.name, 'commands': self.n_commands, 'busy': self.lock.locked(),
+                'models': len(system.models) if system.models is not None else 0,
+                'centers': len(system.centers) if system.centers is not None else 0,
+                'lagtime': system._lagtime if system._test_model is not None else None,
+                'macrostates': len(system.assignements) if system.assignements is not None else 0}
+
+
+class AnalysisServer:
+    """
+    Sessions of the analysis server and execution of the requests.
+    Commands of a session run one at a time, in order of arrival; different sessions run concurrently.
+    Commands drawing figures run one at a time across sessions (pyplot is not thread safe).
+
+    Requests are JSON objects: {"session": NAME, "command": "COMMAND ARGS"} executes a command
+    ("action": "execute", the default), {"action": "sessions"} lists the sessions and
+    {"action": "close", "session": NAME} closes a session.
+    """
+
+    def __init__(self):
+
+        self.sessions: Dict[str, Session] = {}
+        self._lock = threading.Lock()
+        self._figure_lock = threading.Lock()
+
+    def session(self, name: str) -> Session:
+        """
+        Session by name, created on first use.
+        """
+
+        with self._lock:
+            if name not in self.sessions:
+                self.sessions[name] = Session(name)
+            return self.sessions[name]
+
+    def execute(self, session_name: str, command_line: Union[str, List[str]]) -> dict:
+        """
+        Execute a command in a session.
+
+        Parameters
+        ----------
+        session_name : str
+            Session name
+        command_line : Union[str, List[str]]
+            Command line
+
+        Returns
+        -------
+        dict
+            'ok', printed 'output', JSON 'result' of the command (or 'error'), saved 'figures' (plotting commands),
+            time spent waiting in the session queue and executing the command (in s)
+        """
+
+        if isinstance(command_line, str):
+            command_line = command_line.split('#', 1)[0].split()
+        if not isinstance(command_line, list) or not all(isinstance(word, str) for word in command_line):
+            return {'ok': False, 'session': session_name, 'error': 'Invalid command: a string or a list of strings is expected.'}
+        if not command_line:
+            return {'ok': False, 'session': session_name, 'error': 'Empty command.'}
+        if command_line[0] not in commands:
+            return {'ok': False, 'session': session_name, 'error': 'Command {} not found.'.format(command_line[0])}
+        if command_line[0] in UNAVAILABLE:
+            return {'ok': False, 'session': session_name,
+                    'error': "'{}' is not available in server mode: {}.".format(command_line[0], UNAVAILABLE[command_line[0]])}
+
+        session = self.session(session_name)
+        # commands missing from the access table conservatively draw figures
+        figures = 'figures' in ACCESS.get(command_line[0], ((), ('figures',), True))[1]
+
+        arrival = time.perf_counter()
+        with session.lock:
+            start = time.perf_counter()
+            reply = {'ok': True, 'session': session_name, 'command': ' '.join(command_line)}
+            with capture_output() as record, use_system(session.system):
+                try:
+                    if figures:
+                        # figures of the command are saved before the next command draws
+                        with self._figure_lock:
+                            try:
+                                result = execute_command(command_line)
+                            finally:
+                                reply['figures'] = wait_rendering()
+                    else:
+                        result = execute_command(command_line)
+                    reply['result'] = to_json(result)
+                except SystemExit as e:
+                    # argument errors exit in non-interactive mode
+                    reply.update(ok=False, error='Invalid arguments (exit {}).'.format(e.code))
+                except Exception as e:
+                    reply.update(ok=False, error='{}: {}'.format(type(e).__name__, str(e).strip()))
+            session.n_commands += 1
+            reply['output'] = ''.join(record)
+            reply['queued_s'] = start - arrival
+            reply['elapsed_s'] = time.perf_counter() - start
+
+        return reply
+
+    def close(self, session_name: str) -> dict:
+        """
+        Close a session, after its running command.
+        """
+
+        with self._lock:
+            session = self.sessions.pop(session_name, None)
+        if session is None:
+            return {'ok': False, 'session': session_name, 'error': 'Session {} not found.'.format(session_name)}
+        with session.lock:
+            return {'ok': True, 'session': session_name, 'commands': session.n_commands}
+
+    def handle(self, request: dict) -> dict:
+        """
+        Handle a request (see the class description).
+
+        Parameters
+        ----------
+        request : dict
+            Request
+
+        Returns
+        -------
+        dict
+            Reply
+        """
+
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': 'Invalid request: a JSON object is expected, not {}.'.format(type(request).__name__)}
+
+        action = request.get('action', 'execute')
+        session_name = str(request.get('session', 'default'))
+        if action == 'execute':
+            return self.execute(session_name, request.get('command', ''))
+        if action == 'sessions':
+            with self._lock:
+                sessions = list(self.sessions.values())
+            return {'ok': True, 'sessions': [session.info() for session in sessions]}
+        if action == 'close':
+            return self.close(session_name)
+
+        return {'ok': False, 'error': 'Unknown action {}.'.format(action)}
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface: POST /execute (or any path) with a JSON request, GET /sessions, DELETE /sessions/NAME.
+    """
+
+    server_version = 'MSManalysis'
+
+    def _reply(self, reply: dict, status: int = 200):
+        body = json.dumps(reply).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/sessions':
+            self._reply(self.server.analysis.handle({'action': 'sessions'}))
+        else:
+            self._reply({'ok': False, 'error': 'Not found.'}, status=404)
+
+    def do_DELETE(self):
+        prefix = '/sessions/'
+        if self.path.startswith(prefix):
+            reply = self.server.analysis.handle({'action': 'close', 'session': self.path[len(prefix):]})
+            self._reply(reply, status=200 if reply['ok'] else 404)
+        else:
+            self._reply({'ok': False, 'error': 'Not found.'}, status=404)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self._reply({'ok': False, 'error': 'Invalid Content-Length: {}.'.format(self.headers.get('Content-Length'))}, status=400)
+            return
+        try:
+            request = json.loads(self.rfile.read(max(length, 0)) or b'{}')
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            self._reply({'ok': False, 'error': 'Invalid JSON: {}'.format(e)}, status=400)
+            return
+        reply = self.server.analysis.handle(request)
+        self._reply(reply, status=400 if not isinstance(request, dict) else 200)
+
+    def log_message(self, format, *args):
+        # requests are not logged on the server output
+        pass
+
+
+class _SocketHandler(socketserver.StreamRequestHandler):
+    """
+    Unix socket interface: a JSON request per line, a JSON reply per line.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                reply = self.server.analysis.handle(json.loads(line))
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                reply = {'ok': False, 'error': 'Invalid JSON: {}'.format(e)}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(host: str = '127.0.0.1', port: int = 8765, socket_file: Optional[str] = None):
+    """
+    Run the analysis server until interrupted (Ctrl+C).
+    Each client connection is served by its own thread.
+
+    Parameters
+    ----------
+    host : str, optional
+        HTTP host, by default '127.0.0.1' (local clients only)
+    port : int, optional
+        HTTP port, by default 8765
+    socket_file : Optional[str], optional
+        If provided, a Unix socket is used instead of HTTP, by default None
+    """
+
+    # errors are reported to the clients instead of stopping the program
+    set_interactive_mode(False)
+    # figures are saved to file
+    set_rendering(headless=True)
+
+    if socket_file is not None:
+        if os.path.exists(socket_file):
+            os.remove(socket_file)
+        server = _UnixServer(socket_file, _SocketHandler)
+        address = 'unix:{}'.format(socket_file)
+    else:
+        server = ThreadingHTTPServer((host, port), _HTTPHandler)
+        server.daemon_threads = True
+        address = 'http://{}:{}'.format(*server.server_address[:2])
+    server.analysis = AnalysisServer()
+
+    print('\nAnalysis server listening on {} (Ctrl+C to stop).'.format(address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nAnalysis server stopped.')
+    finally:
+        server.server_close()
+        if socket_file is not None and os.path.exists(socket_file):
+            os.remove(socket_file)
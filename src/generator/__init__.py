@@ -1 +1,28 @@
-from src.generator.functions import *
\ No newline at end of file
+"""
+Generation of trajectories, microstates and MSMs. Functions are imported when first used, so that
+deeptime estimators are not loaded at startup.
+"""
+import importlib
+
+# public names of each module, imported when first used
+_modules = {
+    'functions': ['read_trajectory_files', 'trajectory_files', 'generate_trajectory', 'assign',
+                  'generate_centers_dtraj', 'count_transitions', 'fit_models', 'generate_model', 'update_models',
+                  'sweep_models', 'sample_posterior'],
+}
+_exports = {name: module for module, names in _modules.items() for name in names}
+
+__all__ = list(_exports)
+
+def __getattr__(name):
+
+    if name not in _exports:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    value = getattr(importlib.import_module('.' + _exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+
+    return sorted(set(globals()) | set(_exports))
\ No newline at end of file
@@ -2,22 +2,146 @@
 Function used to generate MSMs ingredients: Trajectory, Centers, Discretized Trajectory, Models
 """
 import os
+import itertools
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Optional, Sequence
 
 from src.tools.types import Centers, DTrajectory, Models, Trajectory
+from src.tools.utils.basics import save_file_pkl, save_file_npy, load_file_npy
+from src.tools.utils.shared import SharedArrays, attach_arrays
 
-from deeptime.clustering import KMeans
-from deeptime.markov import TransitionCountEstimator
+import scipy.sparse
+from scipy.spatial import cKDTree
+
+from deeptime.clustering import KMeans, KMeansModel, kmeans_plusplus
+from deeptime.markov import TransitionCountModel
 from deeptime.markov.msm import MaximumLikelihoodMSM
+from deeptime.markov.tools.estimation import tmatrix_sampler
 
-def generate_trajectory(dir: str) -> Trajectory:
+def _count_rows(file_path: str, comments: str = '#') -> int:
     """
-    Generate a trajectory from text files in a given directory.
+    Count the data rows (non-empty and non-comment lines) of a text file.
 
     Parameters
     ----------
-    dir : str
-        Directory of the trajectory files
+    file_path : str
+        Path of the text file
+    comments : str, optional
+        Character marking comment lines, by default '#'
+
+    Returns
+    -------
+    int
+        Number of data rows
+    """
+
+    marker = comments.encode()
+    n_rows = 0
+    with open(file_path, 'rb') as f:
+        for line in f:
+            line = line.lstrip()
+            if line and not line.startswith(marker):
+                n_rows += 1
+
+    return n_rows
+
+def _read_trajectory_file(file_path: str, columns: Optional[Sequence[int]] = None, start: int = 0, stop: Optional[int] = None,
+                          stride: int = 1, chunk_size: int = 100000, comments: str = '#', dtype=np.float64) -> np.ndarray:
+    """
+    Read the selected rows and columns of a trajectory text file in a single pass.
+    Rows are parsed in chunks of lines and copied into an array grown in place, so only one chunk of text is kept in memory.
+    The file is read twice only if start or stop are negative (counted from the end of the file).
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the trajectory text file
+    columns : Optional[Sequence[int]], optional
+        Indices of the columns to load, by default None (all columns)
+    start : int, optional
+        First data row to load, by default 0
+    stop : Optional[int], optional
+        Data row at which loading stops (excluded), by default None (end of file)
+    stride : int, optional
+        Load one data row every stride rows, by default 1
+    chunk_size : int, optional
+        Number of lines parsed at once, by default 100000
+    comments : str, optional
+        Character marking comment lines, by default '#'
+    dtype : optional
+        Data type of the loaded array, by default np.float64
+
+    Returns
+    -------
+    np.ndarray
+        Array with shape (n_selected_rows, n_selected_columns), with single rows or columns squeezed as np.loadtxt
+    """
+
+    # rows selected by start, stop and stride
+    if start < 0 or (stop is not None and stop < 0):
+        rows = range(_count_rows(file_path, comments=comments))[start:stop:stride]
+        start, stop, stride = rows.start, rows.stop, rows.step
+        capacity = len(rows)
+    else:
+        capacity = None
+
+    with open(file_path) as f:
+        data_lines = (line for line in f if line.strip() and not line.lstrip().startswith(comments))
+        selected_lines = itertools.islice(data_lines, start, stop, stride)
+
+        data = None
+        filled = 0
+        while True:
+            chunk = list(itertools.islice(selected_lines, chunk_size))
+            if not chunk:
+                break
+            block = np.loadtxt(chunk, usecols=columns, dtype=dtype, comments=comments, ndmin=2)
+
+            # allocate with the number of parsed columns, then grow geometrically (in place if possible)
+            if data is None:
+                data = np.empty((capacity or len(block), block.shape[1]), dtype=dtype)
+            elif filled + len(block) > len(data):
+                data.resize((max(2*len(data), filled + len(block)), data.shape[1]), refcheck=False)
+
+            data[filled:filled+len(block)] = block
+            filled += len(block)
+
+    if data is None:
+        # empty selection, as np.loadtxt on an empty file
+        return np.empty((0,), dtype=dtype)
+
+    if filled < len(data):
+        data.resize((filled, data.shape[1]), refcheck=False)
+
+    # single rows and columns are squeezed as np.loadtxt
+    return np.squeeze(data)
+
+def read_trajectory_files(file_paths: Sequence[str], columns: Optional[Sequence[int]] = None, start: int = 0, stop: Optional[int] = None,
+                          stride: int = 1, n_jobs: Optional[int] = 1, chunk_size: int = 100000, comments: str = '#') -> Trajectory:
+    """
+    Read a list of trajectory text files in parallel.
+    Each file is a segment of the returned trajectory, in the same order of the file list.
+
+    Parameters
+    ----------
+    file_paths : Sequence[str]
+        Paths of the trajectory text files
+    columns : Optional[Sequence[int]], optional
+        Indices of the columns (CVs) to load, by default None (all columns)
+    start : int, optional
+        First data row to load from each file, by default 0
+    stop : Optional[int], optional
+        Data row at which loading stops in each file (excluded), by default None (end of file)
+    stride : int, optional
+        Load one data row every stride rows, by default 1
+    n_jobs : Optional[int], optional
+        Number of processes reading files, by default 1. If None, all available cores are used
+    chunk_size : int, optional
+        Number of lines parsed at once by each process, by default 100000
+    comments : str, optional
+        Character marking comment lines, by default '#'
 
     Returns
     -------
@@ -25,62 +149,448 @@ def generate_trajectory(dir: str) -> Trajectory:
         A trajectory object
     """
 
-    # Get a list of all files in the directory
-    traj_files = os.listdir(dir)
+    reader = partial(_read_trajectory_file, columns=columns, start=start, stop=stop, stride=stride,
+                     chunk_size=chunk_size, comments=comments)
 
-    traj = []
-    # Iterate over the C files and load each one
-    for f in traj_files:
-        file_path = os.path.join(dir, f)
-        data = np.loadtxt(file_path)
-        traj.append(data)
+    if n_jobs == 1 or len(file_paths) <= 1:
+        traj = [reader(file_path) for file_path in file_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            traj = list(executor.map(reader, file_paths))
 
     return Trajectory(traj)
 
-def generate_centers_dtraj(traj: Trajectory, n_centers: int) -> tuple[Centers, DTrajectory]:
+def trajectory_files(dir: str) -> list:
     """
-    Generate microstates and discretized trajectory from a trajectory using KMeans clustering algorithm.
+    List the trajectory files of a directory in alphabetical order.
 
     Parameters
     ----------
-    traj : Trajectory
-        Trajectory to discretize
+    dir : str
+        Directory of the trajectory files
+
+    Returns
+    -------
+    list
+        Sorted paths of the files in the directory
+    """
+
+    # Get a sorted list of all files in the directory
+    traj_files = [os.path.join(dir, f) for f in sorted(os.listdir(dir))]
+
+    return [f for f in traj_files if os.path.isfile(f)]
+
+def generate_trajectory(dir: str, columns: Optional[Sequence[int]] = None, start: int = 0, stop: Optional[int] = None,
+                        stride: int = 1, n_jobs: Optional[int] = 1) -> Trajectory:
+    """
+    Generate a trajectory from text files in a given directory.
+    Files are read in alphabetical order, so the segment order of the trajectory is always the same.
+
+    Parameters
+    ----------
+    dir : str
+        Directory of the trajectory files
+    columns : Optional[Sequence[int]], optional
+        Indices of the columns (CVs) to load, by default None (all columns)
+    start : int, optional
+        First data row to load from each file, by default 0
+    stop : Optional[int], optional
+        Data row at which loading stops in each file (excluded), by default None (end of file)
+    stride : int, optional
+        Load one data row every stride rows, by default 1
+    n_jobs : Optional[int], optional
+        Number of processes reading files, by default 1. If None, all available cores are used
+
+    Returns
+    -------
+    Trajectory
+        A trajectory object
+    """
+
+    return read_trajectory_files(trajectory_files(dir), columns=columns, start=start, stop=stop, stride=stride, n_jobs=n_jobs)
+
+def _kmeans_clustering(data: np.ndarray, n_centers: int, n_jobs: int = 16, tolerance: float = 1e-5, max_iter: int = 5000):
+    """
+    Fit a KMeans clustering (kmeans++ initialization followed by refinement) on concatenated trajectory data.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Concatenated trajectory
     n_centers : int
         Number of microstates
+    n_jobs : int, optional
+        Number of threads used by KMeans, by default 16
+    tolerance : float, optional
+        Convergence tolerance on the relative change of the KMeans inertia, by default 1e-5
+    max_iter : int, optional
+        Maximum number of refinement iterations, by default 5000
 
     Returns
     -------
-    tuple[Centers, DTrajectory]
-        Microstates and discretized trajectory
+    KMeansModel
+        The fitted clustering model
     """
 
-    traj_concat = np.concatenate(traj, axis=0)
-
     # clustering with KMeans
     estimator = KMeans(
                         n_clusters=n_centers,
                         init_strategy='kmeans++',
                         max_iter=0,
-                        n_jobs=16,
+                        tolerance=tolerance,
+                        n_jobs=n_jobs,
                         )
     
     # initial guess
-    initial_clustering = estimator.fit_fetch(traj_concat)
+    initial_clustering = estimator.fit_fetch(data)
 
     # refinement
     estimator.initial_centers = initial_clustering.cluster_centers
-    estimator.max_iter = 5000
-    clustering = estimator.fit_fetch(traj_concat)
+    estimator.max_iter = max_iter
+    clustering = estimator.fit_fetch(data)
+
+    return clustering
 
-    # generate microstates and discretized traj
+def _sample_frames(traj: Trajectory, offsets: np.ndarray, n_frames: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Draw random frames from the segments of a trajectory without concatenating them.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Trajectory to sample
+    offsets : np.ndarray
+        Index of the first frame of each segment in the whole trajectory (plus the total number of frames)
+    n_frames : int
+        Number of frames to draw
+    rng : np.random.Generator
+        Random number generator
+
+    Returns
+    -------
+    np.ndarray
+        Array of the sampled frames with shape (n_frames, dimension)
+    """
+
+    # sorted indices, so frames are read segment by segment
+    indices = np.sort(rng.integers(0, offsets[-1], size=n_frames))
+    segment_ids = np.searchsorted(offsets, indices, side='right') - 1
+
+    frames = []
+    for i in np.unique(segment_ids):
+        local = indices[segment_ids == i] - offsets[i]
+        frames.append(np.asarray(traj[i][local], dtype=np.float64).reshape(len(local), -1))
+
+    return np.concatenate(frames, axis=0)
+
+def _minibatch_kmeans_clustering(traj: Trajectory, n_centers: int, batch_size: int = 10000, n_jobs: int = 16,
+                                 tolerance: float = 1e-5, max_iter: int = 100, seed: Optional[int] = None) -> KMeansModel:
+    """
+    Fit a mini-batch KMeans clustering streaming random batches of frames from the trajectory segments.
+    Centers are initialized with kmeans++ on one batch and updated online with per-center learning rates.
+    Memory is bounded by the batch size.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Trajectory to clusterize
+    n_centers : int
+        Number of microstates
+    batch_size : int, optional
+        Number of frames of each batch, by default 10000
+    n_jobs : int, optional
+        Number of threads used to assign batch frames to centers, by default 16
+    tolerance : float, optional
+        Convergence tolerance: fitting stops when, after a pass over the number of trajectory frames,
+        the largest displacement of a center relative to the data spread is below this value, by default 1e-5
+    max_iter : int, optional
+        Maximum number of passes over the number of trajectory frames, by default 100
+    seed : Optional[int], optional
+        Seed of the random batches, by default None
+
+    Returns
+    -------
+    KMeansModel
+        The fitted clustering model
+    """
+
+    rng = np.random.default_rng(seed)
+    lengths = [len(segment) for segment in traj]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    batch_size = int(min(batch_size, offsets[-1]))
+    n_batches = -(-int(offsets[-1]) // batch_size)
+
+    # initial guess
+    batch = _sample_frames(traj, offsets, batch_size, rng)
+    centers = kmeans_plusplus(batch, n_centers, n_jobs=n_jobs)
+    scale = np.max(np.std(batch, axis=0)) or 1.0
+
+    clustering = KMeansModel(centers, metric='euclidean', tolerance=tolerance)
+    center_counts = np.zeros(n_centers)
+
+    for _ in range(max_iter):
+        previous_centers = clustering.cluster_centers.copy()
+
+        for _ in range(n_batches):
+            batch = _sample_frames(traj, offsets, batch_size, rng)
+            labels = clustering.transform(batch, n_jobs=n_jobs)
+
+            # online update: each center moves to the running mean of its assigned frames
+            batch_counts = np.bincount(labels, minlength=n_centers)
+            batch_sums = np.zeros_like(centers)
+            np.add.at(batch_sums, labels, batch)
+            center_counts += batch_counts
+            updated = batch_counts > 0
+            centers[updated] += (batch_sums[updated] - batch_counts[updated, None]*centers[updated]) / center_counts[updated, None]
+            clustering = KMeansModel(centers, metric='euclidean', tolerance=tolerance)
+
+        shift = np.max(np.linalg.norm(clustering.cluster_centers - previous_centers, axis=1)) / scale
+        if shift <= tolerance:
+            clustering = KMeansModel(centers, metric='euclidean', tolerance=tolerance, converged=True)
+            break
+
+    return clustering
+
+def _assign_segment(segment: np.ndarray, centers: np.ndarray, chunk_size: int, tree: Optional[cKDTree] = None) -> np.ndarray:
+    """
+    Assign the frames of a trajectory segment to the nearest center, processing blocks of chunk_size frames.
+
+    Parameters
+    ----------
+    segment : np.ndarray
+        Trajectory segment
+    centers : np.ndarray
+        Centers with shape (n_centers, dimension)
+    chunk_size : int
+        Number of frames assigned at once
+    tree : Optional[cKDTree], optional
+        KD-tree built on centers, by default None (brute force distances)
+
+    Returns
+    -------
+    np.ndarray
+        Nearest center of each frame
+    """
+
+    labels = np.empty(len(segment), dtype=np.int32)
+    centers_sq = np.einsum('ij,ij->i', centers, centers)
+
+    for i in range(0, len(segment), chunk_size):
+        chunk = np.asarray(segment[i:i+chunk_size], dtype=np.float64).reshape(-1, centers.shape[1])
+        if tree is not None:
+            labels[i:i+chunk_size] = tree.query(chunk, k=1)[1]
+        else:
+            # squared distances without the frame norms, which do not change the nearest center
+            labels[i:i+chunk_size] = np.argmin(centers_sq - 2*chunk @ centers.T, axis=1)
+
+    return labels
+
+def assign(traj: Trajectory, centers: Centers, method: str = 'brute', chunk_size: Optional[int] = None, n_jobs: int = 1) -> DTrajectory:
+    """
+    Discretize a trajectory assigning each frame to the nearest center.
+    Frames are processed in blocks small enough to keep the distance matrix in cache,
+    and segments are processed in parallel by a pool of threads.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Trajectory to discretize
+    centers : Centers
+        Microstates
+    method : str, optional
+        'brute' (vectorized distance kernel) or 'kdtree' (KD-tree built once on centers, faster for many centers
+        in low dimension), by default 'brute'
+    chunk_size : Optional[int], optional
+        Number of frames assigned at once, by default None (about 2^20 frame-center distances per block)
+    n_jobs : int, optional
+        Number of threads, by default 1
+
+    Returns
+    -------
+    DTrajectory
+        Discretized trajectory
+
+    Raises
+    ------
+    ValueError
+        Raised if the assignment method is not known or if the dimension of centers and trajectory differ.
+    """
+
+    if method not in ('brute', 'kdtree'):
+        raise ValueError(f"Unknown assignment method '{method}'. Choose between 'brute' and 'kdtree'.")
+
+    centers = np.asarray(centers, dtype=np.float64)
+    # Centers are stored transposed when there are fewer centers than dimensions
+    if len(traj) > 0:
+        dimension = traj[0].shape[1] if traj[0].ndim > 1 else 1
+        if centers.shape[1] != dimension:
+            if centers.shape[0] != dimension:
+                raise ValueError(f"Centers with shape {centers.shape} do not match the trajectory dimension {dimension}.")
+            centers = centers.T
+    if chunk_size is None:
+        chunk_size = max(1, 2**20 // len(centers))
+    tree = cKDTree(centers) if method == 'kdtree' else None
+
+    assigner = partial(_assign_segment, centers=centers, chunk_size=chunk_size, tree=tree)
+
+    if n_jobs == 1 or len(traj) <= 1:
+        dtraj = [assigner(segment) for segment in traj]
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            dtraj = list(executor.map(assigner, traj))
+
+    return DTrajectory(dtraj)
+
+def generate_centers_dtraj(traj: Trajectory, n_centers: int, n_jobs: int = 16, mini_batch: bool = False,
+                           batch_size: int = 10000, tolerance: float = 1e-5, max_iter: Optional[int] = None,
+                           seed: Optional[int] = None) -> tuple[Centers, DTrajectory]:
+    """
+    Generate microstates and discretized trajectory from a trajectory using KMeans clustering algorithm.
+    In mini-batch mode, random batches of frames are streamed from the trajectory segments (which are never concatenated)
+    and frames are assigned in chunks, so memory is bounded by the batch size.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Trajectory to discretize
+    n_centers : int
+        Number of microstates
+    n_jobs : int, optional
+        Number of threads used by KMeans, by default 16
+    mini_batch : bool, optional
+        If true, use mini-batch KMeans, by default False
+    batch_size : int, optional
+        Number of frames of each mini-batch, by default 10000
+    tolerance : float, optional
+        Convergence tolerance, by default 1e-5
+    max_iter : Optional[int], optional
+        Maximum number of iterations (passes over the trajectory in mini-batch mode),
+        by default None (5000 for KMeans, 100 for mini-batch KMeans)
+    seed : Optional[int], optional
+        Seed of the random batches in mini-batch mode, by default None
+
+    Returns
+    -------
+    tuple[Centers, DTrajectory]
+        Microstates and discretized trajectory
+    """
+
+    if mini_batch:
+        clustering = _minibatch_kmeans_clustering(traj, n_centers, batch_size=batch_size, n_jobs=n_jobs, tolerance=tolerance,
+                                                  max_iter=max_iter or 100, seed=seed)
+        dtraj = assign(traj, clustering.cluster_centers, n_jobs=n_jobs)
+
+    else:
+        traj_concat = np.concatenate(traj, axis=0)
+
+        clustering = _kmeans_clustering(traj_concat, n_centers, n_jobs=n_jobs, tolerance=tolerance, max_iter=max_iter or 5000)
+        dtraj = DTrajectory([clustering.transform(tr) for tr in traj])
+
+    # generate microstates
     centers = clustering.cluster_centers.T
-    dtraj = [clustering.transform(tr) for tr in traj]
 
-    return Centers(centers), DTrajectory(dtraj)
+    return Centers(centers), dtraj
 
-def generate_model(dtraj: DTrajectory, lagtimes:np.ndarray[int]) -> Models:
+def count_transitions(dtraj: DTrajectory, lagtimes: Sequence[int], n_states: Optional[int] = None) -> tuple[list, np.ndarray]:
+    """
+    Count transitions (sliding window) of a discretized trajectory at several lagtimes.
+    Each segment is read once: pairs of states at all lagtimes are encoded as single integers and accumulated,
+    densely for small numbers of states or sparsely (unique pairs only) otherwise.
+
+    Parameters
+    ----------
+    dtraj : DTrajectory
+        Discretized trajectory
+    lagtimes : Sequence[int]
+        Lagtimes at which transitions are counted
+    n_states : Optional[int], optional
+        Number of states, by default None (largest state in the discretized trajectory + 1)
+
+    Returns
+    -------
+    tuple[list, np.ndarray]
+        List of count matrices (scipy.sparse.csr_matrix), one for each lagtime, and the histogram of visited states
+    """
+
+    if n_states is None:
+        n_states = max(int(np.max(segment)) for segment in dtraj if len(segment) > 0) + 1
+    lagtimes = [int(lt) for lt in lagtimes]
+
+    # dense accumulation only if the count matrices are small
+    dense = n_states**2 <= 2**16
+    if dense:
+        dense_counts = np.zeros((len(lagtimes), n_states**2), dtype=np.int64)
+    else:
+        sparse_codes = [[] for _ in lagtimes]
+        sparse_counts = [[] for _ in lagtimes]
+    histogram = np.zeros(n_states, dtype=np.int64)
+
+    for segment in dtraj:
+        states = np.asarray(segment, dtype=np.int64)
+        histogram += np.bincount(states, minlength=n_states)
+
+        for i, lt in enumerate(lagtimes):
+            if len(states) <= lt:
+                continue
+            codes = states[:-lt]*n_states + states[lt:]
+            if dense:
+                dense_counts[i] += np.bincount(codes, minlength=n_states**2)
+            else:
+                unique_codes, counts = np.unique(codes, return_counts=True)
+                sparse_codes[i].append(unique_codes)
+                sparse_counts[i].append(counts)
+
+    count_matrices = []
+    for i in range(len(lagtimes)):
+        if dense:
+            count_matrices.append(scipy.sparse.csr_matrix(dense_counts[i].reshape(n_states, n_states).astype(np.float64)))
+        else:
+            codes = np.concatenate(sparse_codes[i]) if sparse_codes[i] else np.zeros(0, dtype=np.int64)
+            counts = np.concatenate(sparse_counts[i]) if sparse_counts[i] else np.zeros(0, dtype=np.int64)
+            # duplicated pairs are summed by the conversion
+            count_matrices.append(scipy.sparse.coo_matrix((counts.astype(np.float64), (codes // n_states, codes % n_states)),
+                                                          shape=(n_states, n_states)).tocsr())
+
+    return count_matrices, histogram
+
+def fit_models(count_matrices: Sequence, lagtimes: Sequence[int], histogram: Optional[np.ndarray] = None,
+               sparse: bool = False) -> Models:
+    """
+    Fit MSMs from count matrices (sliding window counting) at different lagtimes.
+
+    Parameters
+    ----------
+    count_matrices : Sequence
+        Count matrices (dense or scipy.sparse), one for each lagtime
+    lagtimes : Sequence[int]
+        Lagtimes of the count matrices
+    histogram : Optional[np.ndarray], optional
+        Histogram of visited states, by default None
+    sparse : bool, optional
+        If true, count and transition matrices are kept in sparse (CSR) format, by default False
+
+    Returns
+    -------
+    Models
+        List of MSMs
+    """
+
+    models = []
+    for count_matrix, lt in zip(count_matrices, lagtimes):
+        if sparse:
+            count_matrix = scipy.sparse.csr_matrix(count_matrix)
+        elif scipy.sparse.issparse(count_matrix):
+            count_matrix = count_matrix.toarray()
+        count_model = TransitionCountModel(count_matrix=count_matrix, counting_mode='sliding',
+                                           lagtime=int(lt), state_histogram=histogram)
+        models.append(MaximumLikelihoodMSM(sparse=sparse).fit_fetch(count_model))
+
+    return Models(models)
+
+def generate_model(dtraj: DTrajectory, lagtimes:np.ndarray[int], n_states: Optional[int] = None, sparse: bool = False) -> Models:
     """
     Generate MSMs from a discretized trajectory at different lagtimes.
+    Transitions at all the lagtimes are counted in a single pass over the discretized trajectory.
 
     Parameters
     ----------
@@ -88,21 +598,342 @@ def generate_model(dtraj: DTrajectory, lagtimes:np.ndarray[int]) -> Models:
         Discretized trajectory
     lagtimes : np.ndarray[int]
         Array of list of lagtimes at which generate MSMs
+    n_states : Optional[int], optional
+        Number of states, by default None (largest state in the discretized trajectory + 1)
+    sparse : bool, optional
+        If true, count and transition matrices are kept in sparse (CSR) format, by default False
 
     Returns
     -------
     Models
         List of MSMs
     """
-    
-    models = []
-    
-    for lt in lagtimes:
-        tce = TransitionCountEstimator(
-                                        lagtime=lt,
-                                        count_mode='sliding'
-                                        )
-        counts = tce.fit_fetch(dtraj)
-        models.append(MaximumLikelihoodMSM().fit_fetch(counts))
-
-        return Models(models)
+
+    count_matrices, histogram = count_transitions(dtraj, lagtimes, n_states=n_states)
+
+    return fit_models(count_matrices, lagtimes, histogram=histogram, sparse=sparse)
+
+def update_models(models: Models, dtraj: DTrajectory, sparse: Optional[bool] = None) -> Models:
+    """
+    Update MSMs with the transitions of new segments of discretized trajectory.
+    The transitions of the new segments are counted at the lagtimes of the MSMs and added to their full count matrices
+    (and state histograms), then the MSMs are fitted again: the cost depends on the new segments only.
+
+    Parameters
+    ----------
+    models : Models
+        MSMs to update, with count models in the full state space
+    dtraj : DTrajectory
+        New segments of discretized trajectory
+    sparse : Optional[bool], optional
+        If true, the updated MSMs are sparse, by default None (same format of the MSMs)
+
+    Returns
+    -------
+    Models
+        Updated MSMs
+    """
+
+    models = list(models)
+    lagtimes = [int(model.lagtime) for model in models]
+    if sparse is None:
+        sparse = scipy.sparse.issparse(models[0].transition_matrix)
+
+    n_states = max(model.count_model.n_states_full for model in models)
+    n_states = max([n_states] + [int(np.max(segment)) + 1 for segment in dtraj if len(segment) > 0])
+    new_counts, new_histogram = count_transitions(dtraj, lagtimes, n_states=n_states)
+
+    count_matrices = []
+    histogram = None
+    for model, counts in zip(models, new_counts):
+        # previous counts, padded if new states were visited
+        old_counts = scipy.sparse.csr_matrix(model.count_model.count_matrix_full)
+        old_counts.resize((n_states, n_states))
+        count_matrices.append(old_counts + counts)
+
+        old_histogram = model.count_model.state_histogram_full
+        if histogram is None and old_histogram is not None:
+            histogram = np.zeros(n_states)
+            histogram[:len(old_histogram)] = old_histogram
+            histogram += new_histogram
+
+    return fit_models(count_matrices, lagtimes, histogram=histogram, sparse=sparse)
+
+# parameter sweep
+
+# trajectory shared with the sweep worker processes
+_shared_traj = {}
+
+def _share_trajectory(traj: Trajectory, shared: SharedArrays):
+    """
+    Copy a trajectory in shared memory: the concatenated segments and their offsets.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Trajectory to share
+    shared : SharedArrays
+        Shared arrays of the sweep
+    """
+
+    lengths = [len(segment) for segment in traj]
+    offsets = shared.share('offsets', np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+
+    data = shared.create('data', (int(offsets[-1]),) + traj[0].shape[1:], traj[0].dtype)
+    for i, segment in enumerate(traj):
+        data[offsets[i]:offsets[i+1]] = segment
+
+def _attach_trajectory(info: dict):
+    """
+    Initializer of the sweep worker processes: attach to the shared trajectory.
+
+    Parameters
+    ----------
+    info : dict
+        Description of the shared arrays (SharedArrays.info)
+    """
+
+    _shared_traj['shm'], arrays = attach_arrays(info)
+    data, offsets = arrays['data'], arrays['offsets']
+
+    _shared_traj['data'] = data
+    _shared_traj['segments'] = [data[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
+
+def _sweep_clustering(n_centers: int, out_dir: str, n_jobs: int = 1) -> dict:
+    """
+    Sweep job: cluster the shared trajectory and save microstates and discretized trajectory.
+
+    Parameters
+    ----------
+    n_centers : int
+        Number of microstates
+    out_dir : str
+        Directory where files are saved
+    n_jobs : int, optional
+        Number of threads used by KMeans, by default 1
+
+    Returns
+    -------
+    dict
+        Names of the saved centers and discretized trajectory files
+    """
+
+    clustering = _kmeans_clustering(_shared_traj['data'], n_centers, n_jobs=n_jobs)
+
+    centers = Centers(clustering.cluster_centers.T)
+    dtraj = DTrajectory([clustering.transform(tr) for tr in _shared_traj['segments']])
+
+    files = {'centers': os.path.join(out_dir, f'centers_{n_centers}.pkl'),
+             'dtraj': os.path.join(out_dir, f'dtraj_{n_centers}.npy')}
+    save_file_pkl(centers, files['centers'])
+    save_file_npy(dtraj, files['dtraj'])
+
+    return files
+
+def _sweep_fit(dtraj_file: str, lagtimes: Sequence[int]) -> list:
+    """
+    Sweep job: fit the MSMs of a saved discretized trajectory.
+
+    Parameters
+    ----------
+    dtraj_file : str
+        Discretized trajectory file (.npy format)
+    lagtimes : Sequence[int]
+        Lagtimes of the MSMs
+
+    Returns
+    -------
+    list
+        List of MSMs
+    """
+
+    dtraj = DTrajectory(load_file_npy(dtraj_file))
+
+    return list(generate_model(dtraj, lagtimes=lagtimes))
+
+def sweep_models(traj: Trajectory, n_centers: Sequence[int], lagtimes: Sequence[int], out_dir: str = '.',
+                 n_jobs: Optional[int] = None, kmeans_jobs: int = 1) -> dict:
+    """
+    Generate and save microstates, discretized trajectories and MSMs for a grid of numbers of microstates and lagtimes.
+    Clustering and MSM fitting jobs are scheduled on a process pool: the MSMs of a clustering are fitted
+    (in jobs of consecutive lagtimes) as soon as the clustering is done. The trajectory is shared with the worker processes
+    through shared memory.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Trajectory to discretize
+    n_centers : Sequence[int]
+        Numbers of microstates to test
+    lagtimes : Sequence[int]
+        Lagtimes to test
+    out_dir : str, optional
+        Directory where results are saved, by default '.'
+    n_jobs : Optional[int], optional
+        Number of worker processes, by default None (all available cores)
+    kmeans_jobs : int, optional
+        Number of threads used by each KMeans clustering, by default 1
+
+    Returns
+    -------
+    dict
+        Index of the results: for each number of microstates, the names of centers, discretized trajectory and models files
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+    lagtimes = [int(lt) for lt in lagtimes]
+
+    # lagtimes fitted by each job: transitions at all the lagtimes of a job are counted in one pass
+    n_workers = n_jobs or os.cpu_count() or 1
+    chunk_size = max(1, -(-len(lagtimes)*len(n_centers) // n_workers))
+
+    index = {}
+    models = {}
+
+    with SharedArrays() as shared:
+        _share_trajectory(traj, shared)
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_attach_trajectory, initargs=(shared.info,)) as executor:
+
+            # clustering jobs
+            clustering_jobs = {executor.submit(_sweep_clustering, int(n), out_dir, kmeans_jobs): int(n) for n in n_centers}
+
+            # fitting jobs, submitted as soon as a clustering is done
+            fit_jobs = {}
+            for job in as_completed(clustering_jobs):
+                n = clustering_jobs[job]
+                index[n] = job.result()
+                print('Clustering with {} microstates done.'.format(n))
+                for i in range(0, len(lagtimes), chunk_size):
+                    fit_jobs[executor.submit(_sweep_fit, index[n]['dtraj'], lagtimes[i:i+chunk_size])] = (n, i)
+                models[n] = [None]*len(lagtimes)
+
+            for job in as_completed(fit_jobs):
+                n, i = fit_jobs[job]
+                fitted = job.result()
+                models[n][i:i+len(fitted)] = fitted
+
+    # save models and results index
+    for n in sorted(models):
+        index[n]['models'] = os.path.join(out_dir, f'models_{n}.pkl')
+        index[n]['lagtimes'] = lagtimes
+        save_file_pkl(Models(models[n]), index[n]['models'])
+        print('Models with {} microstates saved in {}.'.format(n, index[n]['models']))
+
+    index = {n: index[n] for n in sorted(index)}
+    save_file_pkl(index, os.path.join(out_dir, 'sweep_index.pkl'))
+
+    return index
+
+# Bayesian MSM sampling
+
+# prior shared with the sampling worker processes
+_sampler_prior = {}
+
+def _set_prior(count_matrix: np.ndarray, transition_matrix: np.ndarray, reversible: bool, n_steps: Optional[int]):
+    """
+    Initializer of the sampling worker processes: store the prior of the posterior sampling.
+    """
+
+    _sampler_prior.update(count_matrix=count_matrix, transition_matrix=transition_matrix, reversible=reversible, n_steps=n_steps)
+
+def _sample_batch(seed: int, files: tuple, start: int, stop: int) -> int:
+    """
+    Sampling job: draw a batch of posterior transition matrices and write it in the memory-mapped sample files.
+
+    Parameters
+    ----------
+    seed : int
+        Random seed of the batch
+    files : tuple
+        Files of the transition matrices and of the stationary distributions
+    start : int
+        Index of the first sample of the batch
+    stop : int
+        Index after the last sample of the batch
+
+    Returns
+    -------
+    int
+        Number of drawn samples
+    """
+
+    # the non-reversible sampler draws from the global numpy generator, the reversible one is seeded by deeptime
+    np.random.seed(seed)
+    sampler = tmatrix_sampler(_sampler_prior['count_matrix'], reversible=_sampler_prior['reversible'],
+                              T0=_sampler_prior['transition_matrix'], nsteps=_sampler_prior['n_steps'])
+    transition_matrices, stationary_distributions = sampler.sample(nsamples=stop-start, return_statdist=True)
+    if stop - start == 1:
+        transition_matrices, stationary_distributions = transition_matrices[None], stationary_distributions[None]
+
+    transition_file = np.load(files[0], mmap_mode='r+')
+    distribution_file = np.load(files[1], mmap_mode='r+')
+    transition_file[start:stop] = transition_matrices
+    distribution_file[start:stop] = stationary_distributions
+    transition_file.flush()
+    distribution_file.flush()
+
+    return stop - start
+
+def sample_posterior(model, n_samples: int, file_prefix: str, batch_size: int = 100, effective: bool = True,
+                     n_steps: Optional[int] = None, n_jobs: Optional[int] = None, seed: int = 0) -> dict:
+    """
+    Sample the posterior of the transition matrix of a MSM (Bayesian MSM with sparse prior, as deeptime BayesianMSM).
+    Samples are drawn in batches by a process pool and streamed to memory-mapped .npy files, so that memory
+    is bounded by the batch size. Each batch is an independent chain started from the maximum likelihood transition matrix.
+
+    Parameters
+    ----------
+    model : MarkovStateModel
+        Maximum likelihood MSM, with its count model
+    n_samples : int
+        Number of posterior samples
+    file_prefix : str
+        Prefix of the sample files: '{prefix}_transition_matrices.npy' and '{prefix}_stationary_distributions.npy'
+    batch_size : int, optional
+        Number of samples drawn by each job, by default 100
+    effective : bool, optional
+        If true, sliding window counts are divided by the lagtime to approximate uncorrelated counts, by default True
+    n_steps : Optional[int], optional
+        Number of Gibbs steps between samples, by default None (deeptime default)
+    n_jobs : Optional[int], optional
+        Number of worker processes, by default None (all available cores)
+    seed : int, optional
+        Random seed of non-reversible sampling, by default 0
+
+    Returns
+    -------
+    dict
+        Memory-mapped samples ('transition_matrices', shape (n_samples, n_states, n_states), and 'stationary_distributions',
+        shape (n_samples, n_states)), the sample files, the lagtime and the reversibility of the samples
+    """
+
+    count_matrix = model.count_model.count_matrix
+    count_matrix = count_matrix.toarray() if scipy.sparse.issparse(count_matrix) else np.asarray(count_matrix, dtype=np.float64)
+    transition_matrix = model.transition_matrix
+    transition_matrix = transition_matrix.toarray() if scipy.sparse.issparse(transition_matrix) else np.asarray(transition_matrix)
+    if effective and model.count_model.counting_mode == 'sliding':
+        count_matrix = count_matrix/model.lagtime
+    n_states = count_matrix.shape[0]
+
+    files = (f'{file_prefix}_transition_matrices.npy', f'{file_prefix}_stationary_distributions.npy')
+    directory = os.path.dirname(files[0])
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    np.lib.format.open_memmap(files[0], mode='w+', dtype=np.float64, shape=(n_samples, n_states, n_states)).flush()
+    np.lib.format.open_memmap(files[1], mode='w+', dtype=np.float64, shape=(n_samples, n_states)).flush()
+
+    starts = list(range(0, n_samples, batch_size))
+    # the samplers take non-negative 32 bit seeds
+    seeds = [int(s.generate_state(1)[0] >> 1) for s in np.random.SeedSequence(seed).spawn(len(starts))]
+    prior = (count_matrix, transition_matrix, model.reversible, n_steps)
+
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_set_prior, initargs=prior) as executor:
+        jobs = [executor.submit(_sample_batch, s, files, start, min(start + batch_size, n_samples)) for s, start in zip(seeds, starts)]
+        drawn = 0
+        for job in as_completed(jobs):
+            drawn += job.result()
+            print('Drawn {} of {} posterior samples.'.format(drawn, n_samples), end='\r')
+    print('')
+
+    return {'transition_matrices': np.load(files[0], mmap_mode='r'), 'stationary_distributions': np.load(files[1], mmap_mode='r'),
+            'files': files, 'lagtime': int(model.lagtime), 'reversible': model.reversible}
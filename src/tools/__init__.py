@@ -1,4 +1,8 @@
 from .utils.basics import *
 from .types.Types import Models, Centers, DTrajectory, Trajectory
 from .utils.info import *
-from .utils.errors import *
\ No newline at end of file
+from .utils.errors import *
+from .utils.rendering import *
+from .utils.profiling import set_profiling, profiled, profiling_report, profiling_session
+from .utils.output import capture_output
+from .utils.cache import ResultCache, file_digest, cached
\ No newline at end of file
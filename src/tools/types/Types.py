@@ -2,21 +2,27 @@
 Collection of types for this program.
 """
 import numpy as np
-from typing import List
+from typing import List, Optional, TYPE_CHECKING
 
-from deeptime.markov.msm import MarkovStateModelCollection
 from numpy import ndarray
 
+# deeptime and scipy are imported when MSMs are first handled (they take most of the startup time)
+if TYPE_CHECKING:
+    from deeptime.markov.msm import MarkovStateModelCollection
+    from deeptime.util.validation import ImpliedTimescales
+
 #errors
 from src.tools.utils.errors import ConversionError
 
 class Models(list):
     
-    def __init__(self, MSMs: List[MarkovStateModelCollection]):
-        
+    def __init__(self, MSMs: List['MarkovStateModelCollection']):
+        from deeptime.markov.msm import MarkovStateModelCollection
+
         if not all(isinstance(MSM, MarkovStateModelCollection) for MSM in MSMs):
             raise ConversionError(message="One or more elements are not MSM.")
         super().__init__(MSMs)
+        self.clear_cache()
 
     def n_models(self):
 
@@ -26,6 +32,275 @@ class Models(list):
 
         return self[0].n_states 
 
+    # cached lagtimes and implied timescales
+    def clear_cache(self):
+        """
+        Remove cached lagtimes and implied timescales. Called whenever the list of MSMs changes.
+        """
+        self._lagtimes = None
+        self._its = {}
+
+    def lagtimes(self) -> np.ndarray:
+        """
+        Lagtimes of the MSMs (computed once and cached).
+
+        Returns
+        -------
+        np.ndarray
+            Array of lagtimes
+        """
+        if self._lagtimes is None:
+            self._lagtimes = np.array([MSM.lagtime for MSM in self])
+        return self._lagtimes
+
+    def implied_timescales(self, n_its: Optional[int] = None, backend: str = 'dense') -> 'ImpliedTimescales':
+        """
+        Implied timescales of the MSMs (computed once and cached).
+
+        Parameters
+        ----------
+        n_its : Optional[int], optional
+            Number of implied timescales computed by the sparse backend, by default None (10)
+        backend : str, optional
+            Spectral backend: 'dense' (all the processes of each MSM) or 'sparse' (the first n_its processes), by default 'dense'
+
+        Returns
+        -------
+        ImpliedTimescales
+            Implied timescales object
+        """
+        key = 'dense' if backend == 'dense' else ('sparse', n_its)
+        if key not in self._its:
+            if backend == 'dense':
+                from deeptime.util.validation import implied_timescales
+                self._its[key] = implied_timescales(list(self))
+            else:
+                from src.analysis.spectral import sparse_implied_timescales
+                self._its[key] = sparse_implied_timescales(self, n_its)
+        return self._its[key]
+
+    # cached data are not saved
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.clear_cache()
+
+    # list modifications invalidate the cache
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.clear_cache()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.clear_cache()
+
+    def __iadd__(self, other):
+        result = super().__iadd__(other)
+        self.clear_cache()
+        return result
+
+    def append(self, MSM):
+        super().append(MSM)
+        self.clear_cache()
+
+    def extend(self, MSMs):
+        super().extend(MSMs)
+        self.clear_cache()
+
+    def insert(self, index, MSM):
+        super().insert(index, MSM)
+        self.clear_cache()
+
+    def pop(self, index=-1):
+        MSM = super().pop(index)
+        self.clear_cache()
+        return MSM
+
+    def remove(self, MSM):
+        super().remove(MSM)
+        self.clear_cache()
+
+    def clear(self):
+        super().clear()
+        self.clear_cache()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.clear_cache()
+
+    def reverse(self):
+        super().reverse()
+        self.clear_cache()
+
+# indexed models archive (.npz): arrays of model i are stored as 'model_i/name'
+def archive_matrix(arrays: dict, key: str, matrix, sparse: bool = False, dtype: Optional[np.dtype] = None):
+    """
+    Add a dense or sparse (CSR) matrix to the arrays of a models archive.
+
+    Parameters
+    ----------
+    arrays : dict
+        Arrays of the archive
+    key : str
+        Name of the matrix
+    matrix : np.ndarray or scipy.sparse matrix
+        Matrix to store
+    sparse : bool, optional
+        If true, dense matrices are stored in sparse format too, by default False
+    dtype : Optional[np.dtype], optional
+        Storage precision of the matrix values (e.g. np.float32), by default None (unchanged)
+    """
+    import scipy.sparse
+
+    if sparse or scipy.sparse.issparse(matrix):
+        matrix = scipy.sparse.csr_matrix(matrix)
+        arrays[key + '/data'] = matrix.data if dtype is None else matrix.data.astype(dtype)
+        arrays[key + '/indices'] = matrix.indices
+        arrays[key + '/indptr'] = matrix.indptr
+        arrays[key + '/shape'] = np.array(matrix.shape)
+    else:
+        matrix = np.asarray(matrix)
+        arrays[key] = matrix if dtype is None else matrix.astype(dtype)
+
+def _archived_matrix(archive, key: str):
+    """
+    Read a dense or sparse matrix from a models archive (None if not stored).
+    Values stored with reduced precision are converted back to float64.
+    """
+    import scipy.sparse
+
+    if key in archive.files:
+        return archive[key].astype(np.float64, copy=False)
+    if key + '/data' in archive.files:
+        return scipy.sparse.csr_matrix((archive[key + '/data'].astype(np.float64, copy=False), archive[key + '/indices'],
+                                        archive[key + '/indptr']), shape=tuple(archive[key + '/shape']))
+    return None
+
+def _stochastic(transition_matrix):
+    """
+    Renormalize the rows of a transition matrix (after reduced precision storage).
+    """
+    import scipy.sparse
+
+    row_sums = np.asarray(transition_matrix.sum(axis=1)).ravel()
+    if scipy.sparse.issparse(transition_matrix):
+        return scipy.sparse.diags(1/row_sums) @ transition_matrix
+    return transition_matrix/row_sums[:, None]
+
+class _Unloaded:
+    """
+    Placeholder of a MSM not yet read from a models archive.
+    """
+    def __init__(self, index: int):
+        self.index = index
+
+class LazyModels(Models):
+    """
+    Models read from an indexed .npz archive (see save_file_npz).
+    Only the lagtime index is read when the archive is opened: each MSM is built from its transition matrix,
+    stationary distribution and count matrix the first time it is accessed.
+    """
+
+    def __init__(self, file_name: str):
+        self._file_name = file_name
+        self._archive = np.load(file_name)
+        self._index = self._archive['lagtimes']
+        list.__init__(self, [_Unloaded(i) for i in range(len(self._index))])
+        self.clear_cache()
+
+    def _materialize(self, position: int) -> 'MarkovStateModelCollection':
+        """
+        Build (once) the MSM stored at a position of the list.
+        """
+        from deeptime.markov import TransitionCountModel
+        from deeptime.markov.msm import MarkovStateModelCollection
+
+        item = list.__getitem__(self, position)
+        if isinstance(item, _Unloaded):
+            prefix = 'model_{}/'.format(item.index)
+            archive = self._archive
+            symbols = archive[prefix + 'state_symbols']
+            histogram = archive[prefix + 'state_histogram'] if prefix + 'state_histogram' in archive.files else None
+            histogram_full = archive[prefix + 'state_histogram_full'] if prefix + 'state_histogram_full' in archive.files else None
+            count_model = TransitionCountModel(_archived_matrix(archive, prefix + 'count_matrix'),
+                                               counting_mode=str(archive[prefix + 'counting_mode']),
+                                               lagtime=int(self._index[item.index]), state_histogram=histogram,
+                                               state_symbols=symbols,
+                                               count_matrix_full=_archived_matrix(archive, prefix + 'count_matrix_full'),
+                                               state_histogram_full=histogram_full)
+            item = MarkovStateModelCollection([_stochastic(_archived_matrix(archive, prefix + 'transition_matrix'))],
+                                              [archive[prefix + 'stationary_distribution']],
+                                              reversible=bool(archive[prefix + 'reversible']), count_models=[count_model],
+                                              transition_matrix_tolerance=float(archive[prefix + 'transition_matrix_tolerance']))
+            list.__setitem__(self, position, item)
+        return item
+
+    def materialize(self):
+        """
+        Build every MSM not yet read from the archive.
+        """
+        for position in range(len(self)):
+            self._materialize(position)
+
+    def lagtimes(self) -> np.ndarray:
+        """
+        Lagtimes of the MSMs, read from the archive index.
+
+        Returns
+        -------
+        np.ndarray
+            Array of lagtimes
+        """
+        if self._lagtimes is None:
+            self._lagtimes = np.array([self._index[item.index] if isinstance(item, _Unloaded) else item.lagtime
+                                       for item in list.__iter__(self)])
+        return self._lagtimes
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._materialize(position) for position in range(len(self))[index]]
+        return self._materialize(range(len(self))[index])
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self._materialize(position)
+
+    def __reversed__(self):
+        for position in reversed(range(len(self))):
+            yield self._materialize(position)
+
+    def __contains__(self, MSM):
+        self.materialize()
+        return super().__contains__(MSM)
+
+    def __reduce__(self):
+        return (LazyModels, (self._file_name,))
+
+    # methods comparing or returning stored elements need the MSMs
+    def index(self, MSM, *args):
+        self.materialize()
+        return super().index(MSM, *args)
+
+    def count(self, MSM):
+        self.materialize()
+        return super().count(MSM)
+
+    def copy(self):
+        return Models(list(self))
+
+    def pop(self, index=-1):
+        self._materialize(range(len(self))[index])
+        return super().pop(index)
+
+    def remove(self, MSM):
+        self.materialize()
+        super().remove(MSM)
+
+    def sort(self, *args, **kwargs):
+        self.materialize()
+        super().sort(*args, **kwargs)
+
 class Centers(ndarray):
 
     def __new__(cls, centers_array):
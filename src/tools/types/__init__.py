@@ -1 +1 @@
-from .Types import Models, Centers, DTrajectory, Trajectory
\ No newline at end of file
+from .Types import Models, LazyModels, Centers, DTrajectory, Trajectory
\ No newline at end of file
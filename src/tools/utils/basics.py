@@ -1,13 +1,18 @@
 """
 Command used to load files.
 """
-# Only binary files are supported for now. Module pickle is used for loading
+# Binary files are supported. Module pickle is used for loading Models and Centers,
+# while Trajectory and DTrajectory can be also stored as memory-mapped .npy files
+# and Models as indexed .npz archives read lazily
 import pickle as pkl
 from typing import Union
 import os
 import sys
 
-from src.tools.types import Models, Centers, Trajectory, DTrajectory
+import numpy as np
+
+from src.tools.types import Models, LazyModels, Centers, Trajectory, DTrajectory
+from src.tools.types.Types import archive_matrix
 from .errors import ConversionError
 
 def check_models_centers(models: Models, centers: Centers):
@@ -27,6 +32,8 @@ def check_models_centers(models: Models, centers: Centers):
 def load_file(file_name: str, type: Union[Models, Centers, Trajectory, DTrajectory], interactive_mode: bool = False) -> Union[Models, Centers, Trajectory, DTrajectory]:
     """
     Load a file from .pkl format and convert it into the specific type (Models, Centers, Trajectory, DTrajectory).
+    Trajectory and DTrajectory can be also loaded from .npy format (see save_file_npy),
+    Models from an indexed .npz archive (see save_file_npz): MSMs are then read only when accessed.
 
     Parameters
     ----------
@@ -60,12 +67,17 @@ def load_file(file_name: str, type: Union[Models, Centers, Trajectory, DTrajecto
             raise FileNotFoundError(msg)
     else:
         print('\nLoading file {}'.format(file_name))
-        with open(file_name, 'rb') as file:
-            data = pkl.load(file)
+        if file_name.endswith('.npy') and type in (Trajectory, DTrajectory):
+            data = load_file_npy(file_name)
+        elif file_name.endswith('.npz') and type is Models:
+            data = LazyModels(file_name)
+        else:
+            with open(file_name, 'rb') as file:
+                data = pkl.load(file)
 
         #conversion
         try:
-            converted_data = type(data)
+            converted_data = data if isinstance(data, type) else type(data)
             print('{} loaded.\n'.format(file_name))
             return converted_data
         
@@ -118,4 +130,115 @@ def save_file_pkl(obj, filename:str):
     
     with open(filename, 'wb') as f:
         pkl.dump(obj, f)
-    
\ No newline at end of file
+
+def save_file_npz(models: Models, filename: str, sparse: bool = False, precision: str = 'float64'):
+    """
+    Save Models in an indexed .npz archive.
+    For each MSM the transition matrix, the stationary distribution and the count model arrays are stored separately,
+    together with an index of the lagtimes: the archive can be loaded lazily (see LazyModels).
+
+    Parameters
+    ----------
+    models : Models
+        List of MSMs to save
+    filename : str
+        Name of the .npz file
+    sparse : bool, optional
+        If true, count and transition matrices are stored in sparse (CSR) format, by default False
+    precision : str, optional
+        Storage precision of count and transition matrices, 'float64' or 'float32', by default 'float64'
+    """
+
+    dtype = np.dtype(precision)
+    arrays = {'lagtimes': np.array([MSM.lagtime for MSM in models])}
+    for i, MSM in enumerate(models):
+        prefix = 'model_{}/'.format(i)
+        count_model = MSM.count_model
+        archive_matrix(arrays, prefix + 'transition_matrix', MSM.transition_matrix, sparse=sparse, dtype=dtype)
+        arrays[prefix + 'stationary_distribution'] = np.asarray(MSM.stationary_distribution)
+        arrays[prefix + 'reversible'] = np.array(MSM.reversible)
+        arrays[prefix + 'transition_matrix_tolerance'] = np.array(MSM.transition_matrix_tolerance)
+        archive_matrix(arrays, prefix + 'count_matrix', count_model.count_matrix, sparse=sparse, dtype=dtype)
+        arrays[prefix + 'counting_mode'] = np.array(str(count_model.counting_mode))
+        arrays[prefix + 'state_symbols'] = np.asarray(count_model.state_symbols)
+        if count_model.count_matrix_full is not None:
+            archive_matrix(arrays, prefix + 'count_matrix_full', count_model.count_matrix_full, sparse=sparse, dtype=dtype)
+        if count_model.state_histogram is not None:
+            arrays[prefix + 'state_histogram'] = np.asarray(count_model.state_histogram)
+        if count_model.state_histogram_full is not None:
+            arrays[prefix + 'state_histogram_full'] = np.asarray(count_model.state_histogram_full)
+
+    np.savez(filename, **arrays)
+
+def _offsets_file_name(filename: str) -> str:
+    """
+    Name of the offsets index file of a .npy trajectory file.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the .npy trajectory file
+
+    Returns
+    -------
+    str
+        Name of the offsets index file
+    """
+    return os.path.splitext(filename)[0] + '_offsets.npy'
+
+def save_file_npy(segments: Union[Trajectory, DTrajectory], filename: str):
+    """
+    Save a Trajectory or a DTrajectory in .npy format.
+    Segments are written one after the other in a single contiguous .npy file, 
+    while the first and last frame of each segment are saved in an offsets index file ('name_offsets.npy').
+
+    Parameters
+    ----------
+    segments : Union[Trajectory, DTrajectory]
+        Trajectory or discretized trajectory to save
+    filename : str
+        Name of the .npy file where to save the segments
+    """
+
+    lengths = [len(segment) for segment in segments]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+    # write segments directly in the memory-mapped file
+    shape = (int(offsets[-1]),) + segments[0].shape[1:]
+    data = np.lib.format.open_memmap(filename, mode='w+', dtype=segments[0].dtype, shape=shape)
+    for i, segment in enumerate(segments):
+        data[offsets[i]:offsets[i+1]] = segment
+    data.flush()
+    del data
+
+    np.save(_offsets_file_name(filename), offsets)
+
+def load_file_npy(filename: str) -> list:
+    """
+    Load segments saved with save_file_npy.
+    Data are memory-mapped, so segments are read from disk only when accessed.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the .npy file
+
+    Returns
+    -------
+    list
+        List of memory-mapped segments
+
+    Raises
+    ------
+    FileNotFoundError
+        The offsets index file was not found.
+    """
+
+    offsets_file = _offsets_file_name(filename)
+    if not os.path.exists(offsets_file):
+        raise FileNotFoundError('\nWarning! Offsets file {} does not exist.\n'.format(offsets_file))
+
+    data = np.load(filename, mmap_mode='r')
+    offsets = np.load(offsets_file)
+
+    return [data[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
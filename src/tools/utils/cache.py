@@ -0,0 +1,234 @@
+"""
+Persistent content-addressed cache of analysis results
+"""
+import os
+import sys
+import hashlib
+import threading
+import functools
+import pickle as pkl
+
+from typing import Any, Tuple
+
+from .output import capture_output
+
+# digests of the loaded files: (path, size, mtime) --> sha256
+_digests = {}
+
+def file_digest(file_name: str) -> str:
+    """
+    Compute the sha256 digest of the content of a file.
+    Digests are memoized until the file size or modification time change.
+
+    Parameters
+    ----------
+    file_name : str
+        File name
+
+    Returns
+    -------
+    str
+        Hexadecimal digest of the file content
+    """
+
+    stat = os.stat(file_name)
+    key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns)
+    if key not in _digests:
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        _digests[key] = digest.hexdigest()
+
+    return _digests[key]
+
+
+class ResultCache:
+    """
+    On-disk cache of analysis results.
+    Each entry stores the returned value, the resulting state and the printed output of a command
+    and is addressed by the digest of the command inputs. Least recently used entries are evicted
+    when the cache exceeds its maximum size.
+    """
+
+    def __init__(self, cache_dir: str = '.msm_cache', max_size_mb: float = 1024, enabled: bool = False):
+        """
+        Parameters
+        ----------
+        cache_dir : str, optional
+            Directory of the cache entries, by default '.msm_cache'
+        max_size_mb : float, optional
+            Maximum size of the cache in MB, by default 1024
+        enabled : bool, optional
+            True if the cache is used, by default False
+        """
+
+        self.cache_dir = cache_dir
+        self.max_size_mb = max_size_mb
+        self.enabled = enabled
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        Digest of the inputs of a command.
+
+        Returns
+        -------
+        str
+            Hexadecimal sha256 digest
+        """
+
+        return hashlib.sha256(pkl.dumps(parts, protocol=4)).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Look up an entry.
+
+        Parameters
+        ----------
+        key : str
+            Entry key
+
+        Returns
+        -------
+        Tuple[bool, Any]
+            True and the stored entry if found, False and None otherwise
+        """
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                entry = pkl.load(file)
+        except (OSError, EOFError, pkl.UnpicklingError):
+            return False, None
+
+        # mark as recently used
+        os.utime(path)
+        return True, entry
+
+    def put(self, key: str, entry: Any):
+        """
+        Store an entry and evict the least recently used ones if the cache is full.
+
+        Parameters
+        ----------
+        key : str
+            Entry key
+        entry : Any
+            Picklable entry
+        """
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(temp_path, 'wb') as file:
+            pkl.dump(entry, file, protocol=4)
+        os.replace(temp_path, path)
+        self._evict()
+
+    def _entries(self):
+        """
+        Cache entries as (mtime, size, path), least recently used first.
+        """
+
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # evicted meanwhile by a concurrent command
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        return sorted(entries)
+
+    def _evict(self):
+        """
+        Remove least recently used entries until the cache fits its maximum size.
+        """
+
+        entries = self._entries()
+        size = sum(entry[1] for entry in entries)
+        while entries and size > self.max_size_mb*1024**2:
+            _, entry_size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def clear(self):
+        """
+        Remove every cache entry.
+        """
+
+        entries = self._entries()
+        for _, _, path in entries:
+            os.remove(path)
+        print('Removed {} cache entries from {}.'.format(len(entries), self.cache_dir))
+
+    def info(self):
+        """
+        Print cache status and size.
+        """
+
+        entries = self._entries()
+        size = sum(entry[1] for entry in entries)/1024**2
+        print('Cache is {}.'.format('on' if self.enabled else 'off'))
+        print('Directory: {}'.format(self.cache_dir))
+        print('Entries: {} ({:.2f} MB of {:.0f} MB)'.format(len(entries), size, self.max_size_mb))
+
+
+def cached(*state: str):
+    """
+    Decorator caching a System method in the system result cache.
+    The method result, the listed attributes and the printed output are stored, and replayed when the
+    same command is executed again on the same inputs. Calls saving files (file_name argument) are not cached.
+
+    Parameters
+    ----------
+    state : str
+        Attributes of the system set by the method
+    """
+
+    def decorator(method):
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+
+            if not self.cache.enabled or kwargs.get('file_name') is not None:
+                return method(self, *args, **kwargs)
+
+            key = self._cache_key(method.__name__, args, kwargs)
+            if key is None:
+                return method(self, *args, **kwargs)
+
+            found, entry = self.cache.get(key)
+            if found:
+                sys.stdout.write(entry['output'])
+                for attribute, value in entry['state'].items():
+                    setattr(self, attribute, value)
+                return entry['result']
+
+            with capture_output(passthrough=True) as record:
+                result = method(self, *args, **kwargs)
+
+            entry = {'result': result, 'state': {attribute: getattr(self, attribute) for attribute in state},
+                     'output': ''.join(record)}
+            try:
+                self.cache.put(key, entry)
+            except (OSError, pkl.PicklingError, TypeError, AttributeError) as e:
+                print('Warning! Result could not be cached: {}'.format(e))
+
+            return result
+
+        return wrapper
+
+    return decorator
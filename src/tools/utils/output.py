@@ -0,0 +1,75 @@
+"""
+Per-thread capture of the printed output
+"""
+import sys
+import threading
+import contextlib
+
+from typing import List
+
+
+class _ThreadStdout:
+    """
+    Standard output dispatching what each thread writes to the capture buffers opened by that thread.
+    Writes of threads without captures (or with pass-through captures only) reach the original stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    @property
+    def captures(self) -> list:
+        if not hasattr(self._local, 'captures'):
+            self._local.captures = []
+        return self._local.captures
+
+    def write(self, text: str):
+        for record, passthrough in reversed(self.captures):
+            record.append(text)
+            if not passthrough:
+                return len(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+_install_lock = threading.Lock()
+
+def _thread_stdout() -> _ThreadStdout:
+    """
+    Install the per-thread standard output (once) and return it.
+    """
+
+    with _install_lock:
+        if not isinstance(sys.stdout, _ThreadStdout):
+            sys.stdout = _ThreadStdout(sys.stdout)
+        return sys.stdout
+
+@contextlib.contextmanager
+def capture_output(passthrough: bool = False):
+    """
+    Capture what the current thread prints. Captures can be nested and other threads are not affected.
+
+    Parameters
+    ----------
+    passthrough : bool, optional
+        If true, the output is recorded and also written to the enclosing capture (or to the standard output),
+        by default False
+
+    Yields
+    ------
+    List[str]
+        Recorded text
+    """
+
+    stdout = _thread_stdout()
+    record: List[str] = []
+    stdout.captures.append((record, passthrough))
+    try:
+        yield record
+    finally:
+        stdout.captures.pop()
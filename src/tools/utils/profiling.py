@@ -0,0 +1,217 @@
+"""
+Profiling of the executed commands: wall time, CPU time, memory and optional cProfile statistics
+"""
+import os
+import json
+import time
+import resource
+import threading
+import tracemalloc
+import contextlib
+import cProfile
+
+from tabulate import tabulate
+from typing import Optional, Sequence
+
+# profiling settings and records of the executed commands
+_settings = {'enabled': False, 'memory': True, 'cprofile': False, 'trace_file': 'msm_trace.json', 'out_dir': 'profiles'}
+_records = []
+_origin = time.perf_counter()
+# memory tracing is shared by the commands running concurrently (batch mode)
+_tracing = {'lock': threading.Lock(), 'users': 0}
+# records of the running commands: CPU time and memory peak of overlapping commands include each other
+_running = {'lock': threading.Lock(), 'records': []}
+# cProfile supports a single active profiler: concurrent commands are not profiled
+_cprofile_lock = threading.Lock()
+
+def set_profiling(enabled: Optional[bool] = None, memory: Optional[bool] = None, cprofile: Optional[bool] = None,
+                  trace_file: Optional[str] = None, out_dir: Optional[str] = None):
+    """
+    Set the profiling of the executed commands.
+
+    Parameters
+    ----------
+    enabled : Optional[bool], optional
+        If true, every command is profiled, by default None (unchanged)
+    memory : Optional[bool], optional
+        If true, the peak of Python and NumPy allocations is traced (slows down execution), by default None (unchanged)
+    cprofile : Optional[bool], optional
+        If true, cProfile statistics of each command are saved, by default None (unchanged)
+    trace_file : Optional[str], optional
+        Output file of the Chrome trace, by default None (unchanged)
+    out_dir : Optional[str], optional
+        Output directory of cProfile statistics, by default None (unchanged)
+    """
+
+    if memory is not None:
+        _settings['memory'] = memory
+    if cprofile is not None:
+        _settings['cprofile'] = cprofile
+    if trace_file is not None:
+        _settings['trace_file'] = trace_file
+    if out_dir is not None:
+        _settings['out_dir'] = out_dir
+
+    if enabled is None:
+        return
+    _settings['enabled'] = enabled
+    if enabled:
+        print('Profiling is on (memory tracing {}, cProfile {}).'.format('on' if _settings['memory'] else 'off',
+                                                                         'on' if _settings['cprofile'] else 'off'))
+    else:
+        print('Profiling is off.')
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+@contextlib.contextmanager
+def profiled(command_line: Sequence[str]):
+    """
+    Context manager recording the cost of a command, if profiling is on.
+
+    Parameters
+    ----------
+    command_line : Sequence[str]
+        Executed command line
+    """
+
+    # the profile command itself is not recorded
+    if not _settings['enabled'] or command_line[0] == 'profile':
+        yield
+        return
+
+    record = {'command': ' '.join(command_line), 'name': command_line[0]}
+    memory = _settings['memory']
+    profile = cProfile.Profile() if _settings['cprofile'] and _cprofile_lock.acquire(blocking=False) else None
+
+    rss = _max_rss_mb()
+    if memory:
+        with _tracing['lock']:
+            if _tracing['users'] == 0:
+                memory = not tracemalloc.is_tracing()
+                if memory:
+                    tracemalloc.start()
+            if memory:
+                _tracing['users'] += 1
+    # process CPU time includes the worker threads of the command, and those of the commands running concurrently
+    with _running['lock']:
+        if _running['records']:
+            record['concurrent'] = True
+            for running in _running['records']:
+                running['concurrent'] = True
+        _running['records'].append(record)
+    if profile is not None:
+        profile.enable()
+    start, cpu = time.perf_counter(), time.process_time()
+
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        record['cpu_s'] = time.process_time() - cpu
+        with _running['lock']:
+            _running['records'] = [running for running in _running['records'] if running is not record]
+        if profile is not None:
+            profile.disable()
+            _cprofile_lock.release()
+        if memory:
+            with _tracing['lock']:
+                record['peak_mb'] = tracemalloc.get_traced_memory()[1]/1024**2
+                _tracing['users'] -= 1
+                if _tracing['users'] == 0:
+                    tracemalloc.stop()
+
+        record['thread'] = threading.current_thread().name
+        record['start_s'] = start - _origin
+        record['wall_s'] = end - start
+        record['rss_delta_mb'] = _max_rss_mb() - rss
+
+        if profile is not None:
+            os.makedirs(_settings['out_dir'], exist_ok=True)
+            record['profile'] = os.path.join(_settings['out_dir'], '{:03d}_{}.prof'.format(len(_records), record['name']))
+            profile.dump_stats(record['profile'])
+
+        _records.append(record)
+
+def write_trace(file_name: str):
+    """
+    Write the profiled commands as a Chrome trace (chrome://tracing, Perfetto).
+
+    Parameters
+    ----------
+    file_name : str
+        Output JSON file
+    """
+
+    pid = os.getpid()
+    # a track for each thread executing commands
+    tids = {}
+    events = []
+    for record in _records:
+        tid = tids.setdefault(record.get('thread'), len(tids))
+        args = {key: value for key, value in record.items() if key not in ('name', 'start_s', 'wall_s', 'thread')}
+        events.append({'name': record['name'], 'cat': 'command', 'ph': 'X', 'pid': pid, 'tid': tid,
+                       'ts': record['start_s']*1e6, 'dur': record['wall_s']*1e6, 'args': args})
+        if 'peak_mb' in record:
+            events.append({'name': 'peak memory (MB)', 'ph': 'C', 'pid': pid, 'tid': tid,
+                           'ts': record['start_s']*1e6, 'args': {'peak': record['peak_mb']}})
+
+    with open(file_name, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+def profiling_report():
+    """
+    Print the summary of the profiled commands and write the Chrome trace.
+    Reported records are discarded.
+    """
+
+    if not _records:
+        return
+
+    total = sum(record['wall_s'] for record in _records)
+    table = [[i, record['command'] + (' *' if record.get('concurrent') else ''), record['wall_s'], record['cpu_s'],
+              record.get('peak_mb', '-'), record['rss_delta_mb'], 100*record['wall_s']/total if total > 0 else 0]
+             for i, record in enumerate(_records)]
+
+    print('\n### Profiling summary ###')
+    print(tabulate(table, headers=['#', 'Command', 'Wall (s)', 'CPU (s)', 'Peak mem (MB)', 'RSS delta (MB)', 'Wall %'],
+                   floatfmt='.3f'))
+    print('Total wall time: {:.3f} s'.format(total))
+    if any(record.get('concurrent') for record in _records):
+        print('* ran concurrently with other commands: CPU time and memory peak include theirs.')
+
+    try:
+        write_trace(_settings['trace_file'])
+        print('Trace saved in {}.'.format(_settings['trace_file']))
+    except OSError as e:
+        print('Warning! Trace could not be saved: {}'.format(e))
+    if _settings['cprofile']:
+        print('cProfile statistics saved in {} (e.g. python -m pstats FILE).'.format(_settings['out_dir']))
+
+    _records.clear()
+
+@contextlib.contextmanager
+def profiling_session(trace_file: str, out_dir: str):
+    """
+    Profile a run on its own: its records are reported at the end, with its own Chrome trace and cProfile directory.
+    The profiling settings changed by the run (e.g. with 'profile') are restored, so that runs sharing the process
+    do not affect each other.
+
+    Parameters
+    ----------
+    trace_file : str
+        Output file of the Chrome trace of the run
+    out_dir : str
+        Output directory of the cProfile statistics of the run
+    """
+
+    settings, records = dict(_settings), list(_records)
+    _records.clear()
+    _settings.update(trace_file=trace_file, out_dir=out_dir)
+    try:
+        yield
+    finally:
+        profiling_report()
+        _settings.update(settings)
+        _records[:] = records
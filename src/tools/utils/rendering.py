@@ -0,0 +1,153 @@
+"""
+Rendering of figures: on screen or off-screen (Agg) with export to file in a background thread
+"""
+import os
+import itertools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import List, Optional, Sequence
+
+# rendering settings
+_settings = {'headless': False, 'out_dir': '.', 'formats': ('png',), 'dpi': 150}
+_executor = None
+_pending = []
+_counter = itertools.count()
+
+def set_rendering(headless: bool, out_dir: Optional[str] = None, formats: Optional[Sequence[str]] = None,
+                  dpi: Optional[int] = None):
+    """
+    Set how figures are rendered.
+    In headless mode the Agg backend is used and figures are saved to file by a background worker,
+    so that the next commands are executed while figures are written.
+
+    Parameters
+    ----------
+    headless : bool
+        If true, figures are saved to file instead of being shown
+    out_dir : Optional[str], optional
+        Output directory of the figures, by default None (unchanged)
+    formats : Optional[Sequence[str]], optional
+        File formats (e.g. png, svg, pdf), by default None (unchanged)
+    dpi : Optional[int], optional
+        Resolution of raster formats, by default None (unchanged)
+    """
+
+    if headless != _settings['headless']:
+        _switch_backend(headless)
+
+    _settings['headless'] = headless
+    if out_dir is not None:
+        _settings['out_dir'] = out_dir
+    if formats is not None:
+        _settings['formats'] = tuple(formats)
+    if dpi is not None:
+        _settings['dpi'] = dpi
+
+    if headless:
+        os.makedirs(_settings['out_dir'], exist_ok=True)
+        print('Figures will be saved in {} as {}.'.format(_settings['out_dir'], ', '.join(_settings['formats'])))
+    else:
+        print('Figures will be shown on screen.')
+
+def _switch_backend(headless: bool):
+    """
+    Switch pyplot to the Agg backend (headless) or back to the default one.
+    """
+
+    # matplotlib is imported by the first command handling figures
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    if headless:
+        plt.switch_backend('Agg')
+    else:
+        wait_rendering()
+        plt.switch_backend(matplotlib.rcParamsDefault['backend'])
+
+@contextlib.contextmanager
+def rendering_session(out_dir: str):
+    """
+    Render the figures of a run headless in its own directory, numbered from 0.
+    Queued figures are saved at the end, and the rendering settings changed by the run (e.g. with 'render')
+    are restored, so that runs sharing the process do not affect each other.
+
+    Parameters
+    ----------
+    out_dir : str
+        Output directory of the figures of the run
+    """
+
+    global _counter
+    settings, counter = dict(_settings), _counter
+    _counter = itertools.count()
+    try:
+        set_rendering(headless=True, out_dir=out_dir)
+        yield
+    finally:
+        wait_rendering()
+        if _settings['headless'] != settings['headless']:
+            _switch_backend(settings['headless'])
+        _settings.update(settings)
+        _counter = counter
+
+def _save_figure(fig, file_names: Sequence[str], dpi: int):
+    """
+    Save a figure in every requested format.
+    """
+
+    for file_name in file_names:
+        fig.savefig(file_name, dpi=dpi)
+
+    return file_names
+
+def render(fig, name: str):
+    """
+    Render a figure: show it on screen or queue its export to file.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        Figure to render
+    name : str
+        Name of the figure, used for the file names
+    """
+
+    global _executor
+    import matplotlib.pyplot as plt
+
+    if not _settings['headless']:
+        plt.show()
+        return
+
+    # the figure is detached from pyplot: only the worker uses it from now on
+    plt.close(fig)
+    index = next(_counter)
+    file_names = [os.path.join(_settings['out_dir'], '{:03d}_{}.{}'.format(index, name, fmt)) for fmt in _settings['formats']]
+
+    # a single worker: matplotlib drawing is not safe for concurrent figures
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1)
+    _pending.append(_executor.submit(_save_figure, fig, file_names, _settings['dpi']))
+
+def wait_rendering() -> List[str]:
+    """
+    Wait for the figures queued for export and report the saved files.
+
+    Returns
+    -------
+    List[str]
+        Saved files
+    """
+
+    saved = []
+    while _pending:
+        future = _pending.pop(0)
+        try:
+            file_names = future.result()
+            print('Figure saved in {}.'.format(', '.join(file_names)))
+            saved.extend(file_names)
+        except Exception as e:
+            print('Warning! Figure could not be saved: {}'.format(e))
+
+    return saved
@@ -0,0 +1,110 @@
+"""
+Arrays shared with worker processes through shared memory blocks, so that they are not pickled for every job
+"""
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from typing import Dict, List, Sequence, Tuple
+
+
+class SharedArrays:
+    """
+    Arrays copied in shared memory blocks by the main process, which owns the blocks and unlinks them on exit.
+    Worker processes attach to the arrays with attach_arrays(shared.info).
+    """
+
+    def __init__(self):
+
+        self.blocks: List[SharedMemory] = []
+        # name, shape and dtype of each array
+        self.info: Dict[str, Tuple[str, tuple, str]] = {}
+
+    def create(self, key: str, shape: Sequence[int], dtype) -> np.ndarray:
+        """
+        Allocate a shared array, to be filled by the caller.
+
+        Parameters
+        ----------
+        key : str
+            Name of the array
+        shape : Sequence[int]
+            Shape of the array
+        dtype : numpy dtype
+            Data type of the array
+
+        Returns
+        -------
+        np.ndarray
+            The shared array
+        """
+
+        shape, dtype = tuple(int(n) for n in shape), np.dtype(dtype)
+        shm = SharedMemory(create=True, size=max(int(np.prod(shape))*dtype.itemsize, 1))
+        self.blocks.append(shm)
+        self.info[key] = (shm.name, shape, dtype.str)
+
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    def share(self, key: str, array: np.ndarray) -> np.ndarray:
+        """
+        Copy an array in shared memory.
+
+        Parameters
+        ----------
+        key : str
+            Name of the array
+        array : np.ndarray
+            Array to share
+
+        Returns
+        -------
+        np.ndarray
+            The shared copy
+        """
+
+        array = np.asarray(array)
+        shared = self.create(key, array.shape, array.dtype)
+        shared[...] = array
+
+        return shared
+
+    def release(self):
+        """
+        Close and unlink the shared memory blocks.
+        """
+
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks, self.info = [], {}
+
+    def __enter__(self) -> 'SharedArrays':
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def attach_arrays(info: Dict[str, Tuple[str, tuple, str]]) -> Tuple[List[SharedMemory], Dict[str, np.ndarray]]:
+    """
+    Attach to arrays shared by the main process (e.g. in the initializer of worker processes).
+    The returned blocks must be kept alive as long as the arrays are used; they are unlinked by the main process.
+
+    Parameters
+    ----------
+    info : Dict[str, Tuple[str, tuple, str]]
+        Description of the shared arrays (SharedArrays.info)
+
+    Returns
+    -------
+    Tuple[List[SharedMemory], Dict[str, np.ndarray]]
+        The attached blocks and the arrays by name
+    """
+
+    blocks, arrays = [], {}
+    for key, (name, shape, dtype) in info.items():
+        shm = SharedMemory(name=name)
+        blocks.append(shm)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    return blocks, arrays
@@ -0,0 +1,39 @@
+"""
+Shared data of the tests: a metastable Markov chain and a trajectory sampled from it.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# the tests import the analysis modules from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deeptime.markov.msm import MarkovStateModel
+
+LAGTIMES = [1, 2, 3, 5]
+
+
+@pytest.fixture(scope='session')
+def transition_matrix() -> np.ndarray:
+    """
+    Reversible transition matrix of 9 microstates in 3 metastable sets.
+    """
+
+    rng = np.random.default_rng(7)
+    n_states, n_sets = 9, 3
+    blocks = np.arange(n_states) // (n_states // n_sets)
+    # symmetric weights give a reversible chain
+    weights = rng.uniform(0.5, 1.5, size=(n_states, n_states))
+    weights = (weights + weights.T)*np.where(blocks[:, None] == blocks[None, :], 1.0, 0.01)
+
+    return weights/weights.sum(axis=1, keepdims=True)
+
+@pytest.fixture(scope='session')
+def dtraj(transition_matrix) -> np.ndarray:
+    """
+    Discretized trajectory sampled from the transition matrix.
+    """
+
+    return MarkovStateModel(transition_matrix).simulate(20000, seed=11)
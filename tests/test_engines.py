@@ -0,0 +1,115 @@
+"""
+Regression tests of the estimation and analysis engines against their deeptime counterparts.
+"""
+import numpy as np
+import scipy.sparse
+import pytest
+
+from deeptime.markov import TransitionCountEstimator
+from deeptime.markov.msm import MarkovStateModel, MaximumLikelihoodMSM
+from deeptime.markov.tools.analysis import mfpt
+
+from src.generator.functions import count_transitions, fit_models
+from src.analysis.chapman_kolmogorov import chapman_kolmogorov
+from src.analysis.spectral import sparse_pcca
+from src.analysis.kinetics import mfpt_matrix, tpt_rate_matrix
+
+from conftest import LAGTIMES
+
+
+@pytest.fixture(scope='module')
+def models(dtraj):
+    """
+    Reference MSMs fitted by deeptime at every lagtime.
+    """
+
+    return [MaximumLikelihoodMSM().fit_fetch(TransitionCountEstimator(lagtime, 'sliding').fit_fetch(dtraj))
+            for lagtime in LAGTIMES]
+
+@pytest.fixture(scope='module')
+def msm(transition_matrix):
+
+    return MarkovStateModel(transition_matrix)
+
+def test_count_transitions(dtraj, transition_matrix):
+
+    count_matrices, histogram = count_transitions([dtraj], LAGTIMES, n_states=len(transition_matrix))
+
+    for count_matrix, lagtime in zip(count_matrices, LAGTIMES):
+        reference = TransitionCountEstimator(lagtime, 'sliding', n_states=len(transition_matrix)).fit_fetch(dtraj)
+        np.testing.assert_array_equal(count_matrix.toarray(), reference.count_matrix)
+    np.testing.assert_array_equal(histogram, np.bincount(dtraj, minlength=len(transition_matrix)))
+
+def test_count_transitions_segments(dtraj):
+
+    # transitions do not cross the boundaries of the segments
+    segments = [dtraj[:7000], dtraj[7000:]]
+    count_matrices, _ = count_transitions(segments, LAGTIMES)
+
+    for count_matrix, lagtime in zip(count_matrices, LAGTIMES):
+        reference = TransitionCountEstimator(lagtime, 'sliding').fit_fetch(segments)
+        np.testing.assert_array_equal(count_matrix.toarray(), reference.count_matrix)
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_fit_models(dtraj, models, sparse):
+
+    count_matrices, histogram = count_transitions([dtraj], LAGTIMES)
+    fitted = fit_models(count_matrices, LAGTIMES, histogram, sparse=sparse)
+
+    for model, reference in zip(fitted, models):
+        assert model.lagtime == reference.lagtime
+        transition_matrix = model.transition_matrix.toarray() if sparse else model.transition_matrix
+        np.testing.assert_allclose(transition_matrix, reference.transition_matrix, atol=1e-8)
+        np.testing.assert_allclose(model.stationary_distribution, reference.stationary_distribution, atol=1e-8)
+
+def test_chapman_kolmogorov(models):
+
+    test_models = [models[0], models[2]]
+    ck_tests = chapman_kolmogorov(models, test_models, 3)
+
+    for ck_test, test_model in zip(ck_tests, test_models):
+        reference = test_model.ck_test(models, 3)
+        np.testing.assert_array_equal(ck_test.lagtimes, reference.lagtimes)
+        np.testing.assert_allclose(ck_test.predictions, reference.predictions, atol=1e-8)
+        np.testing.assert_allclose(ck_test.estimates, reference.estimates, atol=1e-8)
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_sparse_pcca(msm, sparse):
+
+    transition_matrix = scipy.sparse.csr_matrix(msm.transition_matrix) if sparse else msm.transition_matrix
+    memberships, assignments, distribution = sparse_pcca(transition_matrix, msm.stationary_distribution, 3)
+    reference = msm.pcca(3)
+
+    # macrostates are compared up to their order
+    order = [int(np.argmax(np.abs(reference.memberships.T @ column))) for column in memberships.T]
+    assert sorted(order) == [0, 1, 2]
+    np.testing.assert_allclose(memberships, reference.memberships[:, order], atol=1e-6)
+    np.testing.assert_array_equal(np.asarray(order)[assignments], reference.assignments)
+    np.testing.assert_allclose(distribution, reference.coarse_grained_stationary_probability[order], atol=1e-6)
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_mfpt_matrix(msm, sparse):
+
+    transition_matrix = scipy.sparse.csr_matrix(msm.transition_matrix) if sparse else msm.transition_matrix
+    targets = [0, 4, 8]
+    mfpts = mfpt_matrix(transition_matrix, msm.stationary_distribution, targets=targets)
+
+    reference = np.stack([mfpt(msm.transition_matrix, target) for target in targets], axis=1)
+    np.testing.assert_allclose(mfpts, reference, rtol=1e-8)
+
+@pytest.mark.parametrize('reversible', [False, True])
+@pytest.mark.parametrize('sparse', [False, True])
+def test_tpt_rate_matrix(msm, reversible, sparse):
+
+    transition_matrix = scipy.sparse.csr_matrix(msm.transition_matrix) if sparse else msm.transition_matrix
+    sets = [[0, 1, 2], [3, 4], [6, 7, 8]]
+    kinetics = tpt_rate_matrix(transition_matrix, msm.stationary_distribution, sets, reversible=reversible)
+
+    for a, A in enumerate(sets):
+        for b, B in enumerate(sets):
+            if a == b:
+                continue
+            reference = msm.reactive_flux(A, B)
+            np.testing.assert_allclose(kinetics['rate'][a, b], reference.rate, rtol=1e-8)
+            np.testing.assert_allclose(kinetics['mfpt'][a, b], reference.mfpt, rtol=1e-8)
+            np.testing.assert_allclose(kinetics['flux'][a, b], reference.total_flux, rtol=1e-8)